@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import pandas as pd
+
+# Checkpoints are stored as checkpoints/<run_id>/<stage>-<input fingerprint>/<table>.parquet
+checkpoint_directory = 'checkpoints'
+
+# State of the latest run started by run_all.py, used to resume it after a failure. Sample runs (run_all.py --sample)
+# keep their own state, so they never resume a failed production run or mark it completed.
+run_state_file = 'last_run.json'
+sample_run_state_file = 'last_run_sample.json'
+
+
+def current_run_id():
+    # run_all.py passes the same run ID to every script of a run (and the ID of the failed run when resuming it);
+    # a script started on its own gets a new run ID, so it never picks up the checkpoints of another run
+    return os.getenv('run_id') or datetime.now().strftime('%Y%m%d-%H%M%S')
+
+
+def input_fingerprint(*inputs):
+    """
+    This function summarizes the inputs of a stage with a short content hash. DataFrames are hashed row by row with
+    their index, columns and dtypes, any other input (e.g. a query) through its text, so a checkpoint is only reused
+    when the stage would receive exactly the same inputs.
+
+    Args:
+    - inputs (pandas.DataFrame or str): The inputs of the stage.
+
+    Returns:
+    - str: The fingerprint (16 hexadecimal characters).
+    """
+    digest = hashlib.sha256()
+    for item in inputs:
+        if isinstance(item, pd.DataFrame):
+            digest.update(json.dumps([[str(column), str(dtype)] for column, dtype in item.dtypes.items()]).encode())
+            digest.update(pd.util.hash_pandas_object(item, index=True).to_numpy().tobytes())
+        else:
+            digest.update(str(item).encode())
+    return digest.hexdigest()[:16]
+
+
+def _stage_directory(stage, fingerprint, run_id, directory):
+    return os.path.join(directory, run_id, f'{stage}-{fingerprint}')
+
+
+def load_checkpoint(stage, fingerprint, run_id=None, directory=checkpoint_directory):
+    """
+    This function loads the output of a stage saved earlier in the same run for the same inputs.
+
+    Args:
+    - stage (str): The name of the stage.
+    - fingerprint (str): The fingerprint of the inputs of the stage, see `input_fingerprint`.
+    - run_id (str, optional): The run the checkpoint belongs to. Defaults to `current_run_id()`.
+    - directory (str): The root directory of the checkpoints.
+
+    Returns:
+    - dict: {table name: DataFrame}, or None if the stage has no checkpoint and must be run.
+    """
+    stage_directory = _stage_directory(stage, fingerprint, run_id or current_run_id(), directory)
+    if not os.path.isdir(stage_directory):
+        return None
+    tables = {file_name[:-len('.parquet')]: pd.read_parquet(os.path.join(stage_directory, file_name))
+              for file_name in sorted(os.listdir(stage_directory)) if file_name.endswith('.parquet')}
+    print(f"Resuming from checkpoint: {stage}")
+    return tables
+
+
+def save_checkpoint(stage, fingerprint, tables, run_id=None, directory=checkpoint_directory):
+    """
+    This function saves the output of a completed stage as Parquet files (one per table). The files are written to a
+    temporary directory that is renamed at the end, so a run that fails while saving never leaves a partial
+    checkpoint behind.
+
+    Args:
+    - stage (str): The name of the stage.
+    - fingerprint (str): The fingerprint of the inputs of the stage, see `input_fingerprint`.
+    - tables (dict): {table name: DataFrame} holding everything later stages need from this one.
+    - run_id (str, optional): The run the checkpoint belongs to. Defaults to `current_run_id()`.
+    - directory (str): The root directory of the checkpoints.
+    """
+    stage_directory = _stage_directory(stage, fingerprint, run_id or current_run_id(), directory)
+    temporary_directory = f'{stage_directory}.tmp'
+    shutil.rmtree(temporary_directory, ignore_errors=True)
+    os.makedirs(temporary_directory)
+    for name, table in tables.items():
+        table.to_parquet(os.path.join(temporary_directory, f'{name}.parquet'))
+    shutil.rmtree(stage_directory, ignore_errors=True)
+    os.replace(temporary_directory, stage_directory)
+
+
+def start_run(resume=True, directory=checkpoint_directory, state_file=run_state_file):
+    """
+    This function returns the run ID of a new run of run_all.py. If the previous run failed (or was interrupted) and
+    `resume` is True, its run ID is reused, so every stage it completed is loaded from its checkpoint instead of
+    being run again.
+
+    Args:
+    - resume (bool): Whether a failed run is resumed.
+    - directory (str): The root directory of the checkpoints.
+    - state_file (str): The run state file, `run_state_file` or `sample_run_state_file`.
+
+    Returns:
+    - str: The run ID to pass to the scripts.
+    """
+    state_path = os.path.join(directory, state_file)
+    run_id = None
+    if resume and os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        if state['status'] != 'completed' and os.path.isdir(os.path.join(directory, state['run_id'])):
+            run_id = state['run_id']
+    if run_id is None:
+        run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+    _write_run_state(run_id, 'running', directory, state_file)
+    return run_id
+
+
+def finish_run(run_id, succeeded, directory=checkpoint_directory, state_file=run_state_file):
+    # Record the outcome of the run: a failed run is resumed by the next call of start_run with the same state file
+    _write_run_state(run_id, 'completed' if succeeded else 'failed', directory, state_file)
+
+
+def _write_run_state(run_id, status, directory, state_file):
+    os.makedirs(os.path.join(directory, run_id), exist_ok=True)
+    temporary_path = os.path.join(directory, f'{state_file}.tmp')
+    with open(temporary_path, 'w') as f:
+        json.dump({'run_id': run_id, 'status': status, 'updated': datetime.now().isoformat()}, f)
+    os.replace(temporary_path, os.path.join(directory, state_file))
+
+
+def cleanup_checkpoints(keep_runs=3, max_age_days=7, directory=checkpoint_directory):
+    """
+    This function removes old checkpoints: only the `keep_runs` most recent runs are kept, and runs older than
+    `max_age_days` are removed as well. The runs recorded in the run states are never removed, so a failed run can
+    still be resumed.
+
+    Args:
+    - keep_runs (int): The number of most recent runs to keep.
+    - max_age_days (float): The age (since the last modification) after which a run is removed.
+    - directory (str): The root directory of the checkpoints.
+
+    Returns:
+    - list: The run IDs that were removed.
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    protected = set()
+    for state_file in (run_state_file, sample_run_state_file):
+        state_path = os.path.join(directory, state_file)
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                protected.add(json.load(f)['run_id'])
+
+    runs = sorted((entry for entry in os.scandir(directory) if entry.is_dir()),
+                  key=lambda entry: entry.stat().st_mtime, reverse=True)
+    oldest_kept = time.time() - max_age_days * 86400
+    removed = []
+    for rank, entry in enumerate(runs):
+        if entry.name not in protected and (rank >= keep_runs or entry.stat().st_mtime < oldest_kept):
+            shutil.rmtree(entry.path)
+            removed.append(entry.name)
+    return removed
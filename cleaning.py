@@ -1,7 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import calendar
 
 
 def explore_outliers(dataframe, column, number_of_bins, positive=True, negative=True):
@@ -50,6 +47,10 @@ def explore_outliers(dataframe, column, number_of_bins, positive=True, negative=
         Displays the histogram and whisker lines with annotations, but does not return any values.
     """
 
+    # Plotting libraries are imported here so that runs without plots never load them
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # Calculate quartiles and IQR
     q1 = dataframe[column].quantile(q=0.25)
     q3 = dataframe[column].quantile(q=0.75)
@@ -172,8 +173,8 @@ def day_components_calculation(dataframe, year_columns, month_columns, day_colum
         dataframe.loc[mask_30, f'x_comp_{day}'] = np.cos(2 * np.pi * dataframe.loc[mask_30, day] / 30)
         dataframe.loc[mask_30, f'y_comp_{day}'] = np.sin(2 * np.pi * dataframe.loc[mask_30, day] / 30)
 
-        # Check for leap year:
-        is_leap_year = dataframe[year].apply(lambda x: calendar.monthrange(x, 2)[1] == 29)
+        # Check for leap year (divisible by 4, except centuries not divisible by 400):
+        is_leap_year = (dataframe[year] % 4 == 0) & ((dataframe[year] % 100 != 0) | (dataframe[year] % 400 == 0))
 
         # Apply cyclical encoding for February in leap years (29 days):
         dataframe.loc[mask_february & is_leap_year, f'x_comp_{day}'] = np.cos(
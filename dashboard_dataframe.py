@@ -9,145 +9,379 @@ from sqlalchemy import create_engine
 import pandas as pd
 import numpy as np
 
+# Import the helpers that keep the run-over-run history of the KPIs
+from kpi_history import kpis_to_long, append_kpi_history
+
+# Import the helpers that derive the 7/30/90-day rolling KPIs from daily totals
+from rolling_kpis import daily_hotel_aggregates, rolling_kpis
+
+# Import the engine that spreads the bookings over their stay nights (occupancy, room revenue, RevPAR)
+from stay_nights import stay_night_totals, stay_night_totals_from_groups, occupancy_kpis
+
+# Import the mergeable quantile and distinct-count sketches used for the distribution KPIs
+from sketches import (
+    build_partition_sketches,  # Function to sketch the bookings per hotel and arrival month
+    stale_sketch_months,  # Function to list the months whose persisted sketches no longer match the published data
+    refresh_partition_sketches,  # Function to replace the sketches of the rebuilt months and keep the others
+    sketch_summary  # Function to merge the sketches into the distribution KPIs
+)
+
+# Import the accumulators used to compute the KPIs chunk by chunk in constant memory
+from kpi_accumulators import stream_kpi_totals, finalize_kpis, finalize_market_segments
+
+# Import the backend that lets the database compute the KPI totals, and its equivalence check with pandas
+from kpi_sql import sql_kpi_totals, sql_month_sketches, verify_sql_kpis
+
+# Import the stage checkpoints used to resume a failed run from its last completed stage
+from checkpoints import current_run_id, input_fingerprint, load_checkpoint, save_checkpoint
+
+# Import the sample mode helpers (sample-suffixed outputs and error margins of the sample KPIs)
+from sampling import (
+    current_sample_fraction,  # Function to read the fraction set by run_all.py --sample (None for a full run)
+    output_name,  # Function to add the sample suffix to the outputs in sample mode
+    stratum_counts_query,  # Function to build the query of the stratum sizes of hotel_booking
+    margin_source_columns,  # Columns of the dashboard data behind the error margins
+    sample_kpi_margins  # Function to estimate the KPIs of the full table with their error margins
+)
+
+# Import the export stage that writes size-capped files for the Looker Studio uploads
+from exports import export_tables, export_fingerprint, verify_export
+
+# Import the name of the table holding the per-month fingerprints of the published dashboard data
+from publishing import partition_metadata_table, partition_month
+
 # Suppress specific warning messages (e.g., deprecation or future warnings)
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 # =====================================================================================================================
+# KPIs OF THE PANDAS BACKEND
+def pandas_kpis(df):
+    """
+    This function computes the KPI table and the market segment table from the rows of dashboard_data held in memory
+    (the 'pandas' KPI backend), printing every KPI. It is also the reference the SQL backend is checked against.
+
+    Args:
+    - df (pandas.DataFrame): The dashboard data.
+
+    Returns:
+    - tuple: The one-row KPI table and the market segment table.
+    """
+    filter_city_hotel = df[df['hotel'] == 'City Hotel']
+    filter_resort_hotel = df[df['hotel'] == 'Resort Hotel']
+
+    total_obs = df.shape[0]
+    total_obs_city_hotel = df[df['hotel'] == 'City Hotel'].shape[0]
+    total_obs_resort_hotel = df[df['hotel'] == 'Resort Hotel'].shape[0]
+
+    # AVERAGE CANCELLATION RATE
+    avg_canc_rate = round(df['is_canceled'].mean() * 100, 2)
+    avg_canc_rate_city_hotel = round(filter_city_hotel['is_canceled'].mean() * 100, 2)
+    avg_canc_rate_resort_hotel = round(filter_resort_hotel['is_canceled'].mean() * 100, 2)
+    print(f"Average Cancellation Rate: {avg_canc_rate} %")
+    print(f"Average Cancellation Rate City Hotel: {avg_canc_rate_city_hotel} %")
+    print(f"Average Cancellation Rate Resort Hotel: {avg_canc_rate_resort_hotel} %")
+
+    # AVERAGE PREVIOUS CANCELLATION RATE
+    avg_previous_canc_rate = round(df['previous_cancellations'].mean() * 100, 2)
+    avg_previous_canc_rate_city_hotel = round(filter_city_hotel['previous_cancellations'].mean() * 100, 2)
+    avg_previous_canc_rate_resort_hotel = round(filter_resort_hotel['previous_cancellations'].mean() * 100, 2)
+    print(f"Average Previous Cancellation Rate: {avg_previous_canc_rate} %")
+    print(f"Average Previous Cancellation Rate City Hotel: {avg_previous_canc_rate_city_hotel} %")
+    print(f"Average Previous Cancellation Rate Resort Hotel: {avg_previous_canc_rate_resort_hotel} %")
+
+
+    # TOTAL REVENUE
+    total_revenue = round(df['adr'].sum())
+    total_revenue_city_hotel = round(filter_city_hotel['adr'].sum())
+    total_revenue_resort_hotel = round(filter_resort_hotel['adr'].sum())
+    print(f"Total Revenue: {total_revenue} €")
+    print(f"Total Revenue City Hotel: {total_revenue_city_hotel} €")
+    print(f"Total Revenue Resort Hotel: {total_revenue_resort_hotel} €")
+
+    # AVERAGE DAILY RATE
+    adr = round(df['adr'].mean(), 2)
+    adr_city_hotel = round(filter_city_hotel['adr'].mean(), 2)
+    adr_resort_hotel = round(filter_resort_hotel['adr'].mean(), 2)
+    print(f"Average Daily Rate: {adr} €")
+    print(f"Average Daily Rate City Hotel: {adr_city_hotel} €")
+    print(f"Average Daily Rate Resort Hotel: {adr_resort_hotel} €")
+
+    # AVERAGE LEAD TIME
+    avg_lead_time = round(df['lead_time'].mean(), 2)
+    avg_lead_time_city_hotel = round(filter_city_hotel['lead_time'].mean(), 2)
+    avg_lead_time_resort_hotel = round(filter_resort_hotel['lead_time'].mean(), 2)
+    print(f"Average Lead Time: {avg_lead_time} days")
+    print(f"Average Lead Time City Hotel: {avg_lead_time_city_hotel} days")
+    print(f"Average Lead TIme Resort Hotel: {avg_lead_time_resort_hotel} days")
+
+    # REVENUE PER GUEST
+    total_guests = df['adults'].sum() + df['total_kids'].sum()
+    total_guests_city_hotel = filter_city_hotel['adults'].sum() + filter_city_hotel['total_kids'].sum()
+    total_guests_resort_hotel = filter_resort_hotel['adults'].sum() + filter_resort_hotel['total_kids'].sum()
+
+    revpg = round(total_revenue / total_guests, 2)
+    revpg_city_hotel = round(total_revenue_city_hotel / total_guests_city_hotel, 2)
+    revpg_resort_hotel = round(total_revenue_resort_hotel / total_guests_resort_hotel, 2)
+    print(f"Average Revenue per Guest: {revpg} €")
+    print(f"Average Revenue per Guest City Hotel: {revpg_city_hotel} €")
+    print(f"Average Revenue per Guest Resort Hotel: {revpg_resort_hotel} €")
+
+    # LENGTH OF STAY
+    total_nights = df['stays_in_week_nights'].sum() + df['stays_in_weekend_nights'].sum()
+    total_nights_city_hotel = (filter_city_hotel['stays_in_week_nights'].sum() +
+                               filter_city_hotel['stays_in_weekend_nights'].sum())
+    total_nights_resort_hotel = (filter_resort_hotel['stays_in_week_nights'].sum() +
+                                 filter_resort_hotel['stays_in_weekend_nights'].sum())
+
+    length_of_stay = round(total_nights / total_obs, 2)
+    length_of_stay_city_hotel = round(total_nights_city_hotel / total_obs_city_hotel, 2)
+    length_of_stay_resort_hotel = round(total_nights_resort_hotel / total_obs_resort_hotel, 2)
+    print(f"Length of Stay: {length_of_stay} days")
+    print(f"Length of Stay City Hotel: {length_of_stay_city_hotel} days")
+    print(f"Length of Stay Resort Hotel: {length_of_stay_resort_hotel} days")
+
+    # BOOKINGS BY SOURCE (DATAFRAME)
+    values = df['market_segment'].value_counts().values
+    values_perc = np.round(100 * (values / total_obs), 2)
+    index = df['market_segment'].value_counts().keys()
+    # The counts of each hotel are aligned on the segments of the total counts
+    values_city_hotel = (df[df['hotel'] == 'City Hotel']['market_segment'].value_counts()
+                         .reindex(index, fill_value=0).values)
+    values_perc_city_hotel = np.round(100 * (values_city_hotel / total_obs_city_hotel), 2)
+    values_resort_hotel = (df[df['hotel'] == 'Resort Hotel']['market_segment'].value_counts()
+                           .reindex(index, fill_value=0).values)
+    values_perc_resort_hotel = np.round(100 * (values_resort_hotel / total_obs_resort_hotel), 2)
+
+    columns = ['Total Counts', 'Total Counts (%)', 'City Hotel Counts', 'City Hotel Counts (%)',
+               'Resort Hotel Counts', 'Resort Hotel Counts (%)']
+    data = list(zip(values, values_perc, values_city_hotel, values_perc_city_hotel, values_resort_hotel,
+                    values_perc_resort_hotel))
+
+    market_df = pd.DataFrame(index=index, data=data, columns=columns)
+    market_df.index.name = 'Market Segment'
+
+    # KPIs Summary Table (One-row DataFrame)
+    kpis = {
+        'Total Bookings': total_obs,
+        'Total Bookings City Hotel': total_obs_city_hotel,
+        'Total Bookings Resort Hotel': total_obs_resort_hotel,
+        'Cancellation Rate (%)': avg_canc_rate,
+        'Cancellation Rate City Hotel (%)': avg_canc_rate_city_hotel,
+        'Cancellation Rate Resort Hotel (%)': avg_canc_rate_resort_hotel,
+        'Previous Cancellation Rate (%)': avg_previous_canc_rate,
+        'Previous Cancellation Rate City Hotel (%)': avg_previous_canc_rate_city_hotel,
+        'Previous Cancellation Rate Resort Hotel (%)': avg_previous_canc_rate_resort_hotel,
+        'Total Revenue (€)': total_revenue,
+        'Total Revenue City Hotel (€)': total_revenue_city_hotel,
+        'Total Revenue Resort Hotel (€)': total_revenue_resort_hotel,
+        'ADR (€)': adr,
+        'ADR City Hotel (€)': adr_city_hotel,
+        'ADR Resort Hotel (€)': adr_resort_hotel,
+        'Average Lead Time (days)': avg_lead_time,
+        'Average Lead Time City Hotel (days)': avg_lead_time_city_hotel,
+        'Average Lead Time Resort Hotel (days)': avg_lead_time_resort_hotel,
+        'Revenue per Guest (€)': revpg,
+        'Revenue per Guest City Hotel (€)': revpg_city_hotel,
+        'Revenue per Guest Resort Hotel (€)': revpg_resort_hotel,
+        'Length of Stay (days)': length_of_stay,
+        'Length of Stay City Hotel (days)': length_of_stay_city_hotel,
+        'Length of Stay Resort Hotel (days)': length_of_stay_resort_hotel
+    }
+
+    kpis_df = pd.DataFrame([kpis])
+    return kpis_df, market_df
+# =====================================================================================================================
 # FETCH DATA FROM THE DATABASE
-username = os.getenv('postgresuser')
-password = os.getenv('password')
-host = os.getenv('host')
-port = os.getenv('port')
-db_name = os.getenv('db_name')
+def create_database_engine():
+    """
+    This function sets up the connection to the local PostgreSQL database from the credentials of the environment
+    (.env file).
+
+    Returns:
+    - sqlalchemy.engine.Engine: The engine of the database.
+    """
+    username = os.getenv('postgresuser')
+    password = os.getenv('password')
+    host = os.getenv('host')
+    port = os.getenv('port')
+    db_name = os.getenv('db_name')
+    return create_engine(f'postgresql://{username}:{password}@{host}:{port}/{db_name}')
+
 
 # Set up the connection to the local PostgreSQL database
-engine = create_engine(f'postgresql://{username}:{password}@{host}:{port}/{db_name}')
+engine = create_database_engine()
+
+# KPI BACKEND
+# 'pandas' loads the whole dashboard_data table in memory. 'streaming' reads it chunk by chunk and only keeps running
+# per-hotel totals and sketches (see kpi_accumulators.py), so memory stays constant whatever the size of the table.
+# 'sql' lets the database compute the grouped totals (see kpi_sql.py), so only a few dozen rows are transferred.
+kpi_backend = os.getenv('kpi_backend', 'pandas')
+kpi_chunksize = int(os.getenv('kpi_chunksize', '100000'))
+
+# With kpi_verify=1, the SQL and pandas backends are both run on dashboard_data and must agree
+kpi_verify = os.getenv('kpi_verify') == '1'
+
+# In sample mode (run_all.py --sample), the KPIs are computed on 'dashboard_data_sample' and written to '_sample' files
+sample_fraction = current_sample_fraction()
+dashboard_table = output_name('dashboard_data')
+
+# Fetch data from the 'dashboard_data' table
+query = f"SELECT * FROM {dashboard_table}"
+
+# KPI CHECKPOINT
+# The KPI tables are computed once per run for the same published data. The input fingerprint comes from the per-month
+# fingerprints that publishing.py stores next to dashboard_data, so the table itself is not read to build it.
+run_id = current_run_id()
+published_partitions = pd.read_sql(f"SELECT * FROM {partition_metadata_table(dashboard_table)} ORDER BY partition_name",
+                                   engine)
+kpi_key = input_fingerprint(kpi_backend, published_partitions)
+
+# The sketches of the distribution KPIs are persisted per hotel and arrival month: only the months whose published
+# fingerprint changed since their sketches were built are sketched again, the others are merged from disk.
+sketch_directory = output_name('sketches')
+month_fingerprints = dict(zip(published_partitions['partition_name'].map(partition_month),
+                              published_partitions['fingerprint']))
+stale_months = stale_sketch_months(month_fingerprints, sketch_directory)
+print(f"Months to sketch: {len(stale_months)} of {len(month_fingerprints)}")
+kpi_checkpoint = load_checkpoint('kpis', kpi_key, run_id)
+if kpi_checkpoint is not None:
+    kpis_df, market_df = kpi_checkpoint['kpis'], kpi_checkpoint['market_segments']
+    rolling_df, occupancy_df = kpi_checkpoint['rolling_kpis'], kpi_checkpoint['occupancy']
+    distribution_df = kpi_checkpoint['distribution_kpis']
+else:
+    if kpi_backend == 'streaming':
+        # A server-side cursor makes the database send the rows as they are consumed: without it, the driver would
+        # fetch the whole result before pandas returns the first chunk
+        with engine.connect().execution_options(stream_results=True) as connection:
+            accumulator = stream_kpi_totals(pd.read_sql(query, connection, chunksize=kpi_chunksize), stale_months)
+        kpis_df = finalize_kpis(accumulator['hotels'])
+        market_df = finalize_market_segments(accumulator['segments'])
+        daily_totals = accumulator['daily']
+        nightly_totals = accumulator['nights']
+        partition_sketches = refresh_partition_sketches(accumulator['sketches'], month_fingerprints, sketch_directory)
+        print(kpis_df.T.to_string(header=False))
+    elif kpi_backend == 'sql':
+        sql_totals = sql_kpi_totals(engine, dashboard_table)
+        kpis_df = finalize_kpis(sql_totals['hotels'])
+        market_df = finalize_market_segments(sql_totals['segments'])
+        daily_totals = sql_totals['daily']
+        nightly_totals = stay_night_totals_from_groups(sql_totals['stay_groups'])
+        # The sketches need the individual bookings: only those of the stale months are read, the other months are
+        # merged from disk
+        partition_sketches = refresh_partition_sketches(
+            sql_month_sketches(engine, stale_months, dashboard_table, kpi_chunksize), month_fingerprints,
+            sketch_directory)
+        print(kpis_df.T.to_string(header=False))
+    else:
+        df = pd.read_sql(query, engine)
+        kpis_df, market_df = pandas_kpis(df)
 
-# Fetch data from the 'hotel_booking' table
-query = "SELECT * FROM dashboard_data"
-df = pd.read_sql(query, engine)
+        # Totals behind the rolling, occupancy and distribution KPIs
+        daily_totals = daily_hotel_aggregates(df)
+        nightly_totals = stay_night_totals(df)
+        partition_sketches = refresh_partition_sketches(build_partition_sketches(df, months=stale_months),
+                                                        month_fingerprints, sketch_directory)
+
+    # Compare the SQL backend with the pandas backend on the same data, within rounding tolerance
+    if kpi_verify:
+        if kpi_backend == 'pandas':
+            expected_tables = {'kpis': kpis_df, 'market_segments': market_df, 'daily': daily_totals}
+        else:
+            df = pd.read_sql(query, engine)
+            expected_kpis_df, expected_market_df = pandas_kpis(df)
+            expected_tables = {'kpis': expected_kpis_df, 'market_segments': expected_market_df,
+                               'daily': daily_hotel_aggregates(df)}
+        kpi_differences = verify_sql_kpis(engine, expected_tables, dashboard_table)
+        if not kpi_differences.empty:
+            raise ValueError(f"SQL and pandas KPI backends disagree:\n{kpi_differences.to_string()}")
+        print("SQL and pandas KPI backends agree.")
+# =====================================================================================================================
+# ROLLING KPIs (7/30/90-day windows per hotel and arrival date, derived from cumulative daily totals)
+# The three tables below are also part of the KPI checkpoint: they are only computed when it was missing
+if kpi_checkpoint is None:
+    rolling_df = rolling_kpis(daily_totals)
 # =====================================================================================================================
-filter_city_hotel = df[df['hotel'] == 'City Hotel']
-filter_resort_hotel = df[df['hotel'] == 'Resort Hotel']
-
-total_obs = df.shape[0]
-total_obs_city_hotel = df[df['hotel'] == 'City Hotel'].shape[0]
-total_obs_resort_hotel = df[df['hotel'] == 'Resort Hotel'].shape[0]
-
-# AVERAGE CANCELLATION RATE
-avg_canc_rate = round(df['is_canceled'].mean() * 100, 2)
-avg_canc_rate_city_hotel = round(filter_city_hotel['is_canceled'].mean() * 100, 2)
-avg_canc_rate_resort_hotel = round(filter_resort_hotel['is_canceled'].mean() * 100, 2)
-print(f"Average Cancellation Rate: {avg_canc_rate} %")
-print(f"Average Cancellation Rate City Hotel: {avg_canc_rate_city_hotel} %")
-print(f"Average Cancellation Rate Resort Hotel: {avg_canc_rate_resort_hotel} %")
-
-# AVERAGE PREVIOUS CANCELLATION RATE
-avg_previous_canc_rate = round(df['previous_cancellations'].mean() * 100, 2)
-avg_previous_canc_rate_city_hotel = round(filter_city_hotel['previous_cancellations'].mean() * 100, 2)
-avg_previous_canc_rate_resort_hotel = round(filter_resort_hotel['previous_cancellations'].mean() * 100, 2)
-print(f"Average Previous Cancellation Rate: {avg_previous_canc_rate} %")
-print(f"Average Previous Cancellation Rate City Hotel: {avg_previous_canc_rate_city_hotel} %")
-print(f"Average Previous Cancellation Rate Resort Hotel: {avg_previous_canc_rate_resort_hotel} %")
-
-
-# TOTAL REVENUE
-total_revenue = round(df['adr'].sum())
-total_revenue_city_hotel = round(filter_city_hotel['adr'].sum())
-total_revenue_resort_hotel = round(filter_resort_hotel['adr'].sum())
-print(f"Total Revenue: {total_revenue} €")
-print(f"Total Revenue City Hotel: {total_revenue_city_hotel} €")
-print(f"Total Revenue Resort Hotel: {total_revenue_resort_hotel} €")
-
-# AVERAGE DAILY RATE
-adr = round(df['adr'].mean(), 2)
-adr_city_hotel = round(filter_city_hotel['adr'].mean(), 2)
-adr_resort_hotel = round(filter_resort_hotel['adr'].mean(), 2)
-print(f"Average Daily Rate: {adr} €")
-print(f"Average Daily Rate City Hotel: {adr_city_hotel} €")
-print(f"Average Daily Rate Resort Hotel: {adr_resort_hotel} €")
-
-# AVERAGE LEAD TIME
-avg_lead_time = round(df['lead_time'].mean(), 2)
-avg_lead_time_city_hotel = round(filter_city_hotel['lead_time'].mean(), 2)
-avg_lead_time_resort_hotel = round(filter_resort_hotel['lead_time'].mean(), 2)
-print(f"Average Lead Time: {avg_lead_time} days")
-print(f"Average Lead Time City Hotel: {avg_lead_time_city_hotel} days")
-print(f"Average Lead TIme Resort Hotel: {avg_lead_time_resort_hotel} days")
-
-# REVENUE PER GUEST
-total_guests = df['adults'].sum() + df['total_kids'].sum()
-total_guests_city_hotel = filter_city_hotel['adults'].sum() + filter_city_hotel['total_kids'].sum()
-total_guests_resort_hotel = filter_resort_hotel['adults'].sum() + filter_resort_hotel['total_kids'].sum()
-
-revpg = round(total_revenue / total_guests, 2)
-revpg_city_hotel = round(total_revenue_city_hotel / total_guests_city_hotel, 2)
-revpg_resort_hotel = round(total_revenue_resort_hotel / total_guests_resort_hotel, 2)
-print(f"Average Revenue per Guest: {revpg} €")
-print(f"Average Revenue per Guest City Hotel: {revpg_city_hotel} €")
-print(f"Average Revenue per Guest Resort Hotel: {revpg_resort_hotel} €")
-
-# LENGTH OF STAY
-total_nights = df['stays_in_week_nights'].sum() + df['stays_in_weekend_nights'].sum()
-total_nights_city_hotel = (filter_city_hotel['stays_in_week_nights'].sum() +
-                           filter_city_hotel['stays_in_weekend_nights'].sum())
-total_nights_resort_hotel = (filter_resort_hotel['stays_in_week_nights'].sum() +
-                             filter_resort_hotel['stays_in_weekend_nights'].sum())
-
-length_of_stay = round(total_nights / total_obs, 2)
-length_of_stay_city_hotel = round(total_nights_city_hotel / total_obs_city_hotel, 2)
-length_of_stay_resort_hotel = round(total_nights_resort_hotel / total_obs_resort_hotel, 2)
-print(f"Length of Stay: {length_of_stay} days")
-print(f"Length of Stay City Hotel: {length_of_stay_city_hotel} days")
-print(f"Length of Stay Resort Hotel: {length_of_stay_resort_hotel} days")
-
-# BOOKINGS BY SOURCE (DATAFRAME)
-values = df['market_segment'].value_counts().values
-values_perc = np.round(100 * (values / total_obs), 2)
-values_city_hotel = df[df['hotel'] == 'City Hotel']['market_segment'].value_counts().values
-values_perc_city_hotel = np.round(100 * (values_city_hotel / total_obs_city_hotel), 2)
-values_resort_hotel = df[df['hotel'] == 'Resort Hotel']['market_segment'].value_counts().values
-values_perc_resort_hotel = np.round(100 * (values_resort_hotel / total_obs_resort_hotel), 2)
-
-index = df['market_segment'].value_counts().keys()
-columns = ['Total Counts', 'Total Counts (%)', 'City Hotel Counts', 'City Hotel Counts (%)', 'Resort Hotel Counts',
-           'Resort Hotel Counts (%)']
-data = list(zip(
-    values, values_perc, values_city_hotel, values_perc_city_hotel, values_resort_hotel, values_perc_resort_hotel))
-
-market_df = pd.DataFrame(index=index, data=data, columns=columns)
-market_df.index.name = 'Market Segment'
+# NIGHTLY OCCUPANCY, ROOM REVENUE AND RevPAR (per hotel and stay date, from check-in/check-out difference arrays)
+if kpi_checkpoint is None:
+    occupancy_df = occupancy_kpis(nightly_totals)
 # =====================================================================================================================
-# KPIs Summary Table (One-row DataFrame)
-kpis = {
-    'Total Bookings': total_obs,
-    'Total Bookings City Hotel': total_obs_city_hotel,
-    'Total Bookings Resort Hotel': total_obs_resort_hotel,
-    'Cancellation Rate (%)': avg_canc_rate,
-    'Cancellation Rate City Hotel (%)': avg_canc_rate_city_hotel,
-    'Cancellation Rate Resort Hotel (%)': avg_canc_rate_resort_hotel,
-    'Previous Cancellation Rate (%)': avg_previous_canc_rate,
-    'Previous Cancellation Rate City Hotel (%)': avg_previous_canc_rate_city_hotel,
-    'Previous Cancellation Rate Resort Hotel (%)': avg_previous_canc_rate_resort_hotel,
-    'Total Revenue (€)': total_revenue,
-    'Total Revenue City Hotel (€)': total_revenue_city_hotel,
-    'Total Revenue Resort Hotel (€)': total_revenue_resort_hotel,
-    'ADR (€)': adr,
-    'ADR City Hotel (€)': adr_city_hotel,
-    'ADR Resort Hotel (€)': adr_resort_hotel,
-    'Average Lead Time (days)': avg_lead_time,
-    'Average Lead Time City Hotel (days)': avg_lead_time_city_hotel,
-    'Average Lead Time Resort Hotel (days)': avg_lead_time_resort_hotel,
-    'Revenue per Guest (€)': revpg,
-    'Revenue per Guest City Hotel (€)': revpg_city_hotel,
-    'Revenue per Guest Resort Hotel (€)': revpg_resort_hotel,
-    'Length of Stay (days)': length_of_stay,
-    'Length of Stay City Hotel (days)': length_of_stay_city_hotel,
-    'Length of Stay Resort Hotel (days)': length_of_stay_resort_hotel
-}
-
-kpis_df = pd.DataFrame([kpis])
+# DISTRIBUTION KPIs (median/p90/p95 of ADR, lead time and length of stay, distinct countries)
+# One sketch per hotel and arrival month is persisted; any hotel/period combination is answered by merging sketches.
+if kpi_checkpoint is None:
+    distribution_df = pd.concat([
+        sketch_summary(partition_sketches, group_by='all'),
+        sketch_summary(partition_sketches, group_by='hotel'),
+        sketch_summary(partition_sketches, group_by='hotel_period')
+    ], ignore_index=True)
+    distribution_df.insert(1, 'period', distribution_df.pop('period').fillna('All'))
 
+    save_checkpoint('kpis', kpi_key, {'kpis': kpis_df, 'market_segments': market_df, 'rolling_kpis': rolling_df,
+                                      'occupancy': occupancy_df, 'distribution_kpis': distribution_df}, run_id)
+# =====================================================================================================================
 # Save to CSV
-kpis_df.to_csv('hotel_kpis.csv', index=False)
-market_df.to_csv('hotel_market_segments.csv')
+kpis_df.to_csv(output_name('hotel_kpis.csv'), index=False)
+market_df.to_csv(output_name('hotel_market_segments.csv'))
+rolling_df.to_csv(output_name('hotel_rolling_kpis.csv'), index=False)
+occupancy_df.to_csv(output_name('hotel_occupancy.csv'), index=False)
+distribution_df.to_csv(output_name('hotel_distribution_kpis.csv'), index=False)
+
+# Append the KPIs of this run to the history (one row per run, hotel and KPI) used for the trend views
+append_kpi_history(kpis_to_long(kpis_df), output_name('hotel_kpi_history.parquet'))
+# =====================================================================================================================
+# EXPORT FILES FOR LOOKER STUDIO
+# The row-level dashboard data and the KPI tables are exported as plain CSV parts below the upload size limit (the
+# Looker Studio file upload does not accept gzip; export_compress=1 compresses them for other consumers) and as Parquet
+# files, with a manifest listing every file, its rows and its checksum. dashboard_data is streamed from a server-side
+# cursor and written to the files chunk by chunk, so it is never held in memory. A resumed run whose export already
+# completed for the same published data does not export it again.
+export_max_part_mb = float(os.getenv('export_max_part_mb', '100'))
+export_compress = os.getenv('export_compress', '0') == '1'
+export_directory = output_name('exports')
+export_key = input_fingerprint(run_id, published_partitions, export_max_part_mb, export_compress)
+
+# In sample mode, the columns behind the error margins are kept from the chunks of the export, so the table is read once
+margin_chunks = []
+
+
+def dashboard_data_chunks():
+    """
+    This function reads the published dashboard data chunk by chunk from a server-side cursor, so the export never
+    holds the whole table in memory. In sample mode, it also keeps the columns behind the error margins of every
+    chunk in `margin_chunks`, so the table is read once.
+
+    Yields:
+    - pandas.DataFrame: The rows of the next chunk, `kpi_chunksize` rows at most.
+    """
+    with engine.connect().execution_options(stream_results=True) as connection:
+        for chunk in pd.read_sql(query, connection, chunksize=kpi_chunksize):
+            if sample_fraction:
+                margin_chunks.append(chunk[margin_source_columns])
+            yield chunk
+
+
+if export_fingerprint(export_directory) == export_key and not verify_export(export_directory):
+    print(f"The export in {export_directory}/ is up to date.")
+else:
+    export_manifest = export_tables({
+        'dashboard_data': dashboard_data_chunks(),
+        'hotel_kpis': kpis_df,
+        'hotel_market_segments': market_df.reset_index(),
+        'hotel_rolling_kpis': rolling_df,
+        'hotel_occupancy': occupancy_df,
+        'hotel_distribution_kpis': distribution_df,
+    }, directory=export_directory, max_part_bytes=int(export_max_part_mb * 1024 ** 2), compress=export_compress,
+        fingerprint=export_key)
+    print(f"Exported {sum(len(table['parts']) for table in export_manifest['tables'].values())} CSV parts to "
+          f"{export_directory}/")
+# =====================================================================================================================
+# ERROR MARGINS OF THE SAMPLE KPIs
+# In sample mode, the KPIs of the full table are estimated from the sample with a 95% error margin: every booking stands
+# for the bookings of its stratum (hotel x arrival year x is_canceled) that were not sampled.
+if sample_fraction:
+    stratum_counts = pd.read_sql(stratum_counts_query('hotel_booking', sample_fraction), engine)
+    # Without an export in this run, only the columns behind the margins are read
+    if not margin_chunks:
+        margin_chunks.append(pd.read_sql(f"SELECT {', '.join(margin_source_columns)} FROM {dashboard_table}", engine))
+    margins_df = sample_kpi_margins(pd.concat(margin_chunks, ignore_index=True), stratum_counts)
+    margins_df.to_csv(output_name('hotel_kpi_margins.csv'), index=False)
+    print(margins_df.to_string(index=False))
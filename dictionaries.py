@@ -44,3 +44,7 @@ country_to_category = {
     'GNB': 'Africa', 'MYT': 'Africa', 'BFA': 'Africa', 'MRT': 'Africa', 'MWI': 'Africa',
     'ATA': 'Antarctica', 'ATF': 'Antarctica',
 }
+
+# Hotels reported separately in the KPI tables, in the order of their columns, and the label of both hotels together
+hotels = ['City Hotel', 'Resort Hotel']
+all_hotels_label = 'All Hotels'
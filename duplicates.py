@@ -0,0 +1,161 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# The guest's personal data. It is dropped right after the extraction, so it is never written to a checkpoint, hashed
+# or published.
+personal_columns = ['name', 'email', 'phone-number', 'credit_card']
+
+# Columns that describe a booking as it was entered in 'hotel_booking'. 'arrival_date_week_number' is left out because
+# it is derived from the arrival date and adds nothing to the identity of a row. The `personal_columns` are left out as
+# well: they are not booking attributes.
+fingerprint_columns = [
+    'hotel', 'is_canceled', 'lead_time', 'arrival_date_year', 'arrival_date_month', 'arrival_date_day_of_month',
+    'stays_in_weekend_nights', 'stays_in_week_nights', 'adults', 'children', 'babies', 'meal', 'country',
+    'market_segment', 'distribution_channel', 'is_repeated_guest', 'previous_cancellations',
+    'previous_bookings_not_canceled', 'reserved_room_type', 'assigned_room_type', 'booking_changes', 'deposit_type',
+    'agent', 'company', 'days_in_waiting_list', 'customer_type', 'adr', 'required_car_parking_spaces',
+    'total_of_special_requests', 'reservation_status', 'reservation_status_date'
+]
+
+
+def row_fingerprints(dataframe, columns=None):
+    """
+    This function computes a 64-bit fingerprint for every row of the dataframe by hashing the given columns with
+    pandas' vectorized hashing. Two rows get the same fingerprint only if they hold the same values in all of these
+    columns, so comparing fingerprints replaces comparing the full wide rows.
+
+    Args:
+    - dataframe (pandas.DataFrame): The dataframe whose rows are fingerprinted.
+    - columns (list, optional): The columns to hash. Defaults to `fingerprint_columns`.
+
+    Returns:
+    - pandas.Series: The uint64 fingerprints, aligned with the index of the dataframe.
+    """
+    if columns is None:
+        columns = fingerprint_columns
+
+    fingerprints = pd.util.hash_pandas_object(dataframe[columns], index=False)
+    fingerprints.index = dataframe.index
+    return fingerprints
+
+
+def load_fingerprint_index(path):
+    """
+    This function loads the fingerprint index persisted by a previous run. The index is a sorted array of the unique
+    fingerprints seen so far, so membership checks are binary searches.
+
+    Args:
+    - path (str): The location of the `.npy` index file.
+
+    Returns:
+    - numpy.ndarray: The sorted uint64 fingerprints, empty if no index has been saved yet.
+    """
+    if not os.path.exists(path):
+        return np.empty(0, dtype=np.uint64)
+    return np.load(path)
+
+
+def save_fingerprint_index(index, path):
+    """
+    This function persists the fingerprint index so the next run can check its bookings against it.
+
+    Args:
+    - index (numpy.ndarray): The sorted uint64 fingerprints to store.
+    - path (str): The location of the `.npy` index file.
+    """
+    np.save(path, index)
+
+
+def update_fingerprint_index(index, fingerprints):
+    """
+    This function adds new fingerprints to the index, keeping it sorted and free of repeated values. The new values are
+    inserted at their sorted positions, so the history is not sorted again: the cost grows with the number of
+    fingerprints added and only linearly (one copy) with the size of the history.
+
+    Args:
+    - index (numpy.ndarray): The current sorted uint64 fingerprints.
+    - fingerprints (pandas.Series or numpy.ndarray): The fingerprints to add, e.g. those of the new bookings.
+
+    Returns:
+    - numpy.ndarray: The merged, sorted index.
+    """
+    values = np.unique(np.asarray(fingerprints, dtype=np.uint64))
+    positions = np.searchsorted(index, values)
+    if index.size > 0:
+        new = index[np.minimum(positions, index.size - 1)] != values
+        values, positions = values[new], positions[new]
+    return np.insert(index, positions, values)
+
+
+def in_fingerprint_index(index, fingerprints):
+    """
+    This function tells which fingerprints are already present in the index. Each lookup is a binary search, so the
+    cost grows with the number of fingerprints checked and only logarithmically with the size of the history.
+
+    Args:
+    - index (numpy.ndarray): The sorted uint64 fingerprints of the history.
+    - fingerprints (pandas.Series): The fingerprints to look up.
+
+    Returns:
+    - pandas.Series: True where the fingerprint is already in the index.
+    """
+    values = fingerprints.to_numpy(dtype=np.uint64)
+    if index.size == 0:
+        return pd.Series(False, index=fingerprints.index)
+
+    positions = np.searchsorted(index, values)
+    found = index[np.minimum(positions, index.size - 1)] == values
+    return pd.Series(found, index=fingerprints.index)
+
+
+def flag_duplicates(fingerprints, index=None):
+    """
+    This function flags exact duplicate rows: every copy of a booking after its first occurrence in the batch. With
+    the index of the bookings seen by previous runs, the check is incremental. One binary search per row finds the
+    slot of its booking in the history. Rows of bookings that are not in the history (the new rows) are only compared
+    with each other. A booking of the history can only be duplicated if more than one row falls on its slot, which a
+    single count over the slots reveals. The hash-table comparison is therefore limited to the new rows and to the
+    repeated bookings, instead of every row of the table.
+
+    Args:
+    - fingerprints (pandas.Series): The fingerprints of the batch, as returned by `row_fingerprints`.
+    - index (numpy.ndarray, optional): The sorted fingerprints of bookings seen in previous runs.
+
+    Returns:
+    - pandas.Series: True for every row that duplicates an earlier row of the batch.
+    """
+    if index is None or index.size == 0:
+        return fingerprints.duplicated(keep='first')
+
+    values = fingerprints.to_numpy(dtype=np.uint64)
+    positions = np.minimum(np.searchsorted(index, values), index.size - 1)
+    known = index[positions] == values
+    rows_per_slot = np.bincount(positions[known], minlength=index.size)
+    checked = ~known | (rows_per_slot[positions] > 1)
+
+    duplicated = np.zeros(len(values), dtype=bool)
+    duplicated[checked] = fingerprints[checked].duplicated(keep='first').to_numpy()
+    return pd.Series(duplicated, index=fingerprints.index)
+
+
+def booking_keys(fingerprints, is_duplicate):
+    """
+    This function returns a key that is unique for every row: the fingerprint of the booking for its first copy, and
+    for every further copy the hash of the fingerprint and the number of the copy. The key joins the scores of the
+    model rows to the dashboard rows, so it must stay unique when duplicates are flagged instead of dropped.
+
+    Args:
+    - fingerprints (pandas.Series): The fingerprints of the rows.
+    - is_duplicate (pandas.Series): The flags returned by `flag_duplicates`.
+
+    Returns:
+    - pandas.Series: The int64 keys (signed, which PostgreSQL accepts), aligned with the fingerprints.
+    """
+    keys = fingerprints.copy()
+    if is_duplicate.any():
+        copies = fingerprints[is_duplicate]
+        keys[is_duplicate] = pd.util.hash_pandas_object(
+            pd.DataFrame({'fingerprint': copies, 'copy': copies.groupby(copies).cumcount() + 1}), index=False)
+    return pd.Series(keys.to_numpy(dtype=np.uint64).view('int64'), index=fingerprints.index)
@@ -0,0 +1,274 @@
+import gzip
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Looker Studio accepts uploaded files of up to 100 MB
+max_part_mb = 100
+
+# Size of the blocks read back to checksum a written file
+checksum_block_bytes = 1024 ** 2
+
+manifest_file = 'manifest.json'
+
+
+def _datetime_formats(dataframe):
+    # The format of every datetime column, decided on the first rows of the table so every part writes the column
+    # identically: dates without a time of day as YYYY-MM-DD, the others (e.g. last_updated) with their time
+    formats = {}
+    for column in dataframe.columns[dataframe.dtypes.map(pd.api.types.is_datetime64_any_dtype)]:
+        values = dataframe[column].dropna()
+        formats[column] = '%Y-%m-%d' if (values == values.dt.normalize()).all() else '%Y-%m-%d %H:%M:%S'
+    return formats
+
+
+def _csv_lines(dataframe, formats):
+    # The CSV line of every row, without the header. Rows holding a line break in a quoted value are rendered one by
+    # one, so every line still matches one row.
+    formatted = dataframe.assign(**{column: dataframe[column].dt.strftime(date_format)
+                                    for column, date_format in formats.items() if column in dataframe.columns})
+    lines = formatted.to_csv(index=False, header=False, lineterminator='\n').encode('utf-8').splitlines(keepends=True)
+    if len(lines) != len(formatted):
+        lines = [formatted.iloc[[i]].to_csv(index=False, header=False, lineterminator='\n').encode('utf-8')
+                 for i in range(len(formatted))]
+    return lines
+
+
+def _file_entry(path):
+    # Size and SHA-256 checksum of a written file, read back in blocks
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(checksum_block_bytes), b''):
+            digest.update(block)
+    return {'file': os.path.basename(path), 'bytes': os.path.getsize(path), 'sha256': digest.hexdigest()}
+
+
+def _open_part(path, header, compress):
+    # A part is written to a temporary name first, so an interrupted export never leaves a truncated file with the
+    # final name. gzip without a timestamp keeps the checksums reproducible.
+    handle = open(f'{path}.tmp', 'wb')
+    stream = gzip.GzipFile(filename='', mode='wb', fileobj=handle, compresslevel=6, mtime=0) if compress else handle
+    stream.write(header)
+    return {'path': path, 'handle': handle, 'stream': stream, 'csv_bytes': len(header), 'rows': 0}
+
+
+def _close_part(part):
+    if part['stream'] is not part['handle']:
+        part['stream'].close()
+    part['handle'].close()
+    os.replace(f"{part['path']}.tmp", part['path'])
+    return {**_file_entry(part['path']), 'csv_bytes': part['csv_bytes'], 'rows': part['rows']}
+
+
+def _write_csv_parts(chunks, directory, name, max_part_bytes, compress):
+    """
+    This function writes the rows of a table as CSV parts, chunk by chunk: the rows are appended to the current part
+    until the next one would take its CSV text over the cap, and the part is then closed and a new one started. Only
+    one chunk and one open file are held at a time, whatever the size of the table.
+
+    Args:
+    - chunks (iterable): The DataFrames holding the rows of the table, in order.
+    - directory (str): The export directory.
+    - name (str): The name of the table, the prefix of its parts.
+    - max_part_bytes (int): The largest size of the CSV text of a part, before any compression.
+    - compress (bool): Whether the parts are gzip-compressed.
+
+    Returns:
+    - tuple: The manifest entries of the parts and the columns of the table.
+    """
+    extension = '.csv.gz' if compress else '.csv'
+    parts, columns, formats, header, part = [], None, None, b'\n', None
+
+    def part_path():
+        return os.path.join(directory, f'{name}.part-{len(parts) + 1:04d}{extension}')
+
+    for chunk in chunks:
+        if columns is None:
+            columns = [str(column) for column in chunk.columns]
+            formats = _datetime_formats(chunk)
+            header = chunk.head(0).to_csv(index=False, lineterminator='\n').encode('utf-8')
+        lines = _csv_lines(chunk, formats)
+        ends = np.cumsum([len(line) for line in lines])
+        start = 0
+        while start < len(lines):
+            if part is None:
+                part = _open_part(part_path(), header, compress)
+            # Rows that still fit in the current part; a part always takes at least one row
+            offset = ends[start - 1] if start else 0
+            stop = int(np.searchsorted(ends, offset + max_part_bytes - part['csv_bytes'], side='right'))
+            if stop == start and part['rows'] == 0:
+                stop = start + 1
+            if stop > start:
+                part['stream'].write(b''.join(lines[start:stop]))
+                part['csv_bytes'] += int(ends[stop - 1] - offset)
+                part['rows'] += stop - start
+                start = stop
+            if start < len(lines):
+                parts.append(_close_part(part))
+                part = None
+
+    # An empty table still gets one part holding the header
+    if part is not None or not parts:
+        parts.append(_close_part(part or _open_part(part_path(), header, compress)))
+    return parts, columns or []
+
+
+def _arrow_table(dataframe, schema=None):
+    # Columns without any value (e.g. the scores before a classifier is saved) are written as float columns, so the
+    # schema of the first chunk also fits the chunks where they hold values
+    empty = [column for column in dataframe.columns
+             if dataframe[column].dtype == object and dataframe[column].isna().all()]
+    dataframe = dataframe.astype({column: float for column in empty})
+    return pa.Table.from_pandas(dataframe, schema=schema, preserve_index=False)
+
+
+def _write_parquet(dataframe, path):
+    # Parquet file of a table held in memory, written to a temporary name first like the parts
+    pq.write_table(_arrow_table(dataframe), f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+    return {**_file_entry(path), 'rows': len(dataframe)}
+
+
+def _tee_parquet(chunks, path, entry):
+    # Pass the chunks on to the CSV writer while appending them to the Parquet file as row groups (with the schema of
+    # the first chunk), so the table is read once. The manifest entry of the file is filled once the chunks are done.
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            table = _arrow_table(chunk, writer.schema if writer is not None else None)
+            if writer is None:
+                writer = pq.ParquetWriter(f'{path}.tmp', table.schema)
+            writer.write_table(table)
+            rows += len(chunk)
+            yield chunk
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pd.DataFrame().to_parquet(f'{path}.tmp', index=False)
+    os.replace(f'{path}.tmp', path)
+    entry.update(_file_entry(path), rows=rows)
+
+
+def _remove_previous_files(directory, name):
+    # Parts of a previous export of the table (which may have had more parts) must not be uploaded with the new ones
+    for file_name in os.listdir(directory):
+        if file_name.startswith(f'{name}.'):
+            os.remove(os.path.join(directory, file_name))
+
+
+def export_fingerprint(directory='exports'):
+    # The fingerprint of the data behind the export in the directory, None if there is no complete export
+    path = os.path.join(directory, manifest_file)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get('fingerprint')
+
+
+def export_tables(tables, directory='exports', max_part_bytes=max_part_mb * 1024 ** 2, compress=False,
+                  parquet=True, fingerprint=None, max_workers=None):
+    """
+    This function exports tables for upload to Looker Studio. Each table is written as plain CSV parts whose size
+    stays below the cap (optionally gzip-compressed, for other consumers: the Looker Studio file upload only accepts
+    plain CSV), every part with the same header and the same value formats, plus one Parquet file. A table can be
+    given as an iterable of chunks: its rows are then written to disk chunk by chunk, so the table is never held in
+    memory. The CSV and Parquet files of the tables given as DataFrames are written by a thread pool while the
+    chunked tables stream. A manifest lists every file with its row count, size and SHA-256 checksum. It is written
+    last, so an interrupted export is never mistaken for a complete one.
+
+    Args:
+    - tables (dict): {table name: DataFrame or iterable of DataFrames}. The index is not exported.
+    - directory (str): The export directory.
+    - max_part_bytes (int): The largest size of the CSV text of a part. With compression, the cap applies to the
+      decompressed part, which is what has to be uploaded.
+    - compress (bool): Whether the CSV parts are gzip-compressed.
+    - parquet (bool): Whether a Parquet file is written for each table.
+    - fingerprint (str, optional): The fingerprint of the exported data, recorded in the manifest so an unchanged
+      export can be skipped (see `export_fingerprint`).
+    - max_workers (int, optional): The number of threads. Defaults to the ThreadPoolExecutor default.
+
+    Returns:
+    - dict: The manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, manifest_file)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    manifest = {'created': datetime.now().isoformat(timespec='seconds'), 'fingerprint': fingerprint,
+                'max_part_bytes': max_part_bytes, 'compressed': compress, 'tables': {}}
+    for name in tables:
+        _remove_previous_files(directory, name)
+
+    entries = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # The tables held in memory go to the pool; pyarrow, gzip and the file writes release the GIL
+        futures = {}
+        for name, table in tables.items():
+            if isinstance(table, pd.DataFrame):
+                futures[name] = (
+                    executor.submit(_write_csv_parts, [table], directory, name, max_part_bytes, compress),
+                    executor.submit(_write_parquet, table, os.path.join(directory, f'{name}.parquet'))
+                    if parquet else None)
+
+        for name, table in tables.items():
+            if isinstance(table, pd.DataFrame):
+                continue
+            parquet_entry = {}
+            chunks = table
+            if parquet:
+                chunks = _tee_parquet(table, os.path.join(directory, f'{name}.parquet'), parquet_entry)
+            parts, columns = _write_csv_parts(chunks, directory, name, max_part_bytes, compress)
+            entries[name] = {'rows': sum(part['rows'] for part in parts), 'columns': columns, 'parts': parts}
+            if parquet:
+                entries[name]['parquet'] = parquet_entry
+
+        for name, (csv_future, parquet_future) in futures.items():
+            parts, columns = csv_future.result()
+            entries[name] = {'rows': sum(part['rows'] for part in parts), 'columns': columns, 'parts': parts}
+            if parquet_future is not None:
+                entries[name]['parquet'] = parquet_future.result()
+    manifest['tables'] = {name: entries[name] for name in tables}
+
+    temporary_path = f'{manifest_path}.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary_path, manifest_path)
+    return manifest
+
+
+def verify_export(directory='exports'):
+    """
+    This function checks an export against its manifest, e.g. before uploading it: every file must exist and match
+    its recorded size and checksum, and the parts of every table must add up to its row count.
+
+    Args:
+    - directory (str): The export directory.
+
+    Returns:
+    - list: The problems found (empty if the export is complete and intact).
+    """
+    with open(os.path.join(directory, manifest_file)) as f:
+        manifest = json.load(f)
+
+    problems = []
+    for name, entry in manifest['tables'].items():
+        if sum(part['rows'] for part in entry['parts']) != entry['rows']:
+            problems.append(f"{name}: the parts do not add up to {entry['rows']} rows")
+        for file_entry in entry['parts'] + ([entry['parquet']] if 'parquet' in entry else []):
+            path = os.path.join(directory, file_entry['file'])
+            if not os.path.exists(path):
+                problems.append(f"{file_entry['file']}: missing")
+                continue
+            actual = _file_entry(path)
+            if actual['bytes'] != file_entry['bytes'] or actual['sha256'] != file_entry['sha256']:
+                problems.append(f"{file_entry['file']}: size or checksum does not match the manifest")
+    return problems
@@ -0,0 +1,205 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from publishing import volatile_columns
+
+# Outputs of a run that faster engines must reproduce, in pipeline order: the two published tables and the KPI files
+golden_outputs = ['logreg_rf_data', 'dashboard_data', 'hotel_kpis.csv', 'hotel_market_segments.csv']
+
+# Directory where the fingerprints of reference runs are stored
+golden_directory = 'golden'
+
+# Float columns are also fingerprinted after rounding, so results that differ only by summation order still match
+float_decimals = 6
+
+# Summary statistics of the float columns
+summary_statistics = ['sum', 'min', 'max', 'mean', 'std']
+
+# Statuses of a column that reproduces the reference, from the strictest to the most tolerant
+matching_statuses = ['identical', 'equal after rounding', 'close']
+
+
+def _hash_sum(values):
+    # Order-insensitive fingerprint of a column: the sum of the value hashes, exact modulo 2**64
+    return format(int(pd.util.hash_array(values).sum(dtype=np.uint64)), '016x')
+
+
+def _summaries(numbers):
+    # Summary statistics of the non-null values, compared within a tolerance
+    numbers = numbers[~np.isnan(numbers)]
+    if numbers.size == 0:
+        return dict.fromkeys(summary_statistics, np.nan)
+    return {'sum': numbers.sum(), 'min': numbers.min(), 'max': numbers.max(), 'mean': numbers.mean(),
+            'std': numbers.std()}
+
+
+def column_fingerprints(dataframe, output_name=''):
+    """
+    This function fingerprints every column of an output with a few vectorized reductions. The fingerprint is the
+    sum of the hashes of the values, so it does not depend on the order of the rows and two columns share it only if
+    they hold the same multiset of values. Float columns also get a fingerprint of their values rounded to
+    `float_decimals` and summary statistics, used to compare them within a tolerance. Integer, boolean and object
+    columns only get the exact fingerprint: a changed count or code is never within a tolerance.
+
+    Args:
+    - dataframe (pandas.DataFrame): The output to fingerprint.
+    - output_name (str): The name of the output, e.g. 'dashboard_data' or 'hotel_kpis.csv'.
+
+    Returns:
+    - pandas.DataFrame: One row per column with its position, dtype, row and null counts, fingerprints and summaries.
+    """
+    rows = []
+    for position, (column, series) in enumerate(dataframe.items()):
+        # Categoricals are hashed by value, so they match the same column stored as plain strings
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            values = series.astype(object).to_numpy()
+        else:
+            values = series.to_numpy()
+        row = {
+            'output': output_name,
+            'position': position,
+            'column': str(column),
+            'dtype': str(series.dtype),
+            'rows': len(series),
+            'nulls': int(series.isna().sum()),
+            'fingerprint': _hash_sum(values),
+            'rounded_fingerprint': None,
+        }
+        if pd.api.types.is_float_dtype(series.dtype):
+            numbers = series.to_numpy(dtype=float, na_value=np.nan)
+            # Adding 0.0 turns -0.0 into 0.0, which would otherwise hash differently
+            row['rounded_fingerprint'] = _hash_sum(np.round(numbers, float_decimals) + 0.0)
+            row.update(_summaries(numbers))
+        rows.append(row)
+    return pd.DataFrame(rows, columns=['output', 'position', 'column', 'dtype', 'rows', 'nulls', 'fingerprint',
+                                       'rounded_fingerprint'] + summary_statistics)
+
+
+def output_fingerprints(outputs):
+    """
+    This function fingerprints every column of every output of a run.
+
+    Args:
+    - outputs (dict): {output name: DataFrame}, e.g. as returned by `load_run_outputs`.
+
+    Returns:
+    - pandas.DataFrame: The column fingerprints of all outputs, see `column_fingerprints`.
+    """
+    return pd.concat([column_fingerprints(dataframe, name) for name, dataframe in outputs.items()],
+                     ignore_index=True)
+
+
+def load_run_outputs(engine, directory='.', outputs=None):
+    """
+    This function reads the outputs of the last run: the tables from the database (without the technical columns
+    that change on every run) and the CSV files from the project directory.
+
+    Args:
+    - engine (sqlalchemy.engine.Engine): The connection to the database.
+    - directory (str): The directory holding the CSV outputs.
+    - outputs (list, optional): The outputs to read. Defaults to `golden_outputs`.
+
+    Returns:
+    - dict: {output name: DataFrame}.
+    """
+    if outputs is None:
+        outputs = golden_outputs
+
+    loaded = {}
+    for name in outputs:
+        if name.endswith('.csv'):
+            loaded[name] = pd.read_csv(os.path.join(directory, name))
+        else:
+            loaded[name] = pd.read_sql(f"SELECT * FROM {name}", engine).drop(columns=volatile_columns,
+                                                                              errors='ignore')
+    return loaded
+
+
+def compare_fingerprints(expected, actual, tolerance=1e-6):
+    """
+    This function compares the column fingerprints of a reference run with those of another run (or of another
+    implementation of the pipeline). Every column gets one of the statuses:
+    - 'identical': exactly the same values,
+    - 'equal after rounding': the same values once rounded to `float_decimals` (float columns only),
+    - 'close': same row and null counts and summary statistics within the relative tolerance (float columns only),
+    - 'different', 'missing' (only in the reference) or 'unexpected' (only in the other run).
+
+    Args:
+    - expected (pandas.DataFrame): The fingerprints of the reference run.
+    - actual (pandas.DataFrame): The fingerprints of the run to check.
+    - tolerance (float): The relative tolerance on the summary statistics.
+
+    Returns:
+    - pandas.DataFrame: One row per output and column, in pipeline order, with the status and both fingerprints.
+    """
+    comparison = expected.merge(actual, on=['output', 'column'], how='outer', suffixes=('_expected', '_actual'),
+                                indicator=True)
+
+    exact = comparison['fingerprint_expected'] == comparison['fingerprint_actual']
+    rounded = (comparison['rounded_fingerprint_expected'].notna() &
+               (comparison['rounded_fingerprint_expected'] == comparison['rounded_fingerprint_actual']))
+    close = ((comparison['rows_expected'] == comparison['rows_actual']) &
+             (comparison['nulls_expected'] == comparison['nulls_actual']) &
+             comparison['sum_expected'].notna() & comparison['sum_actual'].notna())
+    for statistic in summary_statistics:
+        close &= np.isclose(comparison[f'{statistic}_expected'], comparison[f'{statistic}_actual'], rtol=tolerance,
+                            atol=tolerance, equal_nan=True)
+
+    comparison['status'] = np.select(
+        [comparison['_merge'] == 'left_only', comparison['_merge'] == 'right_only', exact, rounded, close],
+        ['missing', 'unexpected', 'identical', 'equal after rounding', 'close'], default='different')
+
+    # Pipeline order: outputs as listed in golden_outputs, then column position in the reference
+    output_order = {name: rank for rank, name in enumerate(golden_outputs)}
+    comparison['output_rank'] = comparison['output'].map(output_order).fillna(len(output_order))
+    comparison['position'] = comparison['position_expected'].fillna(comparison['position_actual'])
+    comparison = comparison.sort_values(['output_rank', 'output', 'position'], kind='mergesort')
+
+    return comparison[['output', 'column', 'status', 'dtype_expected', 'dtype_actual', 'rows_expected', 'rows_actual',
+                       'nulls_expected', 'nulls_actual', 'fingerprint_expected', 'fingerprint_actual']] \
+        .reset_index(drop=True)
+
+
+def first_divergence(comparison):
+    # The first column, in pipeline order, that does not reproduce the reference (None if every column does)
+    diverging = comparison.loc[~comparison['status'].isin(matching_statuses)]
+    return None if diverging.empty else diverging.iloc[0]
+
+
+def save_golden(fingerprints, name, directory=golden_directory):
+    os.makedirs(directory, exist_ok=True)
+    fingerprints.to_parquet(os.path.join(directory, f'{name}.parquet'), index=False)
+
+
+def load_golden(name, directory=golden_directory):
+    return pd.read_parquet(os.path.join(directory, f'{name}.parquet'))
+
+
+if __name__ == '__main__':
+    # Usage:
+    #   python golden.py snapshot <name>               fingerprint the outputs of the last run as <name>
+    #   python golden.py compare <reference> <name>    compare two snapshots, exit code 1 if they diverge
+    command, names = sys.argv[1], sys.argv[2:]
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    if command == 'snapshot':
+        from dotenv import load_dotenv
+        from sqlalchemy import create_engine
+        load_dotenv()
+        engine = create_engine(f"postgresql://{os.getenv('postgresuser')}:{os.getenv('password')}@"
+                               f"{os.getenv('host')}:{os.getenv('port')}/{os.getenv('db_name')}")
+        save_golden(output_fingerprints(load_run_outputs(engine)), names[0])
+        print(f"Saved the fingerprints of the last run as '{names[0]}'.")
+    elif command == 'compare':
+        comparison = compare_fingerprints(load_golden(names[0]), load_golden(names[1]))
+        print(comparison['status'].value_counts().to_string())
+        divergence = first_divergence(comparison)
+        if divergence is None:
+            print(f"'{names[1]}' reproduces '{names[0]}'.")
+        else:
+            print(f"First diverging column: {divergence['output']}.{divergence['column']} ({divergence['status']})")
+            print(comparison.loc[~comparison['status'].isin(matching_statuses)].to_string())
+            sys.exit(1)
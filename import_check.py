@@ -0,0 +1,83 @@
+import ast
+import subprocess
+import sys
+import os
+
+# Set the working directory to the script's location
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported by the pipeline
+pipeline_modules = ['checkpoints', 'cleaning', 'dictionaries', 'duplicates', 'exports', 'golden', 'kpi_accumulators',
+                    'kpi_history', 'kpi_sql', 'publishing', 'results', 'rolling_kpis', 'sampling', 'scheduler',
+                    'scoring', 'sketches', 'stay_nights', 'testing', 'validation', 'what_if']
+
+# Scripts of the pipeline. They run the pipeline (and connect to the database) when executed, so only their import
+# statements are loaded.
+pipeline_scripts = ['preprocessing.py', 'dashboard_dataframe.py', 'run_all.py']
+
+# Libraries that must only be loaded when a plot is actually drawn
+plotting_modules = ['matplotlib', 'seaborn']
+
+# File where the import-time report of the last check is written
+report_file = 'import_time.log'
+
+
+def script_imports(path):
+    """
+    Extracts the top-level import statements of a script, so its imports can be loaded without running it.
+
+    Parameters:
+        path (str): The script.
+
+    Returns:
+        str: The import statements, one per line.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), filename=path)
+    return '\n'.join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def import_time_report(modules, scripts=()):
+    """
+    Imports the given modules, and the import statements of the given scripts, in a fresh interpreter with
+    `-X importtime` and parses its report.
+
+    Parameters:
+        modules (list): Names of the modules to import.
+        scripts (list): Scripts whose import statements are loaded, see `script_imports`.
+
+    Returns:
+        list: (module name, self time in µs, cumulative time in µs) for every module that was loaded.
+    """
+    code = '\n'.join([f"import {', '.join(modules)}"] + [script_imports(script) for script in scripts])
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                               capture_output=True, text=True, check=True)
+    report = []
+    for line in completed.stderr.splitlines():
+        # Lines look like: "import time:       123 |        456 |   package.module"
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        report.append((name.strip(), int(self_time), int(cumulative_time)))
+    return report
+
+
+def check_no_plotting_imports(report):
+    # Any top-level plotting package in the report means that a module imports it eagerly
+    loaded = {name.split('.')[0] for name, _, _ in report}
+    eager = [module for module in plotting_modules if module in loaded]
+    assert not eager, f"Plotting libraries imported at module load: {', '.join(eager)}"
+    return 'Test Passed'
+
+
+if __name__ == '__main__':
+    report = import_time_report(pipeline_modules, pipeline_scripts)
+
+    # Keep the slowest imports in the report so that regressions are easy to spot
+    slowest = sorted(report, key=lambda row: row[2], reverse=True)[:25]
+    with open(report_file, 'w') as f:
+        f.write(f"{'cumulative [us]':>16} {'self [us]':>10}  module\n")
+        for name, self_time, cumulative_time in slowest:
+            f.write(f"{cumulative_time:>16} {self_time:>10}  {name}\n")
+
+    print(check_no_plotting_imports(report))
@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+
+from rolling_kpis import daily_hotel_aggregates
+from stay_nights import stay_night_totals, merge_stay_night_totals
+from sketches import build_partition_sketches, merge_partition_sketches
+from dictionaries import hotels, all_hotels_label
+
+# Additive per-hotel totals from which every KPI of hotel_kpis.csv is derived
+hotel_total_columns = ['bookings', 'cancellations', 'previous_cancellations', 'adr_sum', 'lead_time_sum', 'guests',
+                       'nights']
+
+market_segment_columns = ['Total Counts', 'Total Counts (%)', 'City Hotel Counts', 'City Hotel Counts (%)',
+                          'Resort Hotel Counts', 'Resort Hotel Counts (%)']
+
+
+def booking_totals(chunk):
+    # The contribution of every booking to the totals in `hotel_total_columns`, with its hotel
+    return pd.DataFrame({
+        'hotel': chunk['hotel'].astype(str),
+        'bookings': 1,
+        'cancellations': chunk['is_canceled'],
+        'previous_cancellations': chunk['previous_cancellations'],
+        'adr_sum': chunk['adr'],
+        'lead_time_sum': chunk['lead_time'],
+        'guests': chunk['adults'] + chunk['total_kids'],
+        'nights': chunk['stays_in_week_nights'] + chunk['stays_in_weekend_nights'],
+    })
+
+
+def hotel_totals(chunk):
+    """
+    This function reduces a chunk of the dashboard data to one row of additive totals per hotel.
+
+    Args:
+    - chunk (pandas.DataFrame): Rows of the dashboard data.
+
+    Returns:
+    - pandas.DataFrame: The totals in `hotel_total_columns`, indexed by hotel.
+    """
+    return booking_totals(chunk).groupby('hotel').sum()
+
+
+def segment_totals(chunk):
+    # Number of bookings per market segment (rows) and hotel (columns)
+    return pd.crosstab(chunk['market_segment'].astype(str), chunk['hotel'].astype(str))
+
+
+def kpi_totals(chunk, sketch_months=None):
+    """
+    This function builds the accumulator of a chunk of the dashboard data. The accumulator only holds additive
+    totals and mergeable sketches, whose size depends on the number of hotels, segments and days but not on the
+    number of bookings:
+    - 'hotels': per-hotel totals for the KPI table,
+    - 'segments': bookings per market segment and hotel,
+    - 'daily': daily totals per hotel for the rolling KPIs,
+    - 'nights': nightly rooms and revenue per hotel for the occupancy KPIs,
+    - 'sketches': quantile and distinct-count sketches per hotel and arrival month.
+
+    Args:
+    - chunk (pandas.DataFrame): Rows of the dashboard data.
+    - sketch_months (list, optional): The arrival months whose bookings are sketched (by default, every month),
+      e.g. only the months whose persisted sketches are stale.
+
+    Returns:
+    - dict: The accumulator of the chunk.
+    """
+    return {
+        'hotels': hotel_totals(chunk),
+        'segments': segment_totals(chunk),
+        'daily': daily_hotel_aggregates(chunk),
+        'nights': stay_night_totals(chunk),
+        'sketches': build_partition_sketches(chunk, months=sketch_months),
+    }
+
+
+def merge_kpi_totals(*accumulators):
+    """
+    This function merges accumulators built from different chunks, processes or runs. The result is the same as the
+    accumulator of all their rows together.
+
+    Args:
+    - accumulators (dict): Accumulators returned by `kpi_totals` or by a previous merge.
+
+    Returns:
+    - dict: The merged accumulator.
+    """
+    def add(frames):
+        return pd.concat(frames).groupby(level=list(range(frames[0].index.nlevels))).sum()
+
+    return {
+        'hotels': add([accumulator['hotels'] for accumulator in accumulators]),
+        'segments': add([accumulator['segments'] for accumulator in accumulators]).fillna(0).astype(int),
+        'daily': add([accumulator['daily'] for accumulator in accumulators]),
+        'nights': merge_stay_night_totals(*[accumulator['nights'] for accumulator in accumulators]),
+        'sketches': merge_partition_sketches(*[accumulator['sketches'] for accumulator in accumulators]),
+    }
+
+
+def stream_kpi_totals(chunks, sketch_months=None):
+    """
+    This function consumes the dashboard data chunk by chunk (e.g. `pd.read_sql(query, engine, chunksize=...)`)
+    and keeps only the running accumulator, so memory stays constant whatever the size of the table.
+
+    Args:
+    - chunks (iterable): DataFrames holding consecutive rows of the dashboard data.
+    - sketch_months (list, optional): The arrival months whose bookings are sketched, see `kpi_totals`.
+
+    Returns:
+    - dict: The accumulator of all rows.
+    """
+    accumulator = None
+    for chunk in chunks:
+        chunk_totals = kpi_totals(chunk, sketch_months)
+        accumulator = chunk_totals if accumulator is None else merge_kpi_totals(accumulator, chunk_totals)
+    return accumulator
+
+
+def _ratio(numerator, denominator):
+    # A rate or an average of no booking is undefined (NaN, as the mean of an empty column in pandas)
+    return float(numerator) / float(denominator) if denominator else np.nan
+
+
+def finalize_kpis(hotel_totals_df):
+    """
+    This function turns the per-hotel totals into the one-row KPI table of dashboard_dataframe.py, with the same
+    columns, order and rounding. A hotel without any booking (e.g. in a small sample) gets zero totals and NaN rates.
+
+    Args:
+    - hotel_totals_df (pandas.DataFrame): The per-hotel totals of an accumulator. An 'All Hotels' row (such as the
+      rollup row computed by the database) is used for the overall figures when present.
+
+    Returns:
+    - pandas.DataFrame: The one-row KPI table.
+    """
+    # The overall figures first, then one per hotel, as in the KPI table
+    if all_hotels_label in hotel_totals_df.index:
+        overall = hotel_totals_df.loc[all_hotels_label]
+    else:
+        overall = hotel_totals_df.sum()
+    hotel_rows = hotel_totals_df.reindex(hotels, fill_value=0)
+    scopes = [('', overall)] + [(f' {hotel}', hotel_rows.loc[hotel]) for hotel in hotels]
+
+    kpis = {}
+    for name, unit, kpi in [
+        ('Total Bookings', '', lambda t: int(t['bookings'])),
+        ('Cancellation Rate', ' (%)', lambda t: round(_ratio(t['cancellations'], t['bookings']) * 100, 2)),
+        ('Previous Cancellation Rate', ' (%)',
+         lambda t: round(_ratio(t['previous_cancellations'], t['bookings']) * 100, 2)),
+        ('Total Revenue', ' (€)', lambda t: round(t['adr_sum'])),
+        ('ADR', ' (€)', lambda t: round(_ratio(t['adr_sum'], t['bookings']), 2)),
+        ('Average Lead Time', ' (days)', lambda t: round(_ratio(t['lead_time_sum'], t['bookings']), 2)),
+        # Revenue per guest is based on the rounded total revenue, as in the KPI table
+        ('Revenue per Guest', ' (€)', lambda t: round(_ratio(round(t['adr_sum']), t['guests']), 2)),
+        ('Length of Stay', ' (days)', lambda t: round(_ratio(t['nights'], t['bookings']), 2)),
+    ]:
+        for suffix, totals in scopes:
+            kpis[f'{name}{suffix}{unit}'] = kpi(totals)
+    return pd.DataFrame([kpis])
+
+
+def finalize_market_segments(segment_totals_df):
+    """
+    This function turns the bookings per market segment and hotel into the market segment table of
+    dashboard_dataframe.py, sorted by the total number of bookings.
+
+    Args:
+    - segment_totals_df (pandas.DataFrame): The segment totals of an accumulator.
+
+    Returns:
+    - pandas.DataFrame: The market segment table.
+    """
+    counts = segment_totals_df.reindex(columns=hotels, fill_value=0)
+    counts['Total'] = counts.sum(axis=1)
+    counts = counts.sort_values('Total', ascending=False, kind='mergesort')
+
+    data = {}
+    for column, label in [('Total', 'Total'), ('City Hotel', 'City Hotel'), ('Resort Hotel', 'Resort Hotel')]:
+        values = counts[column].to_numpy()
+        data[f'{label} Counts'] = values
+        data[f'{label} Counts (%)'] = np.round(100 * (values / values.sum()), 2)
+
+    market_df = pd.DataFrame(data, index=counts.index)[market_segment_columns]
+    market_df.index.name = 'Market Segment'
+    return market_df
@@ -0,0 +1,84 @@
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+# Hotels that appear as suffixes in the KPI names of dashboard_dataframe.py; KPIs without a hotel cover both hotels
+from dictionaries import hotels, all_hotels_label
+
+history_columns = ['run_timestamp', 'hotel', 'kpi', 'value']
+
+
+def kpis_to_long(kpis_df):
+    """
+    This function turns the one-row KPI table into a long/tidy table with one row per hotel and KPI, e.g. the column
+    'ADR City Hotel (€)' becomes the row ('City Hotel', 'ADR (€)', value).
+
+    Args:
+    - kpis_df (pandas.DataFrame): The one-row KPI table built by dashboard_dataframe.py.
+
+    Returns:
+    - pandas.DataFrame: The columns `hotel`, `kpi` and `value`.
+    """
+    rows = []
+    for column, value in kpis_df.iloc[0].items():
+        hotel = next((name for name in hotels if f' {name}' in column), None)
+        if hotel is None:
+            rows.append((all_hotels_label, column, float(value)))
+        else:
+            rows.append((hotel, column.replace(f' {hotel}', ''), float(value)))
+    return pd.DataFrame(rows, columns=['hotel', 'kpi', 'value'])
+
+
+def read_kpi_history(path):
+    # An empty history is returned before the first run
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=history_columns)
+    return pd.read_parquet(path)
+
+
+def append_kpi_history(kpis_long, path='hotel_kpi_history.parquet', run_timestamp=None, retention_days=730):
+    """
+    This function appends the KPIs of one run to the history file, so that the evolution of every KPI can be charted
+    without recomputing anything over historical bookings. A run whose KPIs are identical to the latest stored run is
+    not appended again, unless that run falls outside the retention period, and runs older than the retention period
+    are removed once the run is appended, so the latest KPIs are always kept. The file is replaced atomically, so a
+    failed run never leaves a truncated history behind.
+
+    Args:
+    - kpis_long (pandas.DataFrame): The KPIs of the run, as returned by `kpis_to_long`.
+    - path (str): The location of the Parquet history file.
+    - run_timestamp (datetime, optional): The time of the run. Defaults to now.
+    - retention_days (int, optional): How long runs are kept. None keeps every run.
+
+    Returns:
+    - bool: True if the run was appended, False if it repeated the latest stored run.
+    """
+    if run_timestamp is None:
+        run_timestamp = datetime.now()
+
+    history = read_kpi_history(path)
+    cutoff = None if retention_days is None else pd.Timestamp(run_timestamp - timedelta(days=retention_days))
+
+    # Skip the run if nothing changed since the latest stored one, as long as the retention keeps that run
+    appended = True
+    if not history.empty:
+        latest_timestamp = history['run_timestamp'].max()
+        latest = history.loc[history['run_timestamp'] == latest_timestamp, ['hotel', 'kpi', 'value']]
+        current = kpis_long[['hotel', 'kpi', 'value']]
+        sort_keys = ['hotel', 'kpi']
+        appended = (cutoff is not None and latest_timestamp < cutoff) or not latest.sort_values(
+            sort_keys).reset_index(drop=True).equals(current.sort_values(sort_keys).reset_index(drop=True))
+
+    if appended:
+        run = kpis_long.assign(run_timestamp=pd.Timestamp(run_timestamp))[history_columns]
+        history = run if history.empty else pd.concat([history, run], ignore_index=True)
+
+    # Drop the runs that fall outside the retention period, after the current run was appended
+    if cutoff is not None:
+        history = history.loc[history['run_timestamp'] >= cutoff]
+
+    temporary_path = f'{path}.tmp'
+    history.to_parquet(temporary_path, index=False)
+    os.replace(temporary_path, path)
+    return appended
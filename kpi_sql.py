@@ -0,0 +1,210 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from kpi_accumulators import finalize_kpis, finalize_market_segments
+from sketches import build_partition_sketches, merge_partition_sketches
+from dictionaries import all_hotels_label
+
+# SQL expression of every additive total in kpi_accumulators.hotel_total_columns
+hotel_total_expressions = {
+    'bookings': 'COUNT(*)',
+    'cancellations': 'SUM(is_canceled)',
+    'previous_cancellations': 'SUM(previous_cancellations)',
+    'adr_sum': 'SUM(adr)',
+    'lead_time_sum': 'SUM(lead_time)',
+    'guests': 'SUM(adults + total_kids)',
+    'nights': 'SUM(stays_in_week_nights + stays_in_weekend_nights)',
+}
+
+# SQL expression of every daily total in rolling_kpis.daily_columns
+daily_total_expressions = {
+    'bookings': 'COUNT(*)',
+    'cancellations': 'SUM(is_canceled)',
+    'adr_sum': 'SUM(adr)',
+    'lead_time_sum': 'SUM(lead_time)',
+    'guests': 'SUM(adults + total_kids)',
+    'nights': 'SUM(stays_in_week_nights + stays_in_weekend_nights)',
+}
+
+
+def _select_list(expressions):
+    return ', '.join(f'{expression} AS {name}' for name, expression in expressions.items())
+
+
+def hotel_totals_query(table_name='dashboard_data', dialect='postgresql'):
+    """
+    Builds the single grouped aggregate returning the totals of every hotel plus an overall row. PostgreSQL computes
+    the overall row with ROLLUP; databases without ROLLUP (e.g. SQLite) get the equivalent UNION ALL.
+
+    Args:
+    - table_name (str): The table holding the dashboard data.
+    - dialect (str): The SQLAlchemy dialect name of the database.
+
+    Returns:
+    - str: The SQL query. The overall row has a NULL hotel.
+    """
+    select_list = _select_list(hotel_total_expressions)
+    if dialect == 'postgresql':
+        return f"SELECT hotel, {select_list} FROM {table_name} GROUP BY ROLLUP (hotel)"
+    return (f"SELECT hotel, {select_list} FROM {table_name} GROUP BY hotel "
+            f"UNION ALL SELECT NULL AS hotel, {select_list} FROM {table_name}")
+
+
+def segment_totals_query(table_name='dashboard_data'):
+    # Bookings per market segment and hotel, the input of the market segment table
+    return (f"SELECT market_segment, hotel, COUNT(*) AS bookings FROM {table_name} "
+            f"GROUP BY market_segment, hotel")
+
+
+def daily_totals_query(table_name='dashboard_data'):
+    # Daily totals per hotel, the input of the rolling KPIs
+    return (f"SELECT hotel, arrival_date, {_select_list(daily_total_expressions)} FROM {table_name} "
+            f"GROUP BY hotel, arrival_date")
+
+
+def stay_groups_query(table_name='dashboard_data'):
+    # Stayed bookings grouped by hotel, arrival date and length of stay, the input of the occupancy KPIs
+    nights = 'stays_in_week_nights + stays_in_weekend_nights'
+    return (f"SELECT hotel, arrival_date, {nights} AS nights, COUNT(*) AS bookings, SUM(adr) AS adr_sum "
+            f"FROM {table_name} WHERE is_canceled = 0 GROUP BY hotel, arrival_date, {nights}")
+
+
+# Columns the sketches are built from (length_of_stay is derived from the two stay columns)
+sketch_source_columns = ['hotel', 'arrival_date', 'adr', 'lead_time', 'stays_in_week_nights',
+                         'stays_in_weekend_nights', 'country']
+
+
+def month_sketches_query(months, table_name='dashboard_data'):
+    """
+    Builds the query returning the columns of `sketch_source_columns` for the bookings that arrive in the given
+    months. Consecutive months are merged into one arrival date range, so the database only scans the partitions of
+    these months.
+
+    Args:
+    - months (list): The months to read ('YYYY-MM').
+    - table_name (str): The table holding the dashboard data.
+
+    Returns:
+    - tuple: The SQL query and its parameters.
+    """
+    periods = sorted(pd.Period(month, freq='M') for month in months)
+    ranges = []
+    for period in periods:
+        if ranges and ranges[-1][1] == period:
+            ranges[-1][1] = period + 1
+        else:
+            ranges.append([period, period + 1])
+
+    conditions, parameters = [], {}
+    for i, (start, end) in enumerate(ranges):
+        conditions.append(f"(arrival_date >= :start_{i} AND arrival_date < :end_{i})")
+        parameters[f'start_{i}'] = start.start_time.date()
+        parameters[f'end_{i}'] = end.start_time.date()
+    query = f"SELECT {', '.join(sketch_source_columns)} FROM {table_name} WHERE {' OR '.join(conditions)}"
+    return query, parameters
+
+
+def sql_month_sketches(engine, months, table_name='dashboard_data', chunksize=100_000):
+    """
+    Builds the sketches of the given months for the 'sql' backend. The sketches need the individual bookings, so the
+    narrow columns of the bookings of these months only are streamed from a server-side cursor and sketched chunk by
+    chunk; the sketches of the other months are the persisted ones.
+
+    Args:
+    - engine (sqlalchemy.engine.Engine): The connection to the database.
+    - months (list): The months to sketch ('YYYY-MM'), e.g. the result of `sketches.stale_sketch_months`.
+    - table_name (str): The table holding the dashboard data.
+    - chunksize (int): The number of rows read at once.
+
+    Returns:
+    - dict: {(hotel, period): {column: sketch}} for the bookings of these months.
+    """
+    if not months:
+        return {}
+    query, parameters = month_sketches_query(months, table_name)
+    partition_sketches = {}
+    with engine.connect().execution_options(stream_results=True) as connection:
+        for chunk in pd.read_sql(text(query), connection, params=parameters, chunksize=chunksize,
+                                 parse_dates=['arrival_date']):
+            partition_sketches = merge_partition_sketches(partition_sketches, build_partition_sketches(chunk))
+    return partition_sketches
+
+
+def sql_kpi_totals(engine, table_name='dashboard_data'):
+    """
+    Lets the database compute the totals behind the KPI table, the market segment table, the rolling KPIs and the
+    occupancy KPIs, so that only a few grouped rows are transferred instead of the whole table. The result has the
+    same layout as the accumulators of kpi_accumulators.py (without the sketches, which need the individual
+    bookings) and is finalized with the same functions.
+
+    Args:
+    - engine (sqlalchemy.engine.Engine): The connection to the database.
+    - table_name (str): The table holding the dashboard data.
+
+    Returns:
+    - dict: The 'hotels', 'segments', 'daily' and 'stay_groups' totals.
+    """
+    with engine.connect() as connection:
+        hotels = pd.read_sql(text(hotel_totals_query(table_name, engine.dialect.name)), connection)
+        segments = pd.read_sql(text(segment_totals_query(table_name)), connection)
+        daily = pd.read_sql(text(daily_totals_query(table_name)), connection, parse_dates=['arrival_date'])
+        stay_groups = pd.read_sql(text(stay_groups_query(table_name)), connection, parse_dates=['arrival_date'])
+
+    hotels['hotel'] = hotels['hotel'].fillna(all_hotels_label)
+    return {
+        'hotels': hotels.set_index('hotel'),
+        'segments': segments.pivot_table(index='market_segment', columns='hotel', values='bookings',
+                                         aggfunc='sum', fill_value=0),
+        'daily': daily.set_index(['hotel', 'arrival_date']).sort_index(),
+        'stay_groups': stay_groups,
+    }
+
+
+def compare_frames(expected, actual, tolerance=0.01):
+    """
+    Compares two KPI tables cell by cell and lists the cells that differ by more than the tolerance.
+
+    Args:
+    - expected (pandas.DataFrame): The reference table.
+    - actual (pandas.DataFrame): The table to check, with the same columns.
+    - tolerance (float): The largest accepted absolute difference, to absorb rounding of sums computed in a
+      different order.
+
+    Returns:
+    - pandas.DataFrame: The row, column, expected and actual value of every differing cell (empty if equivalent).
+    """
+    expected, actual = expected.align(actual, join='outer')
+    differences = ~np.isclose(expected.to_numpy(dtype=float), actual.to_numpy(dtype=float), rtol=0, atol=tolerance,
+                              equal_nan=True)
+    rows, columns = np.nonzero(differences)
+    return pd.DataFrame({
+        'row': expected.index[rows],
+        'column': expected.columns[columns],
+        'expected': expected.to_numpy()[rows, columns],
+        'actual': actual.to_numpy()[rows, columns],
+    })
+
+
+def verify_sql_kpis(engine, expected, table_name='dashboard_data', tolerance=0.01):
+    """
+    Computes the KPI, market segment and daily tables with the database aggregates and reports every cell where they
+    disagree with the tables of the pandas backend on the same table.
+
+    Args:
+    - engine (sqlalchemy.engine.Engine): The connection to the database (PostgreSQL, or SQLite/DuckDB as a stand-in).
+    - expected (dict): The 'kpis', 'market_segments' and 'daily' tables computed by the pandas backend.
+    - table_name (str): The table holding the dashboard data.
+    - tolerance (float): The largest accepted absolute difference.
+
+    Returns:
+    - pandas.DataFrame: The differing cells of the three tables (empty if the backends agree).
+    """
+    totals = sql_kpi_totals(engine, table_name)
+    actual = {
+        'kpis': finalize_kpis(totals['hotels']),
+        'market_segments': finalize_market_segments(totals['segments']),
+        'daily': totals['daily'],
+    }
+    differences = [compare_frames(expected[name], actual[name], tolerance).assign(table=name) for name in actual]
+    return pd.concat(differences, ignore_index=True)[['table', 'row', 'column', 'expected', 'actual']]
@@ -1,5 +1,6 @@
 # PREPROCESSING FOR is_canceled TARGET
 import os
+import time
 
 # IMPORT LIBRARIES
 from dotenv import load_dotenv
@@ -28,451 +29,723 @@ from cleaning import (
 
 from dictionaries import country_to_category  # Dictionary that maps countries to predefined categories
 
-# Suppress future warnings that may clutter output
-import warnings
-warnings.simplefilter(action='ignore', category=FutureWarning)
-
-# Import statistical functions and tools from statsmodels for multicollinearity checks
-# from statsmodels.stats.outliers_influence import variance_inflation_factor  # Calculates VIF
-# from statsmodels.tools.tools import add_constant                            # Adds constant column for regression
-
-# Allow display of all DataFrame columns (useful when inspecting wide datasets)
-pd.options.display.max_columns = 999
-# =====================================================================================================================
-# FETCH DATA FROM THE DATABASE
-
-username = os.getenv('postgresuser')
-password = os.getenv('password')
-host = os.getenv('host')
-port = os.getenv('port')
-db_name = os.getenv('db_name')
-
-# Set up the connection to the local PostgreSQL database
-engine = create_engine(f'postgresql://{username}:{password}@{host}:{port}/{db_name}')
-
-# Fetch data from the 'hotel_booking' table
-query = "SELECT * FROM hotel_booking"
-df_raw = pd.read_sql(query, engine)
-
-# Create a second file for KPIs calculation
-dfdash = df_raw.copy()
-# =====================================================================================================================
-# HANDLING NaNs
-# Explore the NaNs:
-# df_raw.isna().sum()
-# Make a working copy of the raw dataset to avoid altering the original
-df2 = df_raw.copy()
-
-# Fill missing values in 'children' column with the most frequent value (mode)
-df2['children'] = df2['children'].fillna(value=df2['children'].mode()[0])
-
-# Replace missing values in 'agent' with 0, indicating direct bookings without a travel agent
-df2['agent'] = df2['agent'].fillna(value=0)
-
-# Replace missing values in 'company' with 0, meaning bookings not linked to any company
-df2['company'] = df2['company'].fillna(value=0)
-
-# Drop all rows with missing 'country' values, since location info is important for analysis
-df2 = df2.drop(labels=df2.loc[df2['country'].isna()].index)
-
-# DASHBOARD DATAFRAME CLEANING (same logic as above) #####
-dfdash2 = dfdash.copy() 
-
-# Fill missing values similarly for dashboard DataFrame
-dfdash2['children'] = dfdash2['children'].fillna(value=dfdash2['children'].mode()[0])
-dfdash2['agent'] = dfdash2['agent'].fillna(value=0)
-dfdash2['company'] = dfdash2['company'].fillna(value=0)
-dfdash2 = dfdash2.drop(labels=dfdash2.loc[dfdash2['country'].isna()].index)
-# =====================================================================================================================
-# HANDLING DATE-RELATED COLUMNS
-df3 = df2.copy()
-
-# Create a dictionary to convert month names to their corresponding numeric values (as strings)
-month_mapping = {
-    "January": '1', "February": '2', "March": '3', "April": '4', "May": '5', "June": '6',
-    "July": '7', "August": '8', "September": '9', "October": '10', "November": '11', "December": '12'
-}
-
-# Map month names in 'arrival_date_month' column to their numeric equivalents and convert them to integers
-df3['arrival_date_month'] = df3['arrival_date_month'].map(month_mapping).astype(int)
-
-# DASHBOARD DATAFRAME
-dfdash3 = dfdash2.copy()
-
-# Map month names to integers using the same dictionary
-dfdash3['arrival_date_month'] = dfdash3['arrival_date_month'].map(month_mapping).astype(int)
-
-# Combine year, month, and day columns into a single date string in 'YYYY-MM-DD' format
-dfdash3['arrival_date'] = (
-    dfdash3['arrival_date_year'].astype(str) + '-' +
-    dfdash3['arrival_date_month'].astype(str) + '-' +
-    dfdash3['arrival_date_day_of_month'].astype(str)
+# Import the row fingerprinting helpers used to detect duplicate bookings across runs
+from duplicates import (
+    personal_columns,  # The guest's personal data, never persisted
+    row_fingerprints,  # Function to hash the business columns of every row
+    load_fingerprint_index,  # Function to load the fingerprints persisted by previous runs
+    save_fingerprint_index,  # Function to persist the updated fingerprints
+    update_fingerprint_index,  # Function to merge new fingerprints into the index
+    in_fingerprint_index,  # Function to check which rows were already seen in previous runs
+    flag_duplicates,  # Function to flag rows that repeat an earlier booking
+    booking_keys  # Function to derive a unique key per row from the fingerprints
 )
 
-# Convert the date strings into proper datetime objects for easier time-based analysis
-dfdash3['arrival_date'] = pd.to_datetime(dfdash3['arrival_date'], format='%Y-%m-%d')
-
-# As expected, the month of arrival is very strongly correlated with the week number of arrival.
-# Let's confirm this by calculating their correlation:
-df3['arrival_date_month'].corr(df3['arrival_date_week_number'])
+# Import the outlier thresholds and the what-if analysis data (KPIs under other thresholds, see what_if.py)
+from what_if import current_thresholds, what_if_data
 
-# Since they are highly correlated, we can safely drop 'arrival_date_week_number' to reduce redundancy.
-df3 = df3.drop(columns='arrival_date_week_number')
-
-# Apply custom functions to perform cyclic encoding on the 'arrival_date_month' and 'arrival_date_day_of_month' column.
-# This helps machine learning models better understand the cyclical nature of months and days of months.
-df4 = month_components_calculation(dataframe=df3, month_columns=['arrival_date_month'])
-df5 = day_components_calculation(dataframe=df4,
-                                 year_columns=['arrival_date_year'],
-                                 month_columns=['arrival_date_month'],
-                                 day_columns=['arrival_date_day_of_month'])
-# =====================================================================================================================
-# Functions for Testing
+# Import the publishers that maintain the partitioned dashboard table (flat, or as a star schema)
+from publishing import publish_partitioned, publish_star, current_publication_mode
 
-# test_month_components_calculation(df4, month_columns=['arrival_date_month'])
-
-# test_day_components_calculation(dataframe=df5, year_columns=['arrival_date_year'],
-#                                 month_columns=['arrival_date_month'],
-#                                 day_columns=['arrival_date_day_of_month']
-#                            )
-# =====================================================================================================================
-# CHECK FOR DUPLICATES
-
-# Count the number of fully duplicated rows in the preprocessed main dataframe
-df5.duplicated().sum()
-# =====================================================================================================================
-# DROP UNIMPORTANT AND FUTURE INFORMATION COLUMNS
-df6 = df5.copy()
+# Import the stage checkpoints used to resume a failed run from its last completed stage
+from checkpoints import current_run_id, input_fingerprint, load_checkpoint, save_checkpoint
 
-# List of columns to be dropped as they are not needed for analysis
-cols_to_be_dropped = ['name', 'email', 'arrival_date_month', 'arrival_date_day_of_month', 'phone-number',
-                      'credit_card', 'reservation_status', 'reservation_status_date', 'assigned_room_type',
-                      'deposit_type', 'required_car_parking_spaces']
+# Import the aggregate summary of hotel_booking, so an extraction checkpoint is only reused for the same source data
+from scheduler import source_signature, passed_signature
 
-# Drop the columns specified in 'cols_to_be_dropped'
-df6 = df6.drop(columns=cols_to_be_dropped)
-
-# DASHBOARD DATAFRAME
-# List of columns to be dropped from the dashboard dataframe
-dashcols_to_be_dropped = ['name', 'email', 'arrival_date_month', 'arrival_date_day_of_month', 'phone-number',
-                          'credit_card', 'reservation_status', 'reservation_status_date', 'assigned_room_type',
-                          'deposit_type', 'required_car_parking_spaces', 'arrival_date_week_number']
-
-# Create a copy of the dashboard dataframe for further processing
-dfdash4 = dfdash3.copy()
+# Import the sample mode helpers (stratified extraction and sample-suffixed outputs)
+from sampling import (
+    current_sample_fraction,  # Function to read the fraction set by run_all.py --sample (None for a full run)
+    current_sample_seed,  # Function to read the seed of the sample
+    stratified_sample_query,  # Function to build the stratified sample extraction query
+    sample_columns,  # Helper columns of the sample query
+    output_name  # Function to add the sample suffix to the outputs in sample mode
+)
 
-# Drop the unimportant columns from the dashboard dataframe
-dfdash4 = dfdash4.drop(columns=dashcols_to_be_dropped)
-# =====================================================================================================================
-# CREATING total_kids COLUMN
-df7 = df6.copy()
+# Import the vectorized invariant checks that fail the run before anything is published
+from validation import (
+    check_date_components,  # Function to check the date columns and their cyclical encoding
+    check_model_data,  # Function to check NaNs, dtypes, components and the one-hot schema of the model data
+    expected_one_hot_columns,  # Function to list the one-hot columns the encoding must create
+    load_schema,  # Function to load the one-hot columns of the last validated run
+    save_schema,  # Function to persist the validated one-hot columns
+    report_validation,  # Function to report the outcome and the cost of a validation
+    raise_for_problems  # Function to stop the run with every problem found
+)
 
-# Merge the 'children' and 'babies' columns to create a new column 'total_kids' representing the total number of kids
-df7['total_kids'] = df7['children'].astype(int) + df7['babies'].astype(int)
+# Import the scoring stage that adds the predicted cancellation risk to the dashboard data
+from scoring import (
+    load_classifier,  # Function to load the persisted classifier
+    classifier_version,  # Function to hash the classifier file, so its scores are recomputed when it is replaced
+    feature_matrix,  # Function to select the exact feature columns the classifier was trained on
+    score_in_chunks,  # Function to score fixed-size chunks of rows on a process pool
+    join_scores  # Function to add the probabilities to the dashboard rows of the same bookings
+)
 
-# Drop the original 'children' and 'babies' columns after merging
-df7 = df7.drop(columns=['children', 'babies'])
+# Suppress future warnings that may clutter output
+import warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
 
-# Drop rows with outliers (total kids > 3) and reset index
-df7 = df7.loc[df7['total_kids'] <= 3].reset_index(drop=True)
+# Import statistical functions and tools from statsmodels for multicollinearity checks
+# from statsmodels.stats.outliers_influence import variance_inflation_factor  # Calculates VIF
+# from statsmodels.tools.tools import add_constant                            # Adds constant column for regression
 
-# DASHBOARD DATAFRAME
-# Create a copy of the dashboard dataframe to perform the same operations
-dfdash5 = dfdash4.copy()
+# Draw the exploratory plots only when explicitly requested
+show_plots = os.getenv('show_plots') == '1'
 
-# Merge the 'children' and 'babies' columns to create a new column 'total_kids' representing the total number of kids
-dfdash5['total_kids'] = dfdash5['children'].astype(int) + dfdash5['babies'].astype(int)
+# Classifier used to score the cancellation risk of every booking, and number of scoring processes (default: all cores)
+classifier_file = os.getenv('cancellation_model', 'cancellation_model.pkl')
+scoring_workers = int(os.getenv('scoring_workers', '0')) or None
 
-# Drop the original 'children' and 'babies' columns after merging
-dfdash5 = dfdash5.drop(columns=['children', 'babies'])
+# 'flat' (default) publishes dashboard_data as one wide table, 'star' as a fact table of small-integer codes plus one
+# dimension table per categorical column, behind a dashboard_data view with the same columns (dashboard_schema=star)
+publication_mode = current_publication_mode()
 
-# Drop rows with outliers (total kids > 3) and reset index in the dashboard dataframe
-dfdash5 = dfdash5.loc[dfdash5['total_kids'] <= 3].reset_index(drop=True)
+# Allow display of all DataFrame columns (useful when inspecting wide datasets)
+pd.options.display.max_columns = 999
 # =====================================================================================================================
-# HANDLING adults COLUMN
-
-# There are observations where both adults and total_kids equal 0. This can't be explained and therefore all rows where
-# adults=0 will be dropped. Additionally, in all cases where adults were greater than 4 the bookings were canceled and
-# the adr equals 0. For this reason, values for adults from 1 to 4 are considered the most explainable and normal.
-# We will drop all other values.
+# FETCH DATA FROM THE DATABASE
 
-df8 = df7.copy()
+def create_database_engine():
+    """
+    This function sets up the connection to the local PostgreSQL database from the credentials of the environment
+    (.env file).
 
-# Exclude bookings where the number of adults is 0. Also, ensure that the number of adults is between 1 and 4.
-df8 = df8[(df8['adults'] > 0) & (df8['adults'] <= 4)].reset_index(drop=True)
+    Returns:
+    - sqlalchemy.engine.Engine: The engine of the database.
+    """
+    username = os.getenv('postgresuser')
+    password = os.getenv('password')
+    host = os.getenv('host')
+    port = os.getenv('port')
+    db_name = os.getenv('db_name')
+    return create_engine(f'postgresql://{username}:{password}@{host}:{port}/{db_name}')
 
-# DASHBOARD DATAFRAME
-# Create a copy of the dashboard dataframe to perform the same operations
-dfdash6 = dfdash5.copy()
 
-# Exclude bookings where the number of adults is 0. Also, ensure that the number of adults is between 1 and 4.
-dfdash6 = dfdash6[(dfdash6['adults'] > 0) & (dfdash6['adults'] <= 4)].reset_index(drop=True)
 # =====================================================================================================================
-# HANDLING meal COLUMN
-df9 = df8.copy()
+# CLEANING TRUNK
+def clean_bookings(df_raw, dfdash):
+    """
+    This function runs the cleaning steps of both dataframes, from the NaNs to the outliers: the model data is
+    prepared for the encoding and the dashboard data for publication.
+
+    Args:
+    - df_raw (pandas.DataFrame): The extracted bookings, the source of the model data.
+    - dfdash (pandas.DataFrame): The copy of the bookings that becomes the dashboard data.
+
+    Returns:
+    - tuple: The cleaned model data and the cleaned dashboard data.
+    """
+    # HANDLING NaNs
+    # Explore the NaNs:
+    # df_raw.isna().sum()
+    # Make a working copy of the raw dataset to avoid altering the original
+    df2 = df_raw.copy()
+
+    # Fill missing values in 'children' column with the most frequent value (mode)
+    df2['children'] = df2['children'].fillna(value=df2['children'].mode()[0])
+
+    # Replace missing values in 'agent' with 0, indicating direct bookings without a travel agent
+    df2['agent'] = df2['agent'].fillna(value=0)
+
+    # Replace missing values in 'company' with 0, meaning bookings not linked to any company
+    df2['company'] = df2['company'].fillna(value=0)
+
+    # Drop all rows with missing 'country' values, since location info is important for analysis
+    df2 = df2.drop(labels=df2.loc[df2['country'].isna()].index)
+
+    # DASHBOARD DATAFRAME CLEANING (same logic as above) #####
+    dfdash2 = dfdash.copy() 
+
+    # Fill missing values similarly for dashboard DataFrame
+    dfdash2['children'] = dfdash2['children'].fillna(value=dfdash2['children'].mode()[0])
+    dfdash2['agent'] = dfdash2['agent'].fillna(value=0)
+    dfdash2['company'] = dfdash2['company'].fillna(value=0)
+    dfdash2 = dfdash2.drop(labels=dfdash2.loc[dfdash2['country'].isna()].index)
+    # =================================================================================================================
+    # HANDLING DATE-RELATED COLUMNS
+    df3 = df2.copy()
+
+    # Create a dictionary to convert month names to their corresponding numeric values (as strings)
+    month_mapping = {
+        "January": '1', "February": '2', "March": '3', "April": '4', "May": '5', "June": '6',
+        "July": '7', "August": '8', "September": '9', "October": '10', "November": '11', "December": '12'
+    }
+
+    # Map month names in 'arrival_date_month' column to their numeric equivalents and convert them to integers
+    df3['arrival_date_month'] = df3['arrival_date_month'].map(month_mapping).astype(int)
+
+    # DASHBOARD DATAFRAME
+    dfdash3 = dfdash2.copy()
+
+    # Map month names to integers using the same dictionary
+    dfdash3['arrival_date_month'] = dfdash3['arrival_date_month'].map(month_mapping).astype(int)
+
+    # Combine year, month, and day columns into a single date string in 'YYYY-MM-DD' format
+    dfdash3['arrival_date'] = (
+        dfdash3['arrival_date_year'].astype(str) + '-' +
+        dfdash3['arrival_date_month'].astype(str) + '-' +
+        dfdash3['arrival_date_day_of_month'].astype(str)
+    )
+
+    # Convert the date strings into proper datetime objects for easier time-based analysis
+    dfdash3['arrival_date'] = pd.to_datetime(dfdash3['arrival_date'], format='%Y-%m-%d')
+
+    # As expected, the month of arrival is very strongly correlated with the week number of arrival.
+    # Let's confirm this by calculating their correlation:
+    df3['arrival_date_month'].corr(df3['arrival_date_week_number'])
+
+    # Since they are highly correlated, we can safely drop 'arrival_date_week_number' to reduce redundancy.
+    df3 = df3.drop(columns='arrival_date_week_number')
+
+    # Apply custom functions to perform cyclic encoding on the 'arrival_date_month' and 'arrival_date_day_of_month'
+    # column.
+    # This helps machine learning models better understand the cyclical nature of months and days of months.
+    df4 = month_components_calculation(dataframe=df3, month_columns=['arrival_date_month'])
+    df5 = day_components_calculation(dataframe=df4,
+                                     year_columns=['arrival_date_year'],
+                                     month_columns=['arrival_date_month'],
+                                     day_columns=['arrival_date_day_of_month'])
+    # =================================================================================================================
+    # Functions for Testing
+
+    # test_month_components_calculation(df4, month_columns=['arrival_date_month'])
+
+    # test_day_components_calculation(dataframe=df5, year_columns=['arrival_date_year'],
+    #                                 month_columns=['arrival_date_month'],
+    #                                 day_columns=['arrival_date_day_of_month']
+    #                            )
+
+    # The same invariants, checked with vectorized reductions on the full data: the run stops here if a month or a
+    # day is invalid (given leap years) or if a component is NaN, outside [-1, 1] or does not encode its value.
+    validation_start = time.perf_counter()
+    date_problems = check_date_components(df5)
+    report_validation('the date components', date_problems, len(df5), time.perf_counter() - validation_start)
+    raise_for_problems('the date components', date_problems)
+    # =================================================================================================================
+    # DROP UNIMPORTANT AND FUTURE INFORMATION COLUMNS
+    df6 = df5.copy()
+
+    # List of columns to be dropped as they are not needed for analysis
+    # (the personal columns were dropped at the extraction)
+    cols_to_be_dropped = ['arrival_date_month', 'arrival_date_day_of_month', 'reservation_status',
+                          'reservation_status_date', 'assigned_room_type', 'deposit_type',
+                          'required_car_parking_spaces']
+
+    # Drop the columns specified in 'cols_to_be_dropped'
+    df6 = df6.drop(columns=cols_to_be_dropped)
+
+    # DASHBOARD DATAFRAME
+    # List of columns to be dropped from the dashboard dataframe
+    dashcols_to_be_dropped = ['arrival_date_month', 'arrival_date_day_of_month', 'reservation_status',
+                              'reservation_status_date', 'assigned_room_type', 'deposit_type',
+                              'required_car_parking_spaces', 'arrival_date_week_number']
+
+    # Create a copy of the dashboard dataframe for further processing
+    dfdash4 = dfdash3.copy()
+
+    # Drop the unimportant columns from the dashboard dataframe
+    dfdash4 = dfdash4.drop(columns=dashcols_to_be_dropped)
+    # =================================================================================================================
+    # CREATING total_kids COLUMN
+    df7 = df6.copy()
+
+    # Merge the 'children' and 'babies' columns to create a new column 'total_kids' representing the total number of
+    # kids
+    df7['total_kids'] = df7['children'].astype(int) + df7['babies'].astype(int)
+
+    # Drop the original 'children' and 'babies' columns after merging
+    df7 = df7.drop(columns=['children', 'babies'])
+
+    # Drop rows with outliers (total kids > 3) and reset index
+    df7 = df7.loc[df7['total_kids'] <= 3].reset_index(drop=True)
+
+    # DASHBOARD DATAFRAME
+    # Create a copy of the dashboard dataframe to perform the same operations
+    dfdash5 = dfdash4.copy()
+
+    # Merge the 'children' and 'babies' columns to create a new column 'total_kids' representing the total number of
+    # kids
+    dfdash5['total_kids'] = dfdash5['children'].astype(int) + dfdash5['babies'].astype(int)
+
+    # Drop the original 'children' and 'babies' columns after merging
+    dfdash5 = dfdash5.drop(columns=['children', 'babies'])
+
+    # Drop rows with outliers (total kids > 3) and reset index in the dashboard dataframe
+    dfdash5 = dfdash5.loc[dfdash5['total_kids'] <= 3].reset_index(drop=True)
+    # =================================================================================================================
+    # HANDLING adults COLUMN
+
+    # There are observations where both adults and total_kids equal 0. This can't be explained and therefore all rows
+    # where adults=0 will be dropped. Additionally, in all cases where adults were greater than 4 the bookings were
+    # canceled and the adr equals 0. For this reason, values for adults from 1 to 4 are considered the most
+    # explainable and normal. We will drop all other values.
+
+    df8 = df7.copy()
+
+    # Exclude bookings where the number of adults is 0. Also, ensure that the number of adults is between 1 and 4.
+    df8 = df8[(df8['adults'] > 0) & (df8['adults'] <= 4)].reset_index(drop=True)
 
-# Drop rows where the 'meal' column is 'Undefined', indicating no meal choice
-df9 = df9.drop(labels=df9[df9['meal'] == 'Undefined'].index).reset_index(drop=True)
+    # DASHBOARD DATAFRAME
+    # Create a copy of the dashboard dataframe to perform the same operations
+    dfdash6 = dfdash5.copy()
+
+    # Exclude bookings where the number of adults is 0. Also, ensure that the number of adults is between 1 and 4.
+    dfdash6 = dfdash6[(dfdash6['adults'] > 0) & (dfdash6['adults'] <= 4)].reset_index(drop=True)
+    # =================================================================================================================
+    # HANDLING meal COLUMN
+    df9 = df8.copy()
+
+    # Drop rows where the 'meal' column is 'Undefined', indicating no meal choice
+    df9 = df9.drop(labels=df9[df9['meal'] == 'Undefined'].index).reset_index(drop=True)
+
+    # Rename the 'meal' column to 'number_of_meals' for clarity
+    df9 = df9.rename(columns={'meal': 'number_of_meals'})
+
+    # Create a dictionary to map meal types to numerical values
+    meal_mapping = {'BB': 1, 'HB': 2, 'SC': 0, 'FB': 3}
 
-# Rename the 'meal' column to 'number_of_meals' for clarity
-df9 = df9.rename(columns={'meal': 'number_of_meals'})
+    # Map the dictionary to the 'number_of_meals' column, reducing complexity
+    df9['number_of_meals'] = df9['number_of_meals'].map(meal_mapping).astype(int)
 
-# Create a dictionary to map meal types to numerical values
-meal_mapping = {'BB': 1, 'HB': 2, 'SC': 0, 'FB': 3}
+    # *** Ultimately, the 'meal' feature was reduced from 5 categories to 3 categories! ***
 
-# Map the dictionary to the 'number_of_meals' column, reducing complexity
-df9['number_of_meals'] = df9['number_of_meals'].map(meal_mapping).astype(int)
+    # DASHBOARD DATAFRAME
+    # Create a copy of the dashboard dataframe to perform the same operations
+    dfdash7 = dfdash6.copy()
 
-# *** Ultimately, the 'meal' feature was reduced from 5 categories to 3 categories! ***
+    # Drop rows where the 'meal' column is 'Undefined', indicating no meal choice
+    dfdash7 = dfdash7.drop(labels=dfdash7[dfdash7['meal'] == 'Undefined'].index).reset_index(drop=True)
 
-# DASHBOARD DATAFRAME
-# Create a copy of the dashboard dataframe to perform the same operations
-dfdash7 = dfdash6.copy()
+    # Rename the 'meal' column to 'number_of_meals' for clarity
+    dfdash7 = dfdash7.rename(columns={'meal': 'number_of_meals'})
 
-# Drop rows where the 'meal' column is 'Undefined', indicating no meal choice
-dfdash7 = dfdash7.drop(labels=dfdash7[dfdash7['meal'] == 'Undefined'].index).reset_index(drop=True)
+    # Map the dictionary to the 'number_of_meals' column, reducing complexity
+    dfdash7['number_of_meals'] = dfdash7['number_of_meals'].map(meal_mapping).astype(int)
+    # =================================================================================================================
+    # HANDLING country COLUMN
+    df10 = df9.copy()
 
-# Rename the 'meal' column to 'number_of_meals' for clarity
-dfdash7 = dfdash7.rename(columns={'meal': 'number_of_meals'})
+    # Map the 'country' column values to a smaller set of categories using the 'country_to_category' dictionary.
+    # This reduces 177 unique country values to only 15.
+    df10['country'] = df10['country'].map(country_to_category).astype('category')
 
-# Map the dictionary to the 'number_of_meals' column, reducing complexity
-dfdash7['number_of_meals'] = dfdash7['number_of_meals'].map(meal_mapping).astype(int)
-# =====================================================================================================================
-# HANDLING country COLUMN
-df10 = df9.copy()
+    # Drop the rows where the 'country' column is 'Antarctica', as it represents very few bookings and will reduce
+    # model complexity.
+    df10 = df10.drop(labels=df10[df10['country'] == 'Antarctica'].index, axis=0).reset_index(drop=True)
 
-# Map the 'country' column values to a smaller set of categories using the 'country_to_category' dictionary.
-# This reduces 177 unique country values to only 15.
-df10['country'] = df10['country'].map(country_to_category).astype('category')
+    # Remove 'Antarctica' from the category list, as it has been dropped.
+    df10['country'] = df10['country'].cat.remove_categories('Antarctica')
 
-# Drop the rows where the 'country' column is 'Antarctica', as it represents very few bookings and will reduce
-# model complexity.
-df10 = df10.drop(labels=df10[df10['country'] == 'Antarctica'].index, axis=0).reset_index(drop=True)
+    # Drop any rows with NaN values to ensure clean data.
+    df10 = df10.dropna()
 
-# Remove 'Antarctica' from the category list, as it has been dropped.
-df10['country'] = df10['country'].cat.remove_categories('Antarctica')
+    # *** Ultimately, the 'country' feature was reduced from 177 categories to only 15 categories! ***
+    # =================================================================================================================
+    # HANDLING market_segment COLUMN
+    df11 = df10.copy()
 
-# Drop any rows with NaN values to ensure clean data.
-df10 = df10.dropna()
+    # Drop all rows where the 'market_segment' column has the category 'Undefined', as it includes very few observations
+    df11 = df11.drop(labels=df11[df11['market_segment'] == 'Undefined'].index).reset_index(drop=True)
 
-# *** Ultimately, the 'country' feature was reduced from 177 categories to only 15 categories! ***
-# =====================================================================================================================
-# HANDLING market_segment COLUMN
-df11 = df10.copy()
+    # Replace the 'Complementary' and 'Aviation' categories in the 'market_segment' column with 'Other' to consolidate
+    # rare categories
+    df11['market_segment'] = df11['market_segment'].replace(
+        {'Complementary': 'Other', 'Aviation': 'Other'}).astype('category')
 
-# Drop all rows where the 'market_segment' column has the category 'Undefined', as it includes very few observations
-df11 = df11.drop(labels=df11[df11['market_segment'] == 'Undefined'].index).reset_index(drop=True)
+    # *** Ultimately, the 'market_segment' feature was reduced from 8 to 5 categories! ***
 
-# Replace the 'Complementary' and 'Aviation' categories in the 'market_segment' column with 'Other' to consolidate
-# rare categories
-df11['market_segment'] = df11['market_segment'].replace(
-    {'Complementary': 'Other', 'Aviation': 'Other'}).astype('category')
+    # DASHBOARD DATAFRAME
+    # Copy the dashboard dataframe
+    dfdash8 = dfdash7.copy()
 
-# *** Ultimately, the 'market_segment' feature was reduced from 8 to 5 categories! ***
+    # Drop all rows where the 'market_segment' column has the category 'Undefined'
+    dfdash8 = dfdash8.drop(labels=dfdash8[dfdash8['market_segment'] == 'Undefined'].index).reset_index(drop=True)
 
-# DASHBOARD DATAFRAME
-# Copy the dashboard dataframe
-dfdash8 = dfdash7.copy()
+    # Replace the 'Complementary' and 'Aviation' categories in the 'market_segment' column with 'Other'
+    dfdash8['market_segment'] = dfdash8['market_segment'].replace(
+        {'Complementary': 'Other', 'Aviation': 'Other'}).astype('category')
+    # =================================================================================================================
+    # HANDLING distribution_channel COLUMN
+    df12 = df11.copy()
 
-# Drop all rows where the 'market_segment' column has the category 'Undefined'
-dfdash8 = dfdash8.drop(labels=dfdash8[dfdash8['market_segment'] == 'Undefined'].index).reset_index(drop=True)
+    # Drop all rows where the 'distribution_channel' column has the category 'Undefined', as it includes very few
+    # observations
+    df12 = df12.drop(labels=df12[df12['distribution_channel'] == 'Undefined'].index).reset_index(drop=True)
 
-# Replace the 'Complementary' and 'Aviation' categories in the 'market_segment' column with 'Other'
-dfdash8['market_segment'] = dfdash8['market_segment'].replace(
-    {'Complementary': 'Other', 'Aviation': 'Other'}).astype('category')
-# =====================================================================================================================
-# HANDLING distribution_channel COLUMN
-df12 = df11.copy()
+    # Convert the 'distribution_channel' column to categorical type
+    df12['distribution_channel'] = df12['distribution_channel'].astype('category')
 
-# Drop all rows where the 'distribution_channel' column has the category 'Undefined', as it includes very few
-# observations
-df12 = df12.drop(labels=df12[df12['distribution_channel'] == 'Undefined'].index).reset_index(drop=True)
+    # *** Ultimately, the 'distribution_channel' feature was reduced from 5 to 3 categories! ***
+
+    # DASHBOARD DATAFRAME
+    # Copy the dashboard dataframe
+    dfdash9 = dfdash8.copy()
 
-# Convert the 'distribution_channel' column to categorical type
-df12['distribution_channel'] = df12['distribution_channel'].astype('category')
+    # Drop all rows where the 'distribution_channel' column has the category 'Undefined'
+    dfdash9 = dfdash9.drop(labels=dfdash9[dfdash9['distribution_channel'] == 'Undefined'].index).reset_index(drop=True)
+
+    # Convert the 'distribution_channel' column to categorical type
+    dfdash9['distribution_channel'] = dfdash9['distribution_channel'].astype('category')
+    # =================================================================================================================
+    # HANDLING reserved_room_type COLUMN
+    df13 = df12.copy()
+
+    # Merge categories in the 'reserved_room_type' column, combining multiple categories into 'Other'
+    df13['reserved_room_type'] = df13['reserved_room_type'].replace(
+        {'C': 'Other', 'B': 'Other', 'H': 'Other', 'L': 'Other'}).astype('category')
 
-# *** Ultimately, the 'distribution_channel' feature was reduced from 5 to 3 categories! ***
+    # DASHBOARD DATAFRAME
+    # Copy the dashboard dataframe
+    dfdash10 = dfdash9.copy()
 
-# DASHBOARD DATAFRAME
-# Copy the dashboard dataframe
-dfdash9 = dfdash8.copy()
+    # Merge categories in the 'reserved_room_type' column, combining multiple categories into 'Other'
+    dfdash10['reserved_room_type'] = dfdash10['reserved_room_type'].replace(
+        {'C': 'Other', 'B': 'Other', 'H': 'Other', 'L': 'Other'}).astype('category')
 
-# Drop all rows where the 'distribution_channel' column has the category 'Undefined'
-dfdash9 = dfdash9.drop(labels=dfdash9[dfdash9['distribution_channel'] == 'Undefined'].index).reset_index(drop=True)
+    # *** Ultimately, the 'reserved_room_type' feature was reduced from 9 to 6 categories! ***
+    # =================================================================================================================
+    # HANDLING agent & company COLUMNS
+    df14 = df13.copy()
 
-# Convert the 'distribution_channel' column to categorical type
-dfdash9['distribution_channel'] = dfdash9['distribution_channel'].astype('category')
-# =====================================================================================================================
-# HANDLING reserved_room_type COLUMN
-df13 = df12.copy()
+    # Convert 'agent' column to binary: 1 if not 0, else 0
+    df14['agent'] = df14['agent'].apply(lambda x: 1 if x != 0 else 0)
 
-# Merge categories in the 'reserved_room_type' column, combining multiple categories into 'Other'
-df13['reserved_room_type'] = df13['reserved_room_type'].replace(
-    {'C': 'Other', 'B': 'Other', 'H': 'Other', 'L': 'Other'}).astype('category')
+    # Convert 'company' column to binary: 1 if not 0, else 0
+    df14['company'] = df14['company'].apply(lambda x: 1 if x != 0 else 0)
 
-# DASHBOARD DATAFRAME
-# Copy the dashboard dataframe
-dfdash10 = dfdash9.copy()
+    # Rename the columns to more intuitive names
+    df14 = df14.rename(columns={'agent': 'has_agent', 'company': 'has_company'})
 
-# Merge categories in the 'reserved_room_type' column, combining multiple categories into 'Other'
-dfdash10['reserved_room_type'] = dfdash10['reserved_room_type'].replace(
-    {'C': 'Other', 'B': 'Other', 'H': 'Other', 'L': 'Other'}).astype('category')
+    # DASHBOARD DATAFRAME
+    # Copy the dashboard dataframe
+    dfdash11 = dfdash10.copy()
 
-# *** Ultimately, the 'reserved_room_type' feature was reduced from 9 to 6 categories! ***
-# =====================================================================================================================
-# HANDLING agent & company COLUMNS
-df14 = df13.copy()
+    # Convert 'agent' column to binary: 1 if not 0, else 0
+    dfdash11['agent'] = dfdash11['agent'].apply(lambda x: 1 if x != 0 else 0)
 
-# Convert 'agent' column to binary: 1 if not 0, else 0
-df14['agent'] = df14['agent'].apply(lambda x: 1 if x != 0 else 0)
+    # Convert 'company' column to binary: 1 if not 0, else 0
+    dfdash11['company'] = dfdash11['company'].apply(lambda x: 1 if x != 0 else 0)
 
-# Convert 'company' column to binary: 1 if not 0, else 0
-df14['company'] = df14['company'].apply(lambda x: 1 if x != 0 else 0)
+    # Rename the columns to more intuitive names
+    dfdash11 = dfdash11.rename(columns={'agent': 'has_agent', 'company': 'has_company'})
+    # =================================================================================================================
+    # HANDLING previous_cancellations AND previous_bookings_not_canceled COLUMNS
+    df15 = df14.copy()
 
-# Rename the columns to more intuitive names
-df14 = df14.rename(columns={'agent': 'has_agent', 'company': 'has_company'})
+    # Apply transformation to 'previous_cancellations' column:
+    # Set to 2 if greater than or equal to 2, 0 if less than 1, else leave as is
+    df15['previous_cancellations'] = df15['previous_cancellations'].apply(
+        lambda x: 2 if x >= 2 else (0 if x < 1 else x))
 
-# DASHBOARD DATAFRAME
-# Copy the dashboard dataframe
-dfdash11 = dfdash10.copy()
+    # Apply transformation to 'previous_bookings_not_canceled' column:
+    # Set to 2 if greater than or equal to 2, 0 if less than 1, else leave as is
+    df15['previous_bookings_not_canceled'] = df15['previous_bookings_not_canceled'].apply(
+        lambda x: 2 if x >= 2 else (0 if x < 1 else x))
 
-# Convert 'agent' column to binary: 1 if not 0, else 0
-dfdash11['agent'] = dfdash11['agent'].apply(lambda x: 1 if x != 0 else 0)
+    # Rename the columns to more intuitive names
+    df15 = df15.rename(columns={'previous_cancellations': 'number_of_previous_cancellations',
+                                'previous_bookings_not_canceled': 'number_of_previous_bookings_not_canceled'})
+    # =================================================================================================================
+    # HANDLING booking_changes AND total_of_special_requests COLUMNS
+    df16 = df15.copy()
 
-# Convert 'company' column to binary: 1 if not 0, else 0
-dfdash11['company'] = dfdash11['company'].apply(lambda x: 1 if x != 0 else 0)
+    # Apply transformation to 'booking_changes' column:
+    # Set to 3 if greater than 2, 2 if equal to 2, 1 if equal to 1, else leave as is
+    df16['booking_changes'] = df16['booking_changes'].apply(
+        lambda x: 3 if x > 2 else (2 if x == 2 else (1 if x == 1 else x)))
 
-# Rename the columns to more intuitive names
-dfdash11 = dfdash11.rename(columns={'agent': 'has_agent', 'company': 'has_company'})
-# =====================================================================================================================
-# HANDLING previous_cancellations AND previous_bookings_not_canceled COLUMNS
-df15 = df14.copy()
+    # Apply transformation to 'total_of_special_requests' column:
+    # Set to 3 if greater than 2, 2 if equal to 2, 1 if equal to 1, else leave as is
+    df16['total_of_special_requests'] = df16['total_of_special_requests'].apply(
+        lambda x: 3 if x > 2 else (2 if x == 2 else (1 if x == 1 else x)))
 
-# Apply transformation to 'previous_cancellations' column:
-# Set to 2 if greater than or equal to 2, 0 if less than 1, else leave as is
-df15['previous_cancellations'] = df15['previous_cancellations'].apply(lambda x: 2 if x >= 2 else (0 if x < 1 else x))
+    # Rename the columns to more intuitive names
+    df16 = df16.rename(columns={'booking_changes': 'number_of_booking_changes',
+                                'total_of_special_requests': 'number_of_special_requests'})
+    # =================================================================================================================
+    # HANDLING days_in_waiting_list COLUMN
+    df17 = df16.copy()
 
-# Apply transformation to 'previous_bookings_not_canceled' column:
-# Set to 2 if greater than or equal to 2, 0 if less than 1, else leave as is
-df15['previous_bookings_not_canceled'] = df15['previous_bookings_not_canceled'].apply(
-    lambda x: 2 if x >= 2 else (0 if x < 1 else x))
+    # Apply transformation to 'days_in_waiting_list' column:
+    # Set to 1 if greater than 0, else leave as is
+    df17['days_in_waiting_list'] = df17['days_in_waiting_list'].apply(lambda x: 1 if x > 0 else x)
 
-# Rename the columns to more intuitive names
-df15 = df15.rename(columns={'previous_cancellations': 'number_of_previous_cancellations',
-                            'previous_bookings_not_canceled': 'number_of_previous_bookings_not_canceled'})
-# =====================================================================================================================
-# HANDLING booking_changes AND total_of_special_requests COLUMNS
-df16 = df15.copy()
-
-# Apply transformation to 'booking_changes' column:
-# Set to 3 if greater than 2, 2 if equal to 2, 1 if equal to 1, else leave as is
-df16['booking_changes'] = df16['booking_changes'].apply(
-    lambda x: 3 if x > 2 else (2 if x == 2 else (1 if x == 1 else x)))
-
-# Apply transformation to 'total_of_special_requests' column:
-# Set to 3 if greater than 2, 2 if equal to 2, 1 if equal to 1, else leave as is
-df16['total_of_special_requests'] = df16['total_of_special_requests'].apply(
-    lambda x: 3 if x > 2 else (2 if x == 2 else (1 if x == 1 else x)))
-
-# Rename the columns to more intuitive names
-df16 = df16.rename(columns={'booking_changes': 'number_of_booking_changes',
-                            'total_of_special_requests': 'number_of_special_requests'})
-# =====================================================================================================================
-# HANDLING days_in_waiting_list COLUMN
-df17 = df16.copy()
-
-# Apply transformation to 'days_in_waiting_list' column:
-# Set to 1 if greater than 0, else leave as is
-df17['days_in_waiting_list'] = df17['days_in_waiting_list'].apply(lambda x: 1 if x > 0 else x)
+    # Rename the 'days_in_waiting_list' column to 'has_waited'
+    df17 = df17.rename(columns={'days_in_waiting_list': 'has_waited'})
+    # =================================================================================================================
+    # HANDLING OUTLIERS
+    # Calling the explore_outliers function to visualize the distribution of some features.
+    # Plots are only drawn on request (show_plots=1 in the environment), so scheduled runs never load matplotlib.
+    if show_plots:
+        explore_outliers(dataframe=df17, column='lead_time', number_of_bins=60, negative=False)
 
-# Rename the 'days_in_waiting_list' column to 'has_waited'
-df17 = df17.rename(columns={'days_in_waiting_list': 'has_waited'})
-# =====================================================================================================================
-# HANDLING OUTLIERS
-# Calling the explore_outliers function to visualize the distribution of some features
-explore_outliers(dataframe=df17, column='lead_time', number_of_bins=60, negative=False)
+    df18 = df17.copy()
 
-df18 = df17.copy()
+    # Set the threshold values for ADR (average daily rate) and lead_time outliers (defined in what_if.py):
+    adr_outlier_value = current_thresholds['adr']  # Maximum acceptable value for ADR
+    lead_time_outlier_border = current_thresholds['lead_time']  # Maximum acceptable value for lead time
 
-# Set the threshold values for ADR (average daily rate) and lead_time outliers:
-adr_outlier_value = 5400  # Maximum acceptable value for ADR
-lead_time_outlier_border = 640  # Maximum acceptable value for lead time
+    # Remove rows where ADR is higher than the defined threshold or negative:
+    df18 = df18.loc[(df18['adr'] < adr_outlier_value) & (df18['adr'] >= 0)].reset_index(drop=True)
 
-# Remove rows where ADR is higher than the defined threshold or negative:
-df18 = df18.loc[(df18['adr'] < adr_outlier_value) & (df18['adr'] >= 0)].reset_index(drop=True)
+    # Remove rows where lead_time exceeds the defined threshold:
+    df18 = df18.loc[df18['lead_time'] < lead_time_outlier_border].reset_index(drop=True)
 
-# Remove rows where lead_time exceeds the defined threshold:
-df18 = df18.loc[df18['lead_time'] < lead_time_outlier_border].reset_index(drop=True)
+    # Keep the dashboard bookings before the outlier removal, so what_if.py can compute the KPIs under other
+    # thresholds without re-running the pipeline:
+    what_if_data(dfdash11).to_parquet(output_name('what_if_data.parquet'), index=False)
 
-# Create a copy of the dashboard dataframe (dfdash11) for outlier removal:
-dfdash12 = dfdash11.copy()
+    # Create a copy of the dashboard dataframe (dfdash11) for outlier removal:
+    dfdash12 = dfdash11.copy()
 
-# Remove rows where ADR is higher than the defined threshold or negative in the dashboard dataframe:
-dfdash12 = dfdash12.loc[(dfdash12['adr'] < adr_outlier_value) & (dfdash12['adr'] >= 0)].reset_index(drop=True)
+    # Remove rows where ADR is higher than the defined threshold or negative in the dashboard dataframe:
+    dfdash12 = dfdash12.loc[(dfdash12['adr'] < adr_outlier_value) & (dfdash12['adr'] >= 0)].reset_index(drop=True)
 
-# Remove rows where lead_time exceeds the defined threshold in the dashboard dataframe:
-dfdash12 = dfdash12.loc[dfdash12['lead_time'] < lead_time_outlier_border].reset_index(drop=True)
-# =====================================================================================================================
-# Final Check on dtypes
-df19 = df18.copy()
+    # Remove rows where lead_time exceeds the defined threshold in the dashboard dataframe:
+    dfdash12 = dfdash12.loc[dfdash12['lead_time'] < lead_time_outlier_border].reset_index(drop=True)
 
-# Specify columns to be converted to categorical data type:
-cols_to_be_categorized = ['hotel', 'arrival_date_year', 'customer_type']
+    return df18, dfdash12
 
-# Convert the specified columns to categorical data type:
-df19[cols_to_be_categorized] = df19[cols_to_be_categorized].astype('category')
 
-# Create a copy of the dashboard dataframe (dfdash12) to apply categorization:
-dfdash13 = dfdash12.copy()
-
-# Specify columns in the dashboard dataframe to be converted to categorical data type:
-dashcols_to_be_categorized = ['hotel', 'customer_type', 'country']
-
-# Convert the specified columns in the dashboard dataframe to categorical data type:
-dfdash13[dashcols_to_be_categorized] = dfdash13[dashcols_to_be_categorized].astype('category')
-# =====================================================================================================================
-# ENCODE CATEGORIES
-# Specify the list of columns to be one-hot encoded:
-categories = ['hotel', 'arrival_date_year', 'country', 'market_segment', 'distribution_channel', 'reserved_room_type',
-              'customer_type']
-
-# Apply one-hot encoding on the selected columns in df19 and drop the first category to avoid multicollinearity:
-df20 = pd.get_dummies(data=df19, columns=categories, drop_first=True)
-
-# Identify columns with boolean data type:
-boolean_cols = df20.columns[df20.dtypes == 'bool']
-
-# Convert boolean columns to integers (True becomes 1, False becomes 0):
-df20[boolean_cols] = df20[boolean_cols].astype(int)
-# =====================================================================================================================
-# CHECK FOR MULTICOLINEARITY
-# X = df20.copy()
-# # Add a constant (intercept) column to the DataFrame X to use in regression models:
-# X_with_const = add_constant(X)
-# # Initialize an empty DataFrame to store the features and their corresponding VIF values:
-# vif = pd.DataFrame()
-# # Assign column names to the DataFrame: one for features and the other for VIF values:
-# vif["Feature"] = X_with_const.columns
-# # Calculate the Variance Inflation Factor (VIF) for each feature in the dataset
-# # and store the values in the "VIF" column of the DataFrame:
-# vif["VIF"] = [variance_inflation_factor(X_with_const.values, i) for i in range(X_with_const.shape[1])]
-# # Sort the DataFrame 'vif' in descending order based on the VIF values to identify
-# # the features with the highest multicollinearity (i.e., those with the highest VIF).
-# vif_sorted = vif.sort_values(by="VIF", ascending=False)
-# # Filter the sorted 'vif' DataFrame to display only the features with a VIF greater than 5
-# vif_sorted[vif_sorted['VIF'] > 5]
-# =====================================================================================================================
-# EXPORT CLEANED FILES
-# Establish a connection to the PostgreSQL database using SQLAlchemy engine
-engine = create_engine(f'postgresql://{username}:{password}@{host}:{port}/{db_name}')
-
-# Upload the 'df20' dataframe (Logistic Regression and Random Forest dataset) to the PostgreSQL database.
-# If the table "logreg_rf_data" already exists, it will be replaced with the new data.
-df20['last_updated'] = datetime.now()  # To check if the update happens properly
-df20.to_sql("logreg_rf_data", engine, if_exists="replace", index=False)
-
-# Upload the 'dfdash13' dataframe (KPIs dataset for the dashboard) to the PostgreSQL database.
-# If the table "dashboard_data" already exists, it will be replaced with the new data.
-dfdash13['last_updated'] = datetime.now()  # To check if the update happens properly
-dfdash13.to_sql("dashboard_data", engine, if_exists="replace", index=False)
 # =====================================================================================================================
+# RUN THE PIPELINE
+# The pipeline only runs when the script is executed: the processes of the scoring pool import this module without
+# running it again
+if __name__ == '__main__':
+    # Set up the connection to the local PostgreSQL database
+    engine = create_database_engine()
+
+    # Every stage below saves its output as a checkpoint of this run, keyed by the fingerprint of its inputs. When
+    # run_all.py resumes a failed run, the completed stages are loaded from their checkpoints instead of running again.
+    run_id = current_run_id()
+
+    # In sample mode, a reproducible stratified sample (hotel x arrival year x is_canceled) is extracted instead of the
+    # full table, and every output gets the '_sample' suffix so the production tables and files are left untouched.
+    sample_fraction = current_sample_fraction()
+
+    # Fetch data from the 'hotel_booking' table
+    if sample_fraction:
+        query = stratified_sample_query('hotel_booking', sample_fraction, current_sample_seed())
+    else:
+        query = "SELECT * FROM hotel_booking"
+    # The key includes the signature of hotel_booking: when new bookings arrive between a failed run and its resumption,
+    # the extraction is run again instead of reusing the stale rows. run_all.py passes the signature it took before the
+    # run, so the table is not summarized twice; a run started by hand only counts the rows.
+    signature = passed_signature() or source_signature(engine, 'hotel_booking', 'count')
+    extraction_key = input_fingerprint(query, signature)
+    extraction_checkpoint = load_checkpoint('extraction', extraction_key, run_id)
+    if extraction_checkpoint is None:
+        # The personal columns are dropped before the rows are saved as a checkpoint
+        df_raw = pd.read_sql(query, engine).drop(columns=sample_columns + personal_columns, errors='ignore')
+        save_checkpoint('extraction', extraction_key, {'hotel_booking': df_raw}, run_id)
+    else:
+        df_raw = extraction_checkpoint['hotel_booking']
+    # =================================================================================================================
+    # CHECK FOR DUPLICATES
+    # File holding the fingerprints of every booking seen by previous runs
+    fingerprint_index_file = output_name('booking_fingerprints.npy')
+
+    # 'flag' (default) keeps repeated bookings, so the KPIs are unchanged, and marks them in the dashboard data with
+    # 'is_duplicate'; 'drop' removes them before any KPI is calculated (duplicate_policy=drop in the environment)
+    duplicate_policy = os.getenv('duplicate_policy', 'flag')
+    if duplicate_policy not in ('drop', 'flag'):
+        raise ValueError(f"duplicate_policy must be 'drop' or 'flag', not {duplicate_policy!r}")
+
+    # Hash the business columns of each booking once, instead of comparing the full wide rows
+    fingerprints = row_fingerprints(df_raw)
+    fingerprint_index = load_fingerprint_index(fingerprint_index_file)
+
+    # A row is a duplicate if the same booking already appeared earlier in the extracted table. Only the bookings that
+    # are not in the index yet, and those of the index that occur more than once, are compared with each other.
+    is_duplicate = flag_duplicates(fingerprints, fingerprint_index)
+    is_new = ~in_fingerprint_index(fingerprint_index, fingerprints)
+    print(f"Duplicate bookings: {is_duplicate.sum()} "
+          f"(new bookings since the last run: {(is_new & ~is_duplicate).sum()})")
+
+    # The key identifies the booking in both dataframes, so the scores of the model rows can be joined back to the
+    # dashboard rows. It is the fingerprint, made unique for the further copies of a booking kept under 'flag'.
+    df_raw['booking_key'] = booking_keys(fingerprints, is_duplicate)
+
+    # Persist the fingerprints of the new bookings so the next run (or a new batch) can be checked against this one
+    save_fingerprint_index(update_fingerprint_index(fingerprint_index, fingerprints[is_new]), fingerprint_index_file)
+
+    # Keep only the first copy of each booking when dropping duplicates
+    if duplicate_policy == 'drop':
+        df_raw = df_raw.loc[~is_duplicate].reset_index(drop=True)
+        print(f"Dropped duplicate bookings: {is_duplicate.sum()} rows (duplicate_policy=drop)")
+
+    # Create a second file for KPIs calculation
+    dfdash = df_raw.copy()
+
+    # When flagging, mark the repeated bookings so they can be filtered in the dashboard
+    if duplicate_policy == 'flag':
+        dfdash['is_duplicate'] = is_duplicate.astype(int)
+    # =================================================================================================================
+    # CLEANING TRUNK (see clean_bookings)
+    # The cleaning steps are skipped when this run already completed them
+    cleaning_key = input_fingerprint(df_raw, dfdash)
+    cleaning_checkpoint = load_checkpoint('cleaning', cleaning_key, run_id)
+    if cleaning_checkpoint is not None:
+        df18, dfdash12 = cleaning_checkpoint['model_data'], cleaning_checkpoint['dashboard_data']
+    else:
+        df18, dfdash12 = clean_bookings(df_raw, dfdash)
+        save_checkpoint('cleaning', cleaning_key, {'model_data': df18, 'dashboard_data': dfdash12}, run_id)
+    # =================================================================================================================
+    # Final Check on dtypes
+    df19 = df18.copy()
+
+    # Specify columns to be converted to categorical data type:
+    cols_to_be_categorized = ['hotel', 'arrival_date_year', 'customer_type']
+
+    # Convert the specified columns to categorical data type:
+    df19[cols_to_be_categorized] = df19[cols_to_be_categorized].astype('category')
+
+    # Create a copy of the dashboard dataframe (dfdash12) to apply categorization:
+    dfdash13 = dfdash12.copy()
+
+    # Specify columns in the dashboard dataframe to be converted to categorical data type:
+    dashcols_to_be_categorized = ['hotel', 'customer_type', 'country']
+
+    # Convert the specified columns in the dashboard dataframe to categorical data type:
+    dfdash13[dashcols_to_be_categorized] = dfdash13[dashcols_to_be_categorized].astype('category')
+    # =================================================================================================================
+    # ENCODE CATEGORIES
+    # Specify the list of columns to be one-hot encoded:
+    categories = ['hotel', 'arrival_date_year', 'country', 'market_segment', 'distribution_channel',
+                  'reserved_room_type', 'customer_type']
+
+    # The booking key only identifies the rows for the scoring stage, it is not a feature:
+    model_keys = df19.pop('booking_key')
+
+    # Apply one-hot encoding on the selected columns in df19 and drop the first category to avoid multicollinearity:
+    df20 = pd.get_dummies(data=df19, columns=categories, drop_first=True)
+
+    # Identify columns with boolean data type:
+    boolean_cols = df20.columns[df20.dtypes == 'bool']
+
+    # Convert boolean columns to integers (True becomes 1, False becomes 0):
+    df20[boolean_cols] = df20[boolean_cols].astype(int)
+    # =================================================================================================================
+    # VALIDATE THE MODEL DATA
+    # File holding the one-hot columns of the last validated model data. A change of the columns (e.g. a new arrival
+    # year) is legitimate, but a model trained on the previous data needs to be retrained: it is reported as a warning
+    # and the new columns are stored.
+    model_schema_file = output_name('logreg_rf_schema.json')
+
+    # The one-hot columns must match the levels of the encoded categories
+    expected_columns = expected_one_hot_columns(df19, categories)
+    previous_columns = load_schema(model_schema_file)
+    if previous_columns is not None and previous_columns != expected_columns:
+        warnings.warn(f"The one-hot columns changed since the last validated run (see {model_schema_file}): "
+                      f"added {sorted(set(expected_columns) - set(previous_columns))}, "
+                      f"removed {sorted(set(previous_columns) - set(expected_columns))}")
+
+    # NaNs, dtypes, components or one-hot values that violate the invariants stop the model branch: logreg_rf_data is
+    # neither scored nor published. The dashboard branch does not depend on them and is still published; the run fails
+    # once it is done.
+    validation_start = time.perf_counter()
+    model_problems = check_model_data(df20, categories, expected_columns)
+    report_validation('the model data', model_problems, len(df20), time.perf_counter() - validation_start)
+    if model_problems:
+        print("logreg_rf_data is not published:\n- " + "\n- ".join(model_problems))
+    else:
+        save_schema(expected_columns, model_schema_file)
+    # =================================================================================================================
+    # SCORE THE CANCELLATION RISK
+    # The persisted classifier scores every row of the model data in the feature columns it was trained on, and the
+    # probabilities are joined to the dashboard rows of the same bookings: the sum of 'cancellation_probability' gives
+    # the expected cancellations and the sum of 'cancellation_probability' * 'adr' the revenue at risk, per hotel or
+    # segment. A classifier that does not know the one-hot columns of the data (e.g. a new arrival year) cannot score
+    # it: the run fails, but only after the dashboard branch is published, with an empty cancellation_probability.
+    scoring_error = None
+    classifier = load_classifier(classifier_file)
+    scores = pd.DataFrame({'booking_key': pd.Series(dtype='int64'), 'cancellation_probability': pd.Series(dtype=float)})
+    if classifier is None:
+        print(f"No classifier found at {classifier_file}: cancellation_probability is left empty.")
+    elif model_problems:
+        print("The model data is not valid: cancellation_probability is left empty.")
+    else:
+        scoring_key = input_fingerprint(df20, model_keys.to_frame(), classifier_version(classifier_file))
+        scoring_checkpoint = load_checkpoint('scoring', scoring_key, run_id)
+        if scoring_checkpoint is not None:
+            scores = scoring_checkpoint['scores']
+        else:
+            try:
+                features = feature_matrix(df20, classifier)
+            except ValueError as error:
+                scoring_error = error
+                print(f"{error}: cancellation_probability is left empty.")
+            else:
+                scoring_start = time.perf_counter()
+                probabilities = score_in_chunks(classifier, features, max_workers=scoring_workers)
+                scoring_seconds = time.perf_counter() - scoring_start
+                print(f"Scored {len(df20)} bookings in {scoring_seconds:.2f} s "
+                      f"({len(df20) / max(scoring_seconds, 1e-9):,.0f} rows per second)")
+                scores = pd.DataFrame({'booking_key': model_keys.to_numpy(), 'cancellation_probability': probabilities})
+                save_checkpoint('scoring', scoring_key, {'scores': scores}, run_id)
+
+    dfdash13 = join_scores(dfdash13, scores['booking_key'], scores['cancellation_probability'])
+    # =================================================================================================================
+    # CHECK FOR MULTICOLINEARITY
+    # X = df20.copy()
+    # # Add a constant (intercept) column to the DataFrame X to use in regression models:
+    # X_with_const = add_constant(X)
+    # # Initialize an empty DataFrame to store the features and their corresponding VIF values:
+    # vif = pd.DataFrame()
+    # # Assign column names to the DataFrame: one for features and the other for VIF values:
+    # vif["Feature"] = X_with_const.columns
+    # # Calculate the Variance Inflation Factor (VIF) for each feature in the dataset
+    # # and store the values in the "VIF" column of the DataFrame:
+    # vif["VIF"] = [variance_inflation_factor(X_with_const.values, i) for i in range(X_with_const.shape[1])]
+    # # Sort the DataFrame 'vif' in descending order based on the VIF values to identify
+    # # the features with the highest multicollinearity (i.e., those with the highest VIF).
+    # vif_sorted = vif.sort_values(by="VIF", ascending=False)
+    # # Filter the sorted 'vif' DataFrame to display only the features with a VIF greater than 5
+    # vif_sorted[vif_sorted['VIF'] > 5]
+    # =================================================================================================================
+    # EXPORT CLEANED FILES
+    # Establish a connection to the PostgreSQL database using SQLAlchemy engine
+    engine = create_database_engine()
+
+    # Upload the 'df20' dataframe (Logistic Regression and Random Forest dataset) to the PostgreSQL database.
+    # If the table "logreg_rf_data" already exists, it will be replaced with the new data.
+    # The upload is skipped when this run already published the same data (model branch checkpoint), and when the model
+    # data failed validation.
+    model_key = input_fingerprint(df20)
+    model_checkpoint = load_checkpoint('model_branch', model_key, run_id)
+    if model_checkpoint is not None:
+        df20 = model_checkpoint['logreg_rf_data']
+    elif not model_problems:
+        df20['last_updated'] = datetime.now()  # To check if the update happens properly
+        df20.to_sql(output_name("logreg_rf_data"), engine, if_exists="replace", index=False)
+        save_checkpoint('model_branch', model_key, {'logreg_rf_data': df20}, run_id)
+
+    # Upload the 'dfdash13' dataframe (KPIs dataset for the dashboard) to the PostgreSQL database.
+    # The table "dashboard_data" is partitioned by arrival month: only the months whose data changed are replaced, the
+    # common dashboard filters are indexed and the planner statistics are refreshed.
+    # In star mode, the partitioned table is the fact table "dashboard_data_facts", where the categorical columns hold
+    # SMALLINT codes of the tables "dashboard_data_dim_<column>"; the country dimension also holds the country grouping.
+    # The upload is skipped when this run already published the same data (dashboard branch checkpoint).
+    dashboard_key = input_fingerprint(dfdash13, publication_mode)
+    dashboard_checkpoint = load_checkpoint('dashboard_branch', dashboard_key, run_id)
+    if dashboard_checkpoint is None:
+        dfdash13['last_updated'] = datetime.now()  # To check if the update happens properly
+        if publication_mode == 'star':
+            refreshed_partitions = publish_star(dfdash13, engine, table_name=output_name("dashboard_data"),
+                                                partition_column="arrival_date",
+                                                attributes={'country': {'country_category': country_to_category}})
+        else:
+            refreshed_partitions = publish_partitioned(dfdash13, engine, table_name=output_name("dashboard_data"),
+                                                       partition_column="arrival_date")
+        print(f"Refreshed dashboard_data partitions: {len(refreshed_partitions)}")
+        save_checkpoint('dashboard_branch', dashboard_key, {'dashboard_data': dfdash13}, run_id)
+    else:
+        dfdash13 = dashboard_checkpoint['dashboard_data']
+    # =================================================================================================================
+    # END THE RUN ON MODEL BRANCH PROBLEMS
+    # The problems found above end the run, now that the dashboard data is published
+    if model_problems:
+        raise_for_problems('the model data', model_problems)
+    if scoring_error is not None:
+        raise scoring_error
@@ -0,0 +1,349 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+# Columns most often used as filters in the Looker Studio dashboard
+dashboard_index_columns = ['hotel', 'market_segment', 'distribution_channel', 'country']
+
+# Technical columns that change on every run and must not mark a partition as modified
+volatile_columns = ['last_updated']
+
+# Number of rows sent per COPY command, which bounds the size of the CSV text held in memory
+copy_chunk_rows = 100_000
+
+# 'flat' publishes dashboard_data as one wide table; 'star' as a fact table of small-integer codes, one dimension
+# table per categorical column and a dashboard_data view that joins them back
+publication_modes = ['flat', 'star']
+
+# Categorical columns of dashboard_data stored as codes in the fact table of the star schema
+dimension_columns = ['hotel', 'country', 'market_segment', 'distribution_channel', 'reserved_room_type',
+                     'customer_type']
+
+
+def _quote(identifier):
+    # Quote identifiers so that column names with special characters are accepted by PostgreSQL
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def partition_fingerprints(dataframe, partition_column='arrival_date'):
+    """
+    This function summarizes the content of each monthly partition with an order-insensitive fingerprint (the sum of
+    the row hashes) and a row count. Two runs that produce the same rows for a month produce the same fingerprint, so
+    only the months whose content changed need to be rewritten.
+
+    Args:
+    - dataframe (pandas.DataFrame): The data to be published.
+    - partition_column (str): The datetime column the table is partitioned on.
+
+    Returns:
+    - pandas.DataFrame: One row per month with the columns `partition_start`, `fingerprint` and `row_count`.
+    """
+    months = dataframe[partition_column].dt.to_period('M')
+    row_hashes = pd.util.hash_pandas_object(
+        dataframe.drop(columns=volatile_columns, errors='ignore'), index=False).to_numpy()
+
+    codes, uniques = pd.factorize(months, sort=True)
+    # Unsigned integer additions wrap around, which keeps the sum exact modulo 2**64
+    fingerprints = np.zeros(len(uniques), dtype=np.uint64)
+    np.add.at(fingerprints, codes, row_hashes)
+
+    return pd.DataFrame({
+        'partition_start': uniques.to_timestamp(),
+        'fingerprint': [format(value, '016x') for value in fingerprints],
+        'row_count': np.bincount(codes, minlength=len(uniques)),
+    })
+
+
+def _partition_name(table_name, partition_start):
+    return f"{table_name}_p{partition_start:%Y_%m}"
+
+
+def partition_month(partition_name):
+    # The month ('YYYY-MM') of a partition named by `_partition_name`, e.g. '2017-08' for 'dashboard_data_p2017_08'
+    return partition_name[-len('YYYY_MM'):].replace('_', '-')
+
+
+def current_publication_mode():
+    # dashboard_schema=star in the environment switches dashboard_data to the star schema
+    mode = os.getenv('dashboard_schema', 'flat')
+    if mode not in publication_modes:
+        raise ValueError(f"dashboard_schema must be one of {publication_modes}, not '{mode}'")
+    return mode
+
+
+def _relation_kind(connection, name):
+    # 'r' for a table, 'p' for a partitioned table, 'v' for a view, None if the relation does not exist
+    return connection.execute(
+        text("SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+             "WHERE c.relname = :table AND n.nspname = current_schema()"),
+        {'table': name}).scalar()
+
+
+def _drop_relation(connection, name):
+    # dashboard_data is a table in the flat mode and a view in the star mode: drop whichever exists
+    kind = _relation_kind(connection, name)
+    if kind is not None:
+        connection.execute(text(f"DROP {'VIEW' if kind == 'v' else 'TABLE'} {_quote(name)} CASCADE"))
+
+
+def _column_types(connection, table_name):
+    # The (name, type) of every column of a table, in the order of the table
+    return connection.execute(
+        text("SELECT column_name, data_type FROM information_schema.columns "
+             "WHERE table_name = :table AND table_schema = current_schema() ORDER BY ordinal_position"),
+        {'table': table_name}).all()
+
+
+def _is_partitioned_like(connection, table_name, template_table):
+    # The table can be reused only if it is already partitioned and holds the same columns, with the same types, as
+    # the template (e.g. a column that became a float after a NaN appeared must recreate the table)
+    if _relation_kind(connection, table_name) != 'p':
+        return False
+    return _column_types(connection, table_name) == _column_types(connection, template_table)
+
+
+def _copy_rows(connection, table_name, dataframe):
+    # COPY streams the rows as CSV, which is much faster than INSERT statements and has no limit on bind parameters.
+    # Missing values are sent as \N, so they are not confused with empty strings.
+    columns = ', '.join(_quote(column) for column in dataframe.columns)
+    statement = f"COPY {_quote(table_name)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    cursor = connection.connection.cursor()
+    for start in range(0, len(dataframe), copy_chunk_rows):
+        buffer = io.StringIO()
+        dataframe.iloc[start:start + copy_chunk_rows].to_csv(buffer, index=False, header=False, na_rep='\\N')
+        buffer.seek(0)
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2
+            cursor.copy_expert(statement, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+
+
+def publish_partitioned(dataframe, engine, table_name='dashboard_data', partition_column='arrival_date',
+                        index_columns=None):
+    """
+    This function publishes the dataframe as a PostgreSQL table range-partitioned by month on the partition column.
+    Instead of dropping and recreating the whole table, it compares the fingerprint of every month with the one stored
+    by the previous run and only rewrites the partitions that changed, drops the months that disappeared, and keeps
+    the others (and their planner statistics) untouched. Indexes on the common filter columns are defined once on the
+    partitioned table, so every partition inherits them, and the rewritten partitions are analyzed afterwards.
+    Everything happens in a single transaction, so the dashboard never reads a half-published table.
+
+    Args:
+    - dataframe (pandas.DataFrame): The data to be published.
+    - engine (sqlalchemy.engine.Engine): The connection to the PostgreSQL database.
+    - table_name (str): The name of the published table.
+    - partition_column (str): The datetime column the table is partitioned on.
+    - index_columns (list, optional): The columns to index. Defaults to `dashboard_index_columns`.
+
+    Returns:
+    - list: The names of the partitions that were rewritten.
+    """
+    with engine.begin() as connection:
+        refreshed, removed = _publish_partitions(connection, dataframe, table_name, partition_column, index_columns)
+    _analyze_partitions(engine, table_name, refreshed, removed)
+    return refreshed
+
+
+def _publish_partitions(connection, dataframe, table_name, partition_column, index_columns=None, foreign_keys=None):
+    # The body of `publish_partitioned`, in the transaction of the caller. foreign_keys ({column: referenced table})
+    # are declared on the partitioned table, so every partition checks its rows against the referenced tables.
+    if index_columns is None:
+        index_columns = dashboard_index_columns
+    if foreign_keys is None:
+        foreign_keys = {}
+
+    staging_table = f"{table_name}_staging"
+    metadata_table = f"{table_name}_partitions"
+    fingerprints = partition_fingerprints(dataframe, partition_column)
+    months = dataframe[partition_column].dt.to_period('M').dt.to_timestamp()
+
+    # An empty staging table gives the column types pandas would use for the data
+    dataframe.head(0).to_sql(staging_table, connection, if_exists='replace', index=False)
+
+    # (Re)create the partitioned table when it does not exist yet, is a plain table, or its columns changed
+    if not _is_partitioned_like(connection, table_name, staging_table):
+        _drop_relation(connection, table_name)
+        connection.execute(text(f"DROP TABLE IF EXISTS {_quote(metadata_table)}"))
+        connection.execute(text(
+            f"CREATE TABLE {_quote(table_name)} (LIKE {_quote(staging_table)}) "
+            f"PARTITION BY RANGE ({_quote(partition_column)})"))
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {_quote(metadata_table)} "
+        f"(partition_name TEXT PRIMARY KEY, fingerprint TEXT, row_count BIGINT)"))
+    for column in [partition_column] + index_columns:
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {_quote(f'{table_name}_{column}_idx')} "
+            f"ON {_quote(table_name)} ({_quote(column)})"))
+    existing_constraints = set(connection.execute(
+        text("SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass)"),
+        {'table': _quote(table_name)}).scalars())
+    for column, referenced_table in foreign_keys.items():
+        constraint = f'{table_name}_{column}_fkey'
+        if constraint not in existing_constraints:
+            connection.execute(text(
+                f"ALTER TABLE {_quote(table_name)} ADD CONSTRAINT {_quote(constraint)} "
+                f"FOREIGN KEY ({_quote(column)}) REFERENCES {_quote(referenced_table)} ({_quote(column)})"))
+
+    # Find the partitions whose content differs from the previous run
+    published = pd.read_sql(text(f"SELECT * FROM {_quote(metadata_table)}"), connection)
+    fingerprints['partition_name'] = [_partition_name(table_name, start) for start in fingerprints['partition_start']]
+    merged = fingerprints.merge(published, on='partition_name', how='left', suffixes=('', '_published'))
+    changed = merged.loc[(merged['fingerprint'] != merged['fingerprint_published']) |
+                         (merged['row_count'] != merged['row_count_published'])]
+    removed = sorted(set(published['partition_name']) - set(fingerprints['partition_name']))
+
+    for partition_name in removed + changed['partition_name'].tolist():
+        connection.execute(text(f"DROP TABLE IF EXISTS {_quote(partition_name)}"))
+    for partition_name, start in zip(changed['partition_name'], changed['partition_start']):
+        end = start + pd.offsets.MonthBegin(1)
+        connection.execute(text(
+            f"CREATE TABLE {_quote(partition_name)} PARTITION OF {_quote(table_name)} "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"))
+
+    # Load only the rows of the changed months: PostgreSQL routes the copied rows to their partitions
+    connection.execute(text(f"DROP TABLE {_quote(staging_table)}"))
+    _copy_rows(connection, table_name, dataframe.loc[months.isin(changed['partition_start'])])
+
+    # Record the new fingerprints for the next run
+    connection.execute(text(f"DELETE FROM {_quote(metadata_table)}"))
+    fingerprints[['partition_name', 'fingerprint', 'row_count']].to_sql(
+        metadata_table, connection, if_exists='append', index=False)
+    return changed['partition_name'].tolist(), removed
+
+
+def _analyze_partitions(engine, table_name, refreshed, removed):
+    # Refresh planner statistics of the rewritten partitions and of the partitioned table itself
+    if refreshed or removed:
+        with engine.begin() as connection:
+            for partition_name in refreshed:
+                connection.execute(text(f"ANALYZE {_quote(partition_name)}"))
+            connection.execute(text(f"ANALYZE {_quote(table_name)}"))
+
+
+def fact_table_name(table_name='dashboard_data'):
+    return f"{table_name}_facts"
+
+
+def dimension_table_name(table_name, column):
+    return f"{table_name}_dim_{column}"
+
+
+def partition_metadata_table(table_name='dashboard_data', mode=None):
+    # The table holding the per-month fingerprints of the published data, which belong to the fact table in star mode
+    if mode is None:
+        mode = current_publication_mode()
+    return f"{fact_table_name(table_name) if mode == 'star' else table_name}_partitions"
+
+
+def _update_dimension(connection, dimension_table, column, values, attributes):
+    # Codes are kept from one run to the next, so the months that did not change keep valid codes; new values get
+    # the next codes. The attributes are recomputed on every run, e.g. after a change of their dictionary.
+    key_column = f'{column}_id'
+    attribute_columns = ''.join(f', {_quote(name)} TEXT' for name in attributes)
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {_quote(dimension_table)} "
+        f"({_quote(key_column)} SMALLINT PRIMARY KEY, {_quote(column)} TEXT UNIQUE{attribute_columns})"))
+    existing = pd.read_sql(text(f"SELECT {_quote(key_column)}, {_quote(column)} FROM {_quote(dimension_table)}"),
+                           connection)
+
+    new_values = sorted(set(values) - set(existing[column]))
+    next_code = int(existing[key_column].max()) + 1 if len(existing) else 1
+    codes = pd.Series(np.concatenate([existing[key_column].to_numpy(dtype=np.int64),
+                                      np.arange(next_code, next_code + len(new_values))]),
+                      index=pd.Index(list(existing[column]) + new_values))
+    if codes.max() > np.iinfo(np.int16).max:
+        raise ValueError(f"{column} has too many distinct values for a SMALLINT code")
+
+    # Upsert the rows: a row is never deleted, so the fact rows keep satisfying their foreign keys
+    for name in attributes:
+        connection.execute(text(f"ALTER TABLE {_quote(dimension_table)} ADD COLUMN IF NOT EXISTS {_quote(name)} TEXT"))
+    dimension = pd.DataFrame({key_column: codes.to_numpy(dtype=np.int64), column: codes.index})
+    for name, mapping in attributes.items():
+        dimension[name] = dimension[column].map(mapping)
+    dimension = dimension.astype(object).where(dimension.notna(), None)
+    names = list(dimension.columns)
+    parameters = [f'p{i}' for i in range(len(names))]
+    updates = ', '.join(f"{_quote(name)} = EXCLUDED.{_quote(name)}" for name in attributes)
+    connection.execute(
+        text(f"INSERT INTO {_quote(dimension_table)} ({', '.join(_quote(name) for name in names)}) "
+             f"VALUES ({', '.join(f':{parameter}' for parameter in parameters)}) "
+             f"ON CONFLICT ({_quote(key_column)}) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING")),
+        [dict(zip(parameters, row)) for row in dimension.itertuples(index=False)])
+    return codes
+
+
+def publish_star(dataframe, engine, table_name='dashboard_data', partition_column='arrival_date', dimensions=None,
+                 attributes=None):
+    """
+    This function publishes the dataframe as a star schema: every categorical column is replaced by a SMALLINT code in
+    a fact table, which is published with `publish_partitioned` (monthly partitions, only the changed months are
+    rewritten), and its values are stored once in a dimension table with their attributes. A view named after the
+    table joins the codes back to their values, with the columns of the flat table, so every reader of the flat table
+    keeps working, while Looker Studio can scan the narrow fact table and group by the codes.
+
+    Args:
+    - dataframe (pandas.DataFrame): The data to be published.
+    - engine (sqlalchemy.engine.Engine): The connection to the PostgreSQL database.
+    - table_name (str): The name of the view; the fact table is `<table_name>_facts` and the dimension tables
+      `<table_name>_dim_<column>`.
+    - partition_column (str): The datetime column the fact table is partitioned on.
+    - dimensions (list, optional): The columns stored as codes. Defaults to `dimension_columns`.
+    - attributes (dict, optional): {column: {attribute name: {value: attribute}}}, e.g. the grouping of the countries.
+
+    Returns:
+    - list: The names of the fact partitions that were rewritten.
+    """
+    if dimensions is None:
+        dimensions = dimension_columns
+    if attributes is None:
+        attributes = {}
+    facts_table = fact_table_name(table_name)
+
+    # The dimensions, the facts and the view are published in one transaction, so readers see either the previous
+    # publication or the new one. Dimension rows are only added or updated, and the codes are foreign keys.
+    facts = dataframe.copy()
+    code_columns = [f'{column}_id' for column in dimensions]
+    with engine.begin() as connection:
+        for column in dimensions:
+            values = facts[column].astype(object)
+            if values.isna().any():
+                raise ValueError(f"{column} has missing values, which have no code in its dimension table")
+            codes = _update_dimension(connection, dimension_table_name(table_name, column), column,
+                                      values.unique().tolist(), attributes.get(column, {}))
+            facts[column] = codes.to_numpy(dtype=np.int16)[codes.index.get_indexer(values)]
+        # The codes are stored together after the other columns: between 8-byte columns, each 2-byte code would be
+        # padded to 8 bytes by PostgreSQL's alignment, which would cancel most of the saving
+        facts = facts.rename(columns={column: f'{column}_id' for column in dimensions})
+        facts = facts[[column for column in facts.columns if column not in code_columns] + code_columns]
+
+        refreshed, removed = _publish_partitions(
+            connection, facts, facts_table, partition_column,
+            index_columns=[f'{column}_id' for column in dashboard_index_columns if column in dimensions],
+            foreign_keys={f'{column}_id': dimension_table_name(table_name, column) for column in dimensions})
+
+        # The view lists the columns in the order of the flat table
+        selected = [f"{_quote(dimension_table_name(table_name, column))}.{_quote(column)}" if column in dimensions
+                    else f"f.{_quote(column)}" for column in dataframe.columns]
+        joins = ''.join(f" JOIN {_quote(dimension_table_name(table_name, column))} USING ({_quote(f'{column}_id')})"
+                        for column in dimensions)
+        view_query = f"AS SELECT {', '.join(selected)} FROM {_quote(facts_table)} f{joins}"
+        if _relation_kind(connection, table_name) not in (None, 'v'):
+            # The flat table of the previous mode
+            _drop_relation(connection, table_name)
+        try:
+            with connection.begin_nested():
+                connection.execute(text(f"CREATE OR REPLACE VIEW {_quote(table_name)} {view_query}"))
+        except DBAPIError:
+            # CREATE OR REPLACE only appends columns. The view is dropped without CASCADE, so a dependent view makes
+            # the publication fail instead of being dropped silently.
+            connection.execute(text(f"DROP VIEW {_quote(table_name)}"))
+            connection.execute(text(f"CREATE VIEW {_quote(table_name)} {view_query}"))
+    _analyze_partitions(engine, facts_table, refreshed, removed)
+    return refreshed
@@ -1,41 +1,173 @@
+import os
+import zlib
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-
-from sklearn.metrics import (
-    accuracy_score, precision_score, recall_score, f1_score,
-    confusion_matrix, balanced_accuracy_score, matthews_corrcoef,
-)
-
-
-def get_classification_metrics(y_test, y_pred, conf_matrix_title=None, runtime=None):
-    df = pd.DataFrame(data=[
-        round(accuracy_score(y_true=y_test, y_pred=y_pred), 4),
-        round(balanced_accuracy_score(y_true=y_test, y_pred=y_pred), 4),
-        round(recall_score(y_true=y_test, y_pred=y_pred), 4),
-        round(precision_score(y_true=y_test, y_pred=y_pred), 4),
-        round(f1_score(y_true=y_test, y_pred=y_pred), 4),
-        round(matthews_corrcoef(y_true=y_test, y_pred=y_pred), 4),
-        round(runtime, 2)
-    ],
-                 index=[
-        'Accuracy', 'Balanced Accuracy', 'Recall', 'Precision', 'F1 Score', 'Φ Coefficient (MCC)', 'Runtime (Minutes)'],
-                 columns=['Value'])
-    df.index.name = 'Metric'
+
+# Columns one-hot encoded in preprocessing.py; their dummies are permuted together as one feature
+one_hot_categories = ['hotel', 'arrival_date_year', 'country', 'market_segment', 'distribution_channel',
+                      'reserved_room_type', 'customer_type']
+
+metric_names = ['Accuracy', 'Balanced Accuracy', 'Recall', 'Precision', 'F1 Score', 'Φ Coefficient (MCC)']
+
+
+def _safe_divide(numerator, denominator):
+    # Ratios with an empty denominator are reported as 0, as sklearn does with zero_division
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+
+
+def _check_binary(name, values):
+    # The metrics compare labels with 1, so any label other than 0 and 1 would silently be counted as negative
+    values = np.asarray(values)
+    invalid = (values != 0) & (values != 1)
+    if invalid.any():
+        raise ValueError(f"{name} must only hold the binary labels 0 and 1, got {np.unique(values[invalid])[:5]}")
+    return values
+
+
+def confusion_counts(y_test, predictions):
+    """
+    Counts TN, FP, FN and TP for many prediction vectors in a single pass over y_test.
+    predictions is a 2D array-like with one row per model (or fold) and one column per observation.
+    Both must hold binary labels (0 and 1, or booleans).
+    """
+    y_true = _check_binary('y_test', y_test) == 1
+    y_pred = np.atleast_2d(_check_binary('predictions', predictions)) == 1
+    # One matrix product gives the true positives of every model at once
+    tp = y_pred.astype(np.int64) @ y_true.astype(np.int64)
+    predicted_positives = y_pred.sum(axis=1)
+    positives = y_true.sum()
+    fp = predicted_positives - tp
+    fn = positives - tp
+    tn = y_true.size - tp - fp - fn
+    return tn, fp, fn, tp
+
+
+def metrics_from_confusion(tn, fp, fn, tp):
+    """
+    Derives every classification metric from the confusion counts. The counts can be scalars or arrays
+    (one entry per model or per threshold); the result has one row per entry and one column per metric.
+    """
+    tn, fp, fn, tp = (np.asarray(count, dtype=float) for count in (tn, fp, fn, tp))
+    recall = _safe_divide(tp, tp + fn)
+    specificity = _safe_divide(tn, tn + fp)
+    mcc_denominator = np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn))
+    return pd.DataFrame({
+        'Accuracy': _safe_divide(tp + tn, tp + tn + fp + fn),
+        'Balanced Accuracy': (recall + specificity) / 2,
+        'Recall': recall,
+        'Precision': _safe_divide(tp, tp + fp),
+        'F1 Score': _safe_divide(2 * tp, 2 * tp + fp + fn),
+        'Φ Coefficient (MCC)': _safe_divide(tp * tn - fp * fn, mcc_denominator),
+    }, index=np.arange(np.size(tp)))
+
+
+def plot_confusion_matrix(tn, fp, fn, tp, conf_matrix_title=None, ax=None):
+    # Plotting libraries are only loaded when a plot is requested
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # Confusion Matrix Visualization
-    plt.figure(figsize=(6, 5))
+    if ax is None:
+        plt.figure(figsize=(6, 5))
+        ax = plt.gca()
     sns.heatmap(
-        confusion_matrix(y_test, y_pred),
+        np.array([[tn, fp], [fn, tp]]),
         annot=True,
         fmt='d',
         cmap='Blues',
         xticklabels=['Negative', 'Positive'],
-        yticklabels=['Negative', 'Positive'])
-    plt.xlabel('Predicted Label')
-    plt.ylabel('True Label')
-    plt.title(conf_matrix_title)
-    plt.show()
+        yticklabels=['Negative', 'Positive'],
+        ax=ax)
+    ax.set_xlabel('Predicted Label')
+    ax.set_ylabel('True Label')
+    ax.set_title(conf_matrix_title)
+    return ax
+
+
+def compare_classification_metrics(y_test, predictions, runtimes=None, plot=False):
+    """
+    Builds one comparison table for many models (or folds) evaluated on the same y_test.
+    predictions maps a model name to its y_pred (a dict or a DataFrame with one column per model) and runtimes
+    optionally maps the same names to their runtime in minutes. The confusion matrices are computed once and all
+    metrics are derived from them. With plot=True, the confusion matrices are drawn side by side without blocking.
+    """
+    names = list(predictions.keys())
+    tn, fp, fn, tp = confusion_counts(y_test, np.vstack([np.asarray(predictions[name]) for name in names]))
+
+    df = metrics_from_confusion(tn, fp, fn, tp).round(4)
+    df.index = pd.Index(names, name='Model')
+    if runtimes is not None:
+        df['Runtime (Minutes)'] = [round(runtimes[name], 2) if name in runtimes else np.nan for name in names]
+
+    if plot:
+        import matplotlib.pyplot as plt
+        fig, axes = plt.subplots(1, len(names), figsize=(6 * len(names), 5), squeeze=False)
+        for i, name in enumerate(names):
+            plot_confusion_matrix(tn[i], fp[i], fn[i], tp[i], conf_matrix_title=name, ax=axes[0, i])
+        plt.tight_layout()
+        plt.show(block=False)
+    return df
+
+
+def get_classification_metrics(y_test, y_pred, conf_matrix_title=None, runtime=None, plot=False):
+    tn, fp, fn, tp = confusion_counts(y_test, y_pred)
+    metrics = metrics_from_confusion(tn, fp, fn, tp).round(4).iloc[0].tolist()
+    df = pd.DataFrame(data=metrics + [round(runtime, 2) if runtime is not None else np.nan],
+                      index=metric_names + ['Runtime (Minutes)'],
+                      columns=['Value'])
+    df.index.name = 'Metric'
+    if plot:
+        import matplotlib.pyplot as plt
+        plot_confusion_matrix(tn[0], fp[0], fn[0], tp[0], conf_matrix_title=conf_matrix_title)
+        plt.show(block=False)
+    return df
+
+
+def threshold_sweep(y_test, y_proba, thresholds=None):
+    """
+    Evaluates the classifier at every decision threshold in one pass. The probabilities are sorted once and the true
+    positives for all thresholds are read from a cumulative sum, so the whole curve costs O(n log n).
+    y_proba is the probability of the positive class (the output of predict_proba is also accepted) and an
+    observation is predicted positive when its probability is >= the threshold. Without thresholds, every distinct
+    probability is used as a candidate.
+    """
+    scores = np.asarray(y_proba, dtype=float)
+    if scores.ndim == 2:
+        scores = scores[:, 1]
+    y_true = _check_binary('y_test', y_test) == 1
+
+    # Sort once in descending order of probability and accumulate the positives
+    order = np.argsort(-scores, kind='mergesort')
+    tp_cumulative = np.concatenate([[0], np.cumsum(y_true[order])])
+    ascending_scores = scores[order][::-1]
+
+    if thresholds is None:
+        thresholds = np.unique(scores)[::-1]
+    thresholds = np.asarray(thresholds, dtype=float)
+
+    # Number of observations with probability >= threshold, for all thresholds at once
+    predicted_positives = scores.size - np.searchsorted(ascending_scores, thresholds, side='left')
+    tp = tp_cumulative[predicted_positives]
+    fp = predicted_positives - tp
+    fn = y_true.sum() - tp
+    tn = (~y_true).sum() - fp
+
+    df = metrics_from_confusion(tn, fp, fn, tp)
+    df.insert(0, 'Threshold', thresholds)
+    df['TN'], df['FP'], df['FN'], df['TP'] = tn, fp, fn, tp
+    return df
+
+
+def optimal_thresholds(sweep, metrics=('Balanced Accuracy', 'Precision', 'Recall', 'F1 Score', 'Φ Coefficient (MCC)')):
+    # Keep the threshold that maximizes each metric of the sweep
+    rows = [sweep.loc[sweep[metric].idxmax(), ['Threshold', metric]].rename({metric: 'Value'}) for metric in metrics]
+    df = pd.DataFrame(rows, index=list(metrics))
+    df.index.name = 'Metric'
     return df
 
 
@@ -62,3 +194,123 @@ def logreg_interpretation(X_train_scaled, model):
                               'Normalized Odds - Relation to the Maximum': normalized_odds_max})
     weight_df_sorted = weight_df.sort_values(by='Odds Ratio', ascending=False)
     return weight_df_sorted
+
+
+def feature_groups(columns, categories=None):
+    # Map every column to its original feature: all dummies of a one-hot encoded category share the category name
+    if categories is None:
+        categories = one_hot_categories
+    groups = {}
+    for column in columns:
+        group = next((category for category in categories if column.startswith(f'{category}_')), column)
+        groups.setdefault(group, []).append(column)
+    return groups
+
+
+def _update_digest(digest, value):
+    # Hashes the hyperparameters and fitted attributes of a model (recursively, for pipelines and ensembles) instead of
+    # its pickle, whose bytes also depend on the library versions and on state that does not affect the predictions
+    if value is None or isinstance(value, (str, bytes, bool, int, float, np.generic)):
+        digest.update(repr(value).encode())
+    elif isinstance(value, np.ndarray):
+        if value.dtype == object:
+            _update_digest(digest, value.tolist())
+        else:
+            digest.update(f'{value.dtype}{value.shape}'.encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'{type(value).__name__}{len(value)}'.encode())
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            digest.update(str(key).encode())
+            _update_digest(digest, value[key])
+    elif hasattr(value, 'get_params'):
+        # An estimator: its hyperparameters and the attributes learned by fit, which sklearn names with a trailing '_'
+        digest.update(type(value).__name__.encode())
+        _update_digest(digest, value.get_params(deep=False))
+        _update_digest(digest, {name: attribute for name, attribute in vars(value).items()
+                                if name.endswith('_') and not name.startswith('_')})
+    elif isinstance(getattr(value, '__getstate__', lambda: None)(), dict):
+        # Fitted structures without parameters, e.g. the arrays of a decision tree
+        digest.update(type(value).__name__.encode())
+        _update_digest(digest, value.__getstate__())
+    else:
+        digest.update(repr(value).encode())
+
+
+def _permutation_fingerprint(model, X, y, groups, n_repeats, scoring, random_state):
+    # Key of the cache: the fitted parameters of the model, the evaluation data and the settings of the run
+    digest = hashlib.sha256()
+    _update_digest(digest, model)
+    digest.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    digest.update(np.asarray(X.columns).astype(str).tobytes())
+    digest.update(np.asarray(y).tobytes())
+    digest.update(repr((sorted(groups.items()), n_repeats, scoring, random_state)).encode())
+    return digest.hexdigest()
+
+
+def _score(model, X, y_true, scoring):
+    tn, fp, fn, tp = confusion_counts(y_true, model.predict(X))
+    return metrics_from_confusion(tn, fp, fn, tp)[scoring].iloc[0]
+
+
+_worker_state = {}
+
+
+def _init_permutation_worker(model, X, y, scoring):
+    # Each worker process receives the model and the data once, not once per task
+    _worker_state.update(model=model, X=X, y=y, scoring=scoring)
+
+
+def _permuted_score(task):
+    group, columns, repeat, random_state = task
+    X = _worker_state['X'].copy()
+    # The same row permutation is applied to all columns of the group, so the dummies stay consistent. Every group gets
+    # its own stream of permutations, seeded by its name so it does not depend on the order of the groups.
+    permutation = np.random.default_rng([random_state, zlib.crc32(group.encode()), repeat]).permutation(len(X))
+    X[columns] = X[columns].to_numpy()[permutation]
+    return group, _score(_worker_state['model'], X, _worker_state['y'], _worker_state['scoring'])
+
+
+def permutation_interpretation(X_test_scaled, y_test, model, n_repeats=5, scoring='Balanced Accuracy', groups=None,
+                               n_jobs=None, random_state=0, cache_dir='permutation_cache'):
+    """
+    Permutation importance that is comparable across models: the importance of a feature is the drop of the chosen
+    metric when that feature is shuffled. The dummies of each one-hot encoded category are shuffled together, so
+    e.g. 'country' is reported once instead of once per dummy. The repeats are spread over a process pool (n_jobs=1
+    runs in the current process) and the result is cached in cache_dir, keyed by the model and the data, so it is
+    only computed once per model version.
+    """
+    if groups is None:
+        groups = feature_groups(X_test_scaled.columns)
+
+    cache_file = None
+    if cache_dir is not None:
+        key = _permutation_fingerprint(model, X_test_scaled, y_test, groups, n_repeats, scoring, random_state)
+        cache_file = os.path.join(cache_dir, f'{key}.pkl')
+        if os.path.exists(cache_file):
+            return pd.read_pickle(cache_file)
+
+    tasks = [(group, columns, repeat, random_state) for group, columns in groups.items() for repeat in range(n_repeats)]
+    if n_jobs == 1:
+        _init_permutation_worker(model, X_test_scaled, y_test, scoring)
+        scores = [_permuted_score(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_permutation_worker,
+                                 initargs=(model, X_test_scaled, y_test, scoring)) as executor:
+            scores = list(executor.map(_permuted_score, tasks, chunksize=max(1, len(tasks) // 32)))
+
+    # Importance = baseline score minus the score with the feature permuted
+    baseline = _score(model, X_test_scaled, y_test, scoring)
+    drops = pd.DataFrame(scores, columns=['Feature', 'Score'])
+    drops['Score'] = baseline - drops['Score']
+    weight_df = drops.groupby('Feature', sort=False)['Score'].agg(['mean', 'std']).reset_index()
+    weight_df.columns = ['Feature', 'Importance', 'Importance Std']
+    weight_df_sorted = weight_df.sort_values(by='Importance', ascending=False).reset_index(drop=True)
+
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        weight_df_sorted.to_pickle(cache_file)
+    return weight_df_sorted
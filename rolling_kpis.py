@@ -0,0 +1,78 @@
+import pandas as pd
+
+from dictionaries import all_hotels_label
+
+# Window lengths (in days) of the rolling KPIs
+rolling_windows = [7, 30, 90]
+
+# Additive daily totals from which every rolling KPI is derived
+daily_columns = ['bookings', 'cancellations', 'adr_sum', 'lead_time_sum', 'guests', 'nights']
+
+
+def daily_hotel_aggregates(dataframe):
+    """
+    This function reduces the bookings to one row per hotel and arrival date holding additive totals: the number of
+    bookings and cancellations and the sums of ADR, lead time, guests and nights. Because the totals are additive,
+    aggregates built from separate chunks of data can simply be added together.
+
+    Args:
+    - dataframe (pandas.DataFrame): The dashboard data (one row per booking).
+
+    Returns:
+    - pandas.DataFrame: The daily totals, indexed by `hotel` and `arrival_date`.
+    """
+    daily = pd.DataFrame({
+        'hotel': dataframe['hotel'].astype(str),
+        'arrival_date': dataframe['arrival_date'],
+        'bookings': 1,
+        'cancellations': dataframe['is_canceled'],
+        'adr_sum': dataframe['adr'],
+        'lead_time_sum': dataframe['lead_time'],
+        'guests': dataframe['adults'] + dataframe['total_kids'],
+        'nights': dataframe['stays_in_week_nights'] + dataframe['stays_in_weekend_nights'],
+    })
+    return daily.groupby(['hotel', 'arrival_date']).sum()
+
+
+def rolling_kpis(daily, windows=None):
+    """
+    This function computes trailing-window KPIs for every hotel and arrival date. The daily totals are laid out on a
+    continuous calendar and accumulated once; the total of any window ending on a date is then the difference of two
+    cumulative sums, so every window length costs a single pass over the dates, whatever its size.
+
+    Args:
+    - daily (pandas.DataFrame): The daily totals, as returned by `daily_hotel_aggregates`.
+    - windows (list, optional): The window lengths in days. Defaults to `rolling_windows`.
+
+    Returns:
+    - pandas.DataFrame: One row per hotel (plus 'All Hotels'), arrival date and window length with the bookings,
+      cancellation rate, ADR, lead time, revenue per guest and length of stay of the window ending on that date.
+    """
+    if windows is None:
+        windows = rolling_windows
+
+    # One column per (total, hotel) on a calendar without gaps, so that a shift of w rows is a shift of w days
+    wide = daily[daily_columns].unstack('hotel', fill_value=0)
+    for column in daily_columns:
+        wide[(column, all_hotels_label)] = wide[column].sum(axis=1)
+    calendar_days = pd.date_range(wide.index.min(), wide.index.max(), freq='D', name='arrival_date')
+    cumulative = wide.reindex(calendar_days, fill_value=0).cumsum()
+
+    frames = []
+    for window in windows:
+        # Total of the window [date - window + 1, date] from two prefix sums
+        totals = (cumulative - cumulative.shift(window, fill_value=0)).stack('hotel', future_stack=True)
+        bookings = totals['bookings'].where(totals['bookings'] > 0)
+        frames.append(pd.DataFrame({
+            'window_days': window,
+            'bookings': totals['bookings'],
+            'cancellation_rate': (100 * totals['cancellations'] / bookings).round(2),
+            'adr': (totals['adr_sum'] / bookings).round(2),
+            'avg_lead_time': (totals['lead_time_sum'] / bookings).round(2),
+            'revenue_per_guest': (totals['adr_sum'] / totals['guests'].where(totals['guests'] > 0)).round(2),
+            'length_of_stay': (totals['nights'] / bookings).round(2),
+        }))
+
+    result = pd.concat(frames).reset_index()
+    return result[['hotel', 'arrival_date'] + [column for column in result.columns
+                                                if column not in ('hotel', 'arrival_date')]]
@@ -1,13 +1,35 @@
 import subprocess
 import os
 import datetime
+import argparse
+import json
+import asyncio
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+from checkpoints import start_run, finish_run, cleanup_checkpoints, run_state_file, sample_run_state_file
+from scheduler import (
+    run_lock,  # Lock that keeps a second invocation from running the pipeline concurrently
+    request_run,  # Function to queue a trigger that arrived during a run
+    take_pending_run,  # Function to consume the queued triggers when a check starts
+    has_pending_run,  # Function to check for the triggers queued during the run, once the lock is released
+    source_signature,  # Function to summarize hotel_booking with a single aggregate query
+    load_signature,  # Function to read the signature of the last successful run
+    save_signature,  # Function to persist the signature of a successful run
+    serve  # Function to run the refresh as a long-running asyncio service
+)
 
 # Set the working directory to the script's location
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
+load_dotenv()
 
 # Define the log file name
 log_file = 'run_all.log'
 
+# A failed run is resumed from its last completed stage unless resume=0 is set (e.g. after changing a cleaning rule)
+resume = os.getenv('resume', '1') == '1'
+
 
 # Function to write a message to the log file with a timestamp
 def log_message(message):
@@ -16,24 +38,114 @@ def log_message(message):
         f.write(f"[{timestamp}] {message}\n")
 
 
-try:
-    # Define the Python scripts to run
-    preprocessing_script = r'preprocessing.py'
-    dashboard_script = r'dashboard_dataframe.py'
+# Function to run preprocessing.py and dashboard_dataframe.py, returning True if both succeeded
+def run_pipeline(signature, state_file=run_state_file):
+    # Both scripts of the run share its ID, under which their stage checkpoints are stored. They also receive the
+    # signature of hotel_booking, which keys the extraction checkpoint.
+    run_id = start_run(resume=resume, state_file=state_file)
+    script_env = {**os.environ, 'run_id': run_id, 'source_signature': json.dumps(signature)}
+    log_message(f"Run ID: {run_id}")
+    succeeded = False
+
+    try:
+        # Define the Python scripts to run
+        preprocessing_script = r'preprocessing.py'
+        dashboard_script = r'dashboard_dataframe.py'
+
+        # Run the preprocessing script
+        log_message("Starting preprocessing script...")
+        subprocess.run(['python', preprocessing_script], check=True, env=script_env)
+        log_message("Preprocessing completed successfully.")
+
+        # Run the dashboard data preparation script
+        log_message("Starting dashboard script...")
+        subprocess.run(['python', dashboard_script], check=True, env=script_env)
+        log_message("Dashboard data updated successfully.")
+        succeeded = True
+
+    # Catch and log any errors during the script executions
+    except subprocess.CalledProcessError as e:
+        log_message(f"Script failed with error: {e}")
+        log_message(f"The next run resumes run {run_id} from its last completed stage.")
+
+    finish_run(run_id, succeeded=succeeded, state_file=state_file)
+
+    # Remove the checkpoints of old runs
+    cleanup_checkpoints()
+
+    # Log the end of the run
+    log_message("Run completed.\n")
+    return succeeded
+
+
+# Function to run the pipeline under the lock, skipping it when hotel_booking did not change since the last success
+def refresh(engine, if_changed=True, method='checksum', key_column=None):
+    while True:
+        with run_lock() as acquired:
+            # Another run is in progress: queue the trigger, the running invocation reruns once when it finishes
+            if not acquired:
+                request_run()
+                log_message("A run is already in progress, the trigger was queued.")
+                return
+
+            # The triggers queued before this point are served by the check that starts now
+            take_pending_run()
+
+            # The signature is taken before the run, so changes made during the run are picked up by the next one
+            signature = source_signature(engine, 'hotel_booking', method, key_column)
+            if if_changed and signature == load_signature():
+                log_message("hotel_booking did not change since the last successful run, refresh skipped.")
+            elif run_pipeline(signature):
+                save_signature(signature)
+
+        # Every trigger received during the run is served by a single rerun, only if hotel_booking changed. The check
+        # comes after the lock is released, so a trigger queued while the run was ending is not lost.
+        if not has_pending_run():
+            return
+        log_message("Checking again for the triggers received during the run.")
+        if_changed = True
 
-    # Run the preprocessing script
-    log_message("Starting preprocessing script...")
-    subprocess.run(['python', preprocessing_script], check=True)
-    log_message("Preprocessing completed successfully.")
 
-    # Run the dashboard data preparation script
-    log_message("Starting dashboard script...")
-    subprocess.run(['python', dashboard_script], check=True)
-    log_message("Dashboard data updated successfully.")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Refresh the dashboard data.")
+    parser.add_argument('--if-changed', action='store_true',
+                        help="skip the refresh when hotel_booking did not change since the last successful run")
+    parser.add_argument('--serve', action='store_true',
+                        help="keep running and refresh every --interval seconds or on SIGUSR1 (implies --if-changed)")
+    parser.add_argument('--interval', type=float, default=300, help="seconds between two scheduled refreshes")
+    parser.add_argument('--change-detection', choices=['count', 'max_key', 'checksum'], default='checksum',
+                        help="how hotel_booking is compared with the last successful run")
+    parser.add_argument('--key-column', help="the column compared by --change-detection max_key")
+    parser.add_argument('--sample', type=float, metavar='FRACTION',
+                        help="run on a stratified sample of hotel_booking and write to '_sample' outputs")
+    parser.add_argument('--sample-seed', type=int, default=0, help="seed of the sample")
+    args = parser.parse_args()
+    if args.change_detection == 'max_key' and not args.key_column:
+        parser.error("--change-detection max_key requires --key-column")
 
-# Catch and log any errors during the script executions
-except subprocess.CalledProcessError as e:
-    log_message(f"Script failed with error: {e}")
+    username = os.getenv('postgresuser')
+    password = os.getenv('password')
+    host = os.getenv('host')
+    port = os.getenv('port')
+    db_name = os.getenv('db_name')
+    engine = create_engine(f'postgresql://{username}:{password}@{host}:{port}/{db_name}')
 
-# Log the end of the run
-log_message("Run completed.\n")
+    if args.sample:
+        # A development run on a sample: the scripts read the fraction and seed from the environment. The production
+        # signature is left untouched, so the next --if-changed run is not skipped because of it, and the sample run
+        # keeps its own run state, so it never resumes a failed production run.
+        os.environ['sample_fraction'] = str(args.sample)
+        os.environ['sample_seed'] = str(args.sample_seed)
+        with run_lock() as acquired:
+            if acquired:
+                log_message(f"Sample run: {args.sample:.0%} of hotel_booking (seed {args.sample_seed}).")
+                run_pipeline(source_signature(engine, 'hotel_booking', args.change_detection, args.key_column),
+                             sample_run_state_file)
+            else:
+                log_message("A run is already in progress, the sample run was not started.")
+    elif args.serve:
+        log_message(f"Starting the refresh service (every {args.interval:g} s).")
+        asyncio.run(serve(lambda: refresh(engine, True, args.change_detection, args.key_column), args.interval))
+    else:
+        # Without options, the pipeline always runs (as before), but never concurrently with another run
+        refresh(engine, args.if_changed, args.change_detection, args.key_column)
@@ -0,0 +1,165 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from dictionaries import hotels, all_hotels_label
+
+# The sample keeps the same share of bookings in every hotel, arrival year and cancellation status
+strata_columns = ['hotel', 'arrival_date_year', 'is_canceled']
+
+# Suffix of every table and file written by a sample run, so production outputs are never overwritten
+sample_suffix = '_sample'
+
+# Helper columns added by the sample query
+sample_columns = ['sample_rank', 'stratum_rows']
+
+# z-value of the reported error margins (95% confidence)
+margin_z = 1.96
+
+# Columns of the dashboard data read by `sample_kpi_margins`
+margin_source_columns = ['hotel', 'arrival_date_year', 'is_canceled', 'previous_cancellations', 'adr', 'lead_time',
+                         'adults', 'total_kids', 'stays_in_week_nights', 'stays_in_weekend_nights']
+
+# KPIs of the KPI table with their numerator and denominator (None for totals), see kpi_accumulators.finalize_kpis
+margin_kpis = [
+    ('Total Bookings', 'bookings', None, 1),
+    ('Cancellation Rate (%)', 'is_canceled', 'bookings', 100),
+    ('Previous Cancellation Rate (%)', 'previous_cancellations', 'bookings', 100),
+    ('Total Revenue (€)', 'adr', None, 1),
+    ('ADR (€)', 'adr', 'bookings', 1),
+    ('Average Lead Time (days)', 'lead_time', 'bookings', 1),
+    ('Revenue per Guest (€)', 'adr', 'guests', 1),
+    ('Length of Stay (days)', 'nights', 'bookings', 1),
+]
+
+
+def current_sample_fraction():
+    # run_all.py --sample sets the fraction of hotel_booking to extract; None runs the pipeline on the full table
+    fraction = float(os.getenv('sample_fraction', '0'))
+    return fraction if 0 < fraction < 1 else None
+
+
+def current_sample_seed():
+    # Runs with the same seed and fraction draw the same sample
+    return int(os.getenv('sample_seed', '0'))
+
+
+def output_name(name, fraction=None):
+    """
+    Returns the name of a table, file or directory in the current mode: in sample mode 'dashboard_data' becomes
+    'dashboard_data_sample' and 'hotel_kpis.csv' becomes 'hotel_kpis_sample.csv'.
+
+    Args:
+    - name (str): The name of the production output.
+    - fraction (float, optional): The sample fraction. Defaults to `current_sample_fraction()`.
+
+    Returns:
+    - str: The name to use.
+    """
+    if fraction is None:
+        fraction = current_sample_fraction()
+    if not fraction:
+        return name
+    root, extension = os.path.splitext(name)
+    return f'{root}{sample_suffix}{extension}'
+
+
+def stratified_sample_query(table_name='hotel_booking', fraction=0.05, seed=0):
+    """
+    Builds the extraction query of a reproducible stratified sample: within every stratum (see `strata_columns`) the
+    rows are ranked by a hash of their content and the seed, and the first CEIL(fraction * stratum size) are kept.
+    The same seed and fraction always select the same bookings, whatever the physical order of the table.
+
+    Args:
+    - table_name (str): The source table.
+    - fraction (float): The share of each stratum to keep, between 0 and 1.
+    - seed (int): The seed of the sample.
+
+    Returns:
+    - str: The SQL query. Its result holds the helper columns in `sample_columns`.
+    """
+    strata = ', '.join(strata_columns)
+    return (f"SELECT * FROM ("
+            f"SELECT t.*, ROW_NUMBER() OVER (PARTITION BY {strata} ORDER BY MD5('{int(seed)}' || t::text)) "
+            f"AS sample_rank, COUNT(*) OVER (PARTITION BY {strata}) AS stratum_rows FROM {table_name} t) ranked "
+            f"WHERE sample_rank <= CEIL({float(fraction)} * stratum_rows)")
+
+
+def stratum_counts_query(table_name='hotel_booking', fraction=0.05):
+    # Size of every stratum in the source table and number of its rows kept by `stratified_sample_query`
+    strata = ', '.join(strata_columns)
+    return (f"SELECT {strata}, COUNT(*) AS population, CEIL({float(fraction)} * COUNT(*)) AS sampled "
+            f"FROM {table_name} GROUP BY {strata}")
+
+
+def _stratified_estimate(codes, population, sampled, numerator, denominator):
+    # Stratified estimate of a total (denominator None) or of a ratio of totals, with the linearized standard error.
+    # Bookings of the sample removed by the cleaning steps count as zeros, so their stratum keeps its sample size.
+    n_strata = len(population)
+    weights = population / sampled
+
+    def stratum_sums(values):
+        return np.bincount(codes, weights=values, minlength=n_strata)
+
+    sum_y, sum_yy = stratum_sums(numerator), stratum_sums(numerator ** 2)
+    estimate = np.sum(weights * sum_y)
+    if denominator is None:
+        sum_z, sum_zz, scale = sum_y, sum_yy, 1.0
+    else:
+        denominator_total = np.sum(weights * stratum_sums(denominator))
+        estimate = estimate / denominator_total
+        sum_x, sum_xx, sum_xy = (stratum_sums(denominator), stratum_sums(denominator ** 2),
+                                 stratum_sums(numerator * denominator))
+        # Residuals z = y - R x of the ratio estimator
+        sum_z = sum_y - estimate * sum_x
+        sum_zz = sum_yy - 2 * estimate * sum_xy + estimate ** 2 * sum_xx
+        scale = 1 / denominator_total
+
+    stratum_variance = np.divide(sum_zz - sum_z ** 2 / sampled, sampled - 1, out=np.zeros(n_strata),
+                                 where=sampled > 1)
+    variance = np.sum(population ** 2 * (1 - sampled / population) * np.maximum(stratum_variance, 0) / sampled)
+    return estimate, np.sqrt(variance) * scale
+
+
+def sample_kpi_margins(dataframe, stratum_counts):
+    """
+    Estimates the KPIs of the full table from the dashboard data of a sample run, with a 95% error margin. Every
+    booking stands for population / sampled bookings of its stratum, so the totals (bookings, revenue) are scaled
+    up to the full table; rates and averages are ratios of two estimated totals.
+
+    Args:
+    - dataframe (pandas.DataFrame): The dashboard data of the sample run.
+    - stratum_counts (pandas.DataFrame): The result of `stratum_counts_query`.
+
+    Returns:
+    - pandas.DataFrame: The columns `hotel`, `kpi`, `estimate` and `margin` (half-width of the 95% interval).
+    """
+    strata = stratum_counts.assign(hotel=stratum_counts['hotel'].astype(str)).reset_index(drop=True)
+    population = strata['population'].to_numpy(dtype=float)
+    sampled = strata['sampled'].to_numpy(dtype=float)
+
+    data = pd.DataFrame({
+        'hotel': dataframe['hotel'].astype(str),
+        'arrival_date_year': dataframe['arrival_date_year'].astype(strata['arrival_date_year'].dtype),
+        'is_canceled': dataframe['is_canceled'].astype(strata['is_canceled'].dtype),
+        'bookings': 1.0,
+        'previous_cancellations': dataframe['previous_cancellations'],
+        'adr': dataframe['adr'],
+        'lead_time': dataframe['lead_time'],
+        'guests': dataframe['adults'] + dataframe['total_kids'],
+        'nights': dataframe['stays_in_week_nights'] + dataframe['stays_in_weekend_nights'],
+    })
+    codes = pd.MultiIndex.from_frame(strata[strata_columns]).get_indexer(
+        pd.MultiIndex.from_frame(data[strata_columns]))
+
+    rows = []
+    for hotel in [all_hotels_label] + hotels:
+        # Bookings of the other hotel count as zeros, which restricts every total to the hotel
+        in_scope = np.ones(len(data)) if hotel == all_hotels_label else (data['hotel'] == hotel).to_numpy(float)
+        for kpi, numerator, denominator, unit in margin_kpis:
+            estimate, error = _stratified_estimate(
+                codes, population, sampled, data[numerator].to_numpy(dtype=float) * in_scope,
+                None if denominator is None else data[denominator].to_numpy(dtype=float) * in_scope)
+            rows.append((hotel, kpi, round(estimate * unit, 2), round(margin_z * error * unit, 2)))
+    return pd.DataFrame(rows, columns=['hotel', 'kpi', 'estimate', 'margin'])
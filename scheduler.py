@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+import signal
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+# Files shared by every invocation of run_all.py in the project directory
+lock_file = 'run_all.lock'
+pending_file = 'run_all.pending'
+signature_file = 'run_all_signature.json'
+
+# Signature queries of the source table, from the cheapest to the most thorough:
+# - 'count' only detects inserted or deleted rows,
+# - 'max_key' also detects new rows that replace deleted ones, given a column that grows with every new booking,
+# - 'checksum' detects any change to any row, with an order-insensitive sum of row hashes computed in the database.
+signature_queries = {
+    'count': "SELECT COUNT(*) AS row_count FROM {table}",
+    'max_key': "SELECT COUNT(*) AS row_count, MAX({key_column}) AS max_key FROM {table}",
+    'checksum': "SELECT COUNT(*) AS row_count, SUM(('x' || LEFT(MD5(t::text), 15))::bit(60)::bigint) AS checksum "
+                "FROM {table} t",
+}
+
+
+@contextmanager
+def run_lock(path=lock_file):
+    """
+    Takes an exclusive, non-blocking lock on a file, so that only one pipeline runs at a time. The lock is held by
+    the operating system and released when the process ends, even if it crashes, so it never has to be cleaned up.
+
+    Args:
+    - path (str): The lock file.
+
+    Yields:
+    - bool: True if the lock was acquired, False if another run holds it.
+    """
+    handle = open(path, 'a+')
+    try:
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        yield True
+    finally:
+        handle.close()
+
+
+def request_run(path=pending_file):
+    # Record a trigger that arrived during a run; any number of triggers leave a single marker, i.e. a single rerun
+    open(path, 'a').close()
+
+
+def has_pending_run(path=pending_file):
+    # Whether a trigger is waiting, without consuming it: the next holder of the lock takes it
+    return os.path.exists(path)
+
+
+def take_pending_run(path=pending_file):
+    # Consume the marker left by the triggers that arrived during the run, if any
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def source_signature(engine, table_name='hotel_booking', method='checksum', key_column=None):
+    """
+    Summarizes the content of the source table with a single aggregate query, so that a refresh can be skipped when
+    nothing changed since the last successful run without extracting the table.
+
+    Args:
+    - engine (sqlalchemy.engine.Engine): The connection to the database.
+    - table_name (str): The source table.
+    - method (str): 'count', 'max_key' or 'checksum', see `signature_queries`.
+    - key_column (str, optional): The column used by the 'max_key' method.
+
+    Returns:
+    - dict: The method and the values it returned, comparable with `==`.
+
+    Raises:
+    - ValueError: If the 'max_key' method is used without a key column.
+    """
+    if method == 'max_key' and key_column is None:
+        raise ValueError("The 'max_key' signature needs a key column")
+    query = signature_queries[method].format(table=table_name, key_column=key_column)
+    with engine.connect() as connection:
+        row = connection.execute(text(query)).mappings().one()
+    return {'method': method, **{name: str(value) for name, value in row.items()}}
+
+
+def passed_signature():
+    # The signature run_all.py took before the run and passed to the scripts, None when a script is run by hand
+    signature = os.getenv('source_signature')
+    return json.loads(signature) if signature else None
+
+
+def load_signature(path=signature_file):
+    # The signature of the source table at the last successful run, None before the first one
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_signature(signature, path=signature_file):
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(signature, f)
+    os.replace(temporary_path, path)
+
+
+async def serve(refresh, interval=300):
+    """
+    Runs `refresh` as a long-running service: every `interval` seconds, and whenever the process receives SIGUSR1
+    (e.g. `kill -USR1 <pid>` from the job that loads new bookings). Triggers that arrive while a refresh is running
+    are coalesced into a single follow-up refresh.
+
+    Args:
+    - refresh (callable): The blocking function to run, executed in a worker thread.
+    - interval (float): The number of seconds between two scheduled refreshes.
+    """
+    trigger = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    if hasattr(signal, 'SIGUSR1'):
+        loop.add_signal_handler(signal.SIGUSR1, trigger.set)
+
+    async def tick():
+        while True:
+            trigger.set()
+            await asyncio.sleep(interval)
+
+    ticker = asyncio.create_task(tick())
+    try:
+        while True:
+            await trigger.wait()
+            trigger.clear()
+            await asyncio.to_thread(refresh)
+    finally:
+        ticker.cancel()
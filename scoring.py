@@ -0,0 +1,153 @@
+import hashlib
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from results import one_hot_categories
+
+# Classifier persisted by the modeling notebook with `save_classifier`
+classifier_file = 'cancellation_model.pkl'
+
+# Number of rows scored per task: large enough to amortize the per-task overhead, small enough to bound the memory
+chunk_rows = 50_000
+
+# Columns of logreg_rf_data that are not features
+non_feature_columns = ['is_canceled', 'last_updated']
+
+
+def save_classifier(model, path=classifier_file):
+    """
+    This function persists a fitted classifier for the scoring stage of preprocessing.py. The model must be fitted on
+    a DataFrame of logreg_rf_data, so that it records its feature columns (`feature_names_in_`), and include its
+    preprocessing (e.g. a scikit-learn Pipeline of the scaler and the model), since it receives the unscaled features.
+
+    Args:
+    - model: The fitted classifier, with `predict_proba`.
+    - path (str): The location of the pickle file.
+    """
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as f:
+        pickle.dump(model, f)
+    os.replace(temporary_path, path)
+
+
+def load_classifier(path=classifier_file):
+    # The persisted classifier, None if no model was saved yet
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def classifier_version(path=classifier_file):
+    # Hash of the persisted classifier, so the scores are recomputed whenever the model file is replaced
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def feature_matrix(dataframe, model, categories=None):
+    """
+    This function selects the features of the model data in the exact columns and order the classifier was trained
+    on. A one-hot column missing from this run (a level without any booking) is all zeros, as it would have been in
+    the encoding. A one-hot column the classifier does not know (a new level) cannot be represented, so the rows that
+    have it would silently be scored as the first level: this raises an error instead.
+
+    Args:
+    - dataframe (pandas.DataFrame): The encoded model data (logreg_rf_data).
+    - model: The classifier. Its `feature_names_in_` define the columns; without them, every column of the data
+      except `non_feature_columns` is used.
+    - categories (list, optional): The one-hot encoded columns. Defaults to `results.one_hot_categories`.
+
+    Returns:
+    - pandas.DataFrame: The features, one row per row of the data.
+    """
+    if categories is None:
+        categories = one_hot_categories
+    feature_columns = getattr(model, 'feature_names_in_', None)
+    if feature_columns is None:
+        return dataframe.drop(columns=non_feature_columns, errors='ignore')
+    feature_columns = list(feature_columns)
+
+    def is_one_hot(column):
+        return any(column.startswith(f'{category}_') for category in categories)
+
+    missing = [column for column in feature_columns if column not in dataframe.columns]
+    if any(not is_one_hot(column) for column in missing):
+        raise ValueError(f"The model data lacks features of the classifier: {missing}")
+    unknown = [column for column in dataframe.columns
+               if is_one_hot(column) and column not in feature_columns and dataframe[column].any()]
+    if unknown:
+        raise ValueError(f"The model data has category levels the classifier was not trained on: {unknown}")
+    return dataframe.reindex(columns=feature_columns, fill_value=0)
+
+
+_worker_state = {}
+
+
+def _init_scoring_worker(model):
+    # Each worker process receives the model once, not once per chunk
+    _worker_state['model'] = model
+
+
+def _score_chunk(features):
+    model = _worker_state['model']
+    positive_class = list(model.classes_).index(1)
+    return model.predict_proba(features)[:, positive_class]
+
+
+def score_in_chunks(model, features, chunk_rows=chunk_rows, max_workers=None):
+    """
+    This function returns the probability of cancellation of every row, scoring fixed-size chunks of rows. The chunks
+    are spread over a process pool when there is more than one of them (max_workers=1 scores in the current
+    process), so large tables use every core while the memory of a task stays bounded by the chunk size. The workers
+    are spawned, not forked: the pipeline has started threads and opened connections by then, which a forked child
+    would inherit in an undefined state. The script calling this function must therefore guard its entry point with
+    `if __name__ == '__main__':`, since every spawned worker imports it.
+
+    Args:
+    - model: The classifier, with `predict_proba` and `classes_`.
+    - features (pandas.DataFrame): The features, e.g. from `feature_matrix`.
+    - chunk_rows (int): The number of rows scored per task.
+    - max_workers (int, optional): The number of processes. Defaults to the number of cores.
+
+    Returns:
+    - numpy.ndarray: The probabilities, in the order of the rows.
+    """
+    chunks = [features.iloc[start:start + chunk_rows] for start in range(0, len(features), chunk_rows)]
+    if not chunks:
+        return np.empty(0)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1 or len(chunks) == 1:
+        _init_scoring_worker(model)
+        probabilities = [_score_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_scoring_worker, initargs=(model,)) as executor:
+            probabilities = list(executor.map(_score_chunk, chunks))
+    return np.concatenate(probabilities)
+
+
+def join_scores(dataframe, keys, probabilities, key_column='booking_key', column='cancellation_probability'):
+    """
+    This function adds the probabilities of the model rows to the dashboard rows of the same bookings. Bookings that
+    the model branch removed (e.g. an undefined distribution channel) get no probability. The key column only serves
+    the join and is not published.
+
+    Args:
+    - dataframe (pandas.DataFrame): The dashboard data, with the key column.
+    - keys (array-like): The keys of the scored rows.
+    - probabilities (array-like): The probabilities of the scored rows.
+    - key_column (str): The column identifying a booking in both branches.
+    - column (str): The name of the new column.
+
+    Returns:
+    - pandas.DataFrame: The dashboard data with the probability column, without the key column.
+    """
+    # The keys are unique per row, including the flagged copies of a booking (see `duplicates.booking_keys`)
+    scores = pd.Series(np.asarray(probabilities, dtype=float), index=pd.Index(keys))
+    return dataframe.assign(**{column: dataframe[key_column].map(scores)}).drop(columns=key_column)
@@ -0,0 +1,312 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from dictionaries import all_hotels_label
+
+# QUANTILE SKETCH
+# Values are counted in logarithmic buckets: bucket k holds the values in (gamma**(k-1), gamma**k], so any quantile is
+# returned with a relative error of at most `relative_accuracy`. The bucket layout is fixed, which makes a sketch a
+# plain array of counts: sketches of different partitions or runs are merged by adding them.
+relative_accuracy = 0.01
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+min_sketch_value = 0.01  # Values below this one (e.g. ADR of 0) are counted in the zero bucket
+max_sketch_value = 1e6  # Values above this one are counted in the last bucket
+min_bucket = int(np.ceil(np.log(min_sketch_value) / np.log(gamma)))
+max_bucket = int(np.ceil(np.log(max_sketch_value) / np.log(gamma)))
+quantile_sketch_size = max_bucket - min_bucket + 2  # One zero bucket plus the logarithmic buckets
+
+# DISTINCT-COUNT SKETCH (HyperLogLog)
+# The 64-bit hash of each value selects one of 2**precision registers with its first bits, and the register keeps the
+# longest run of leading zeros seen in the remaining bits. Sketches are merged with an element-wise maximum.
+hll_precision = 12  # 4096 registers, about 1.6% standard error
+hll_registers = 2 ** hll_precision
+
+# Columns summarized by default: quantiles of the skewed numeric KPIs and distinct counts of the guest origin
+quantile_columns = ['adr', 'lead_time', 'length_of_stay']
+distinct_columns = ['country']
+
+# File of the sketch directory recording, for every month, the fingerprint of the published data it was built from
+sketch_fingerprints_file = 'fingerprints.json'
+
+
+def _quantile_buckets(values):
+    # Bucket of every value in the fixed layout; 0 is the zero bucket
+    values = np.asarray(values, dtype=float)
+    buckets = np.zeros(values.size, dtype=np.int64)
+    positive = values > min_sketch_value
+    buckets[positive] = np.clip(np.ceil(np.log(values[positive]) / np.log(gamma)).astype(np.int64),
+                                min_bucket, max_bucket) - min_bucket + 1
+    return buckets
+
+
+def quantile_sketch(values):
+    """
+    Builds a quantile sketch of the values.
+
+    Args:
+    - values (array-like): The non-negative numeric values to summarize.
+
+    Returns:
+    - numpy.ndarray: The bucket counts of the sketch.
+    """
+    return np.bincount(_quantile_buckets(values), minlength=quantile_sketch_size)
+
+
+def sketch_quantile(sketch, q):
+    """
+    Estimates a quantile from a (possibly merged) quantile sketch.
+
+    Args:
+    - sketch (numpy.ndarray): The bucket counts of the sketch.
+    - q (float): The quantile to estimate, between 0 and 1.
+
+    Returns:
+    - float: The estimated quantile, NaN for an empty sketch.
+    """
+    total = sketch.sum()
+    if total == 0:
+        return np.nan
+    bucket = int(np.searchsorted(np.cumsum(sketch), q * (total - 1), side='right'))
+    if bucket == 0:
+        return 0.0
+    # Midpoint (in relative terms) of the bucket, which bounds the relative error
+    k = bucket - 1 + min_bucket
+    return float(2 * gamma ** k / (gamma + 1))
+
+
+def _hll_registers(values):
+    # Register index and rank (position of the first set bit) of every value
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+    index = (hashes >> np.uint64(64 - hll_precision)).astype(np.int64)
+    # The remaining bits fit exactly in a float64, so frexp gives the exact position of their highest set bit
+    remainder = (hashes & np.uint64((1 << (64 - hll_precision)) - 1)).astype(float)
+    rank = (64 - hll_precision) - np.frexp(remainder)[1] + 1
+    return index, rank.astype(np.int8)
+
+
+def distinct_sketch(values):
+    """
+    Builds a HyperLogLog distinct-count sketch of the values. Missing values are ignored.
+
+    Args:
+    - values (array-like): The values whose distinct count is estimated.
+
+    Returns:
+    - numpy.ndarray: The registers of the sketch.
+    """
+    values = pd.Series(values).dropna()
+    registers = np.zeros(hll_registers, dtype=np.int8)
+    index, rank = _hll_registers(values)
+    np.maximum.at(registers, index, rank)
+    return registers
+
+
+def sketch_distinct_count(registers):
+    """
+    Estimates the number of distinct values from a (possibly merged) HyperLogLog sketch.
+
+    Args:
+    - registers (numpy.ndarray): The registers of the sketch.
+
+    Returns:
+    - float: The estimated number of distinct values.
+    """
+    m = registers.size
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m ** 2 / np.sum(2.0 ** -registers.astype(float))
+    empty_registers = np.count_nonzero(registers == 0)
+    # Linear counting is more accurate while many registers are still empty
+    if estimate <= 2.5 * m and empty_registers > 0:
+        estimate = m * np.log(m / empty_registers)
+    return float(estimate)
+
+
+def merge_sketches(sketches, kind):
+    # Quantile sketches add up, distinct-count sketches keep the largest rank per register
+    sketches = list(sketches)
+    if kind == 'quantile':
+        return np.sum(sketches, axis=0)
+    return np.maximum.reduce(sketches)
+
+
+def build_partition_sketches(dataframe, period='M', months=None):
+    """
+    Builds the sketches of every hotel and arrival period in one pass: the bucket (or register) of every booking is
+    computed once and all partitions are filled together with a single scatter per column.
+
+    Args:
+    - dataframe (pandas.DataFrame): The dashboard data (one row per booking).
+    - period (str): The pandas period frequency of the partitions, monthly by default.
+    - months (list, optional): Only the bookings of these months ('YYYY-MM') are sketched, e.g. the result of
+      `stale_sketch_months`. By default, every booking is.
+
+    Returns:
+    - dict: {(hotel, period): {column: sketch}} for the columns in `quantile_columns` and `distinct_columns`.
+    """
+    if months is not None:
+        dataframe = dataframe.loc[dataframe['arrival_date'].dt.to_period('M').astype(str).isin(months)]
+    if dataframe.empty:
+        return {}
+    data = dataframe.assign(length_of_stay=dataframe['stays_in_week_nights'] + dataframe['stays_in_weekend_nights'])
+    keys = pd.MultiIndex.from_arrays([data['hotel'].astype(str),
+                                      data['arrival_date'].dt.to_period(period).astype(str)])
+    codes, partitions = pd.factorize(keys, sort=True)
+
+    columns = {}
+    for column in quantile_columns:
+        cells = codes * quantile_sketch_size + _quantile_buckets(data[column])
+        columns[column] = np.bincount(cells, minlength=len(partitions) * quantile_sketch_size).reshape(
+            len(partitions), quantile_sketch_size)
+    for column in distinct_columns:
+        present = data[column].notna().to_numpy()
+        index, rank = _hll_registers(data[column].to_numpy()[present])
+        registers = np.zeros(len(partitions) * hll_registers, dtype=np.int8)
+        np.maximum.at(registers, codes[present] * hll_registers + index, rank)
+        columns[column] = registers.reshape(len(partitions), hll_registers)
+
+    return {partition: {column: sketches[i] for column, sketches in columns.items()}
+            for i, partition in enumerate(partitions)}
+
+
+def merge_partition_sketches(*partition_sketches):
+    # Merge the sketches of the same hotel and period built from different chunks, processes or runs
+    merged = {}
+    for sketches_by_partition in partition_sketches:
+        for partition, sketches in sketches_by_partition.items():
+            if partition not in merged:
+                merged[partition] = dict(sketches)
+                continue
+            for column, sketch in sketches.items():
+                kind = 'quantile' if column in quantile_columns else 'distinct'
+                merged[partition][column] = merge_sketches([merged[partition][column], sketch], kind)
+    return merged
+
+
+def _sketch_file_name(hotel, period):
+    return f"{hotel.replace(' ', '_')}__{period}.npz"
+
+
+def _remove_other_sketches(directory, partitions):
+    # Remove the persisted partitions that are not in `partitions`
+    file_names = {_sketch_file_name(hotel, period) for hotel, period in partitions}
+    for file_name in os.listdir(directory):
+        if file_name.endswith('.npz') and file_name not in file_names:
+            os.remove(os.path.join(directory, file_name))
+
+
+def save_partition_sketches(partition_sketches, directory='sketches', prune=False):
+    # One compressed file per partition, so a run can replace the partitions it rebuilt and keep the others.
+    # With prune=True, the persisted partitions that are not part of partition_sketches are removed.
+    os.makedirs(directory, exist_ok=True)
+    for (hotel, period), sketches in partition_sketches.items():
+        np.savez_compressed(os.path.join(directory, _sketch_file_name(hotel, period)), **sketches)
+    if prune:
+        _remove_other_sketches(directory, partition_sketches)
+
+
+def load_partition_sketches(directory='sketches'):
+    # Read back every persisted partition as {(hotel, period): {column: sketch}}
+    partition_sketches = {}
+    if not os.path.isdir(directory):
+        return partition_sketches
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.npz'):
+            hotel, period = file_name[:-len('.npz')].split('__')
+            with np.load(os.path.join(directory, file_name)) as sketches:
+                partition_sketches[(hotel.replace('_', ' '), period)] = dict(sketches)
+    return partition_sketches
+
+
+def load_sketch_fingerprints(directory='sketches'):
+    # The fingerprint of the published month behind every persisted month of sketches, empty before the first run
+    path = os.path.join(directory, sketch_fingerprints_file)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def stale_sketch_months(month_fingerprints, directory='sketches'):
+    """
+    Lists the months whose persisted sketches do not match the published data: new months, and months whose
+    fingerprint changed since their sketches were built. Only the bookings of these months need to be sketched again.
+
+    Args:
+    - month_fingerprints (dict): {month ('YYYY-MM'): fingerprint} of the published data, e.g. from the partition
+      metadata written by publishing.py.
+    - directory (str): The directory of the persisted sketches.
+
+    Returns:
+    - list: The months to rebuild, sorted.
+    """
+    persisted = load_sketch_fingerprints(directory)
+    return sorted(month for month, fingerprint in month_fingerprints.items() if persisted.get(month) != fingerprint)
+
+
+def refresh_partition_sketches(rebuilt, month_fingerprints, directory='sketches'):
+    """
+    Replaces the persisted sketches of the stale months by the rebuilt ones, removes the months that are no longer
+    published and keeps the other months as they are. The fingerprints are written last, so an interrupted refresh
+    only leaves months that are rebuilt again by the next run.
+
+    Args:
+    - rebuilt (dict): The sketches of the bookings of the stale months, as returned by `build_partition_sketches`.
+    - month_fingerprints (dict): {month: fingerprint} of all the published months.
+    - directory (str): The directory of the persisted sketches.
+
+    Returns:
+    - dict: The sketches of every published month, {(hotel, period): {column: sketch}}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stale_months = set(stale_sketch_months(month_fingerprints, directory))
+    kept = {partition: sketches for partition, sketches in load_partition_sketches(directory).items()
+            if partition[1] in month_fingerprints and partition[1] not in stale_months}
+    partition_sketches = {**kept, **rebuilt}
+    save_partition_sketches(rebuilt, directory)
+    _remove_other_sketches(directory, partition_sketches)
+
+    temporary_path = os.path.join(directory, f'{sketch_fingerprints_file}.tmp')
+    with open(temporary_path, 'w') as f:
+        json.dump(month_fingerprints, f, indent=2)
+    os.replace(temporary_path, os.path.join(directory, sketch_fingerprints_file))
+    return partition_sketches
+
+
+def sketch_summary(partition_sketches, group_by='hotel', quantiles=(0.5, 0.9, 0.95)):
+    """
+    Merges the partition sketches into the distribution KPIs of each group, without rescanning the bookings.
+
+    Args:
+    - partition_sketches (dict): The sketches returned by `build_partition_sketches` or `load_partition_sketches`.
+    - group_by (str): 'hotel' for one row per hotel, 'hotel_period' for one row per hotel and period or 'all' for a
+      single row covering every partition.
+    - quantiles (tuple): The quantiles reported for every column in `quantile_columns`.
+
+    Returns:
+    - pandas.DataFrame: One row per group with the quantiles and the distinct counts. Without any sketch, the table
+      is empty but keeps its columns.
+    """
+    key_columns = {'hotel_period': ['hotel', 'period']}.get(group_by, ['hotel'])
+    columns = key_columns + [f'{column}_p{int(round(q * 100))}' for column in quantile_columns for q in quantiles]
+    columns += [f'distinct_{column}' for column in distinct_columns]
+
+    groups = {}
+    for (hotel, period), sketches in partition_sketches.items():
+        key = {'hotel': (hotel,), 'hotel_period': (hotel, period), 'all': (all_hotels_label,)}[group_by]
+        groups.setdefault(key, []).append(sketches)
+
+    rows = []
+    for key, members in sorted(groups.items()):
+        row = dict(zip(key_columns, key))
+        for column in quantile_columns:
+            merged = merge_sketches((sketches[column] for sketches in members), kind='quantile')
+            for q in quantiles:
+                row[f'{column}_p{int(round(q * 100))}'] = round(sketch_quantile(merged, q), 2)
+        for column in distinct_columns:
+            merged = merge_sketches((sketches[column] for sketches in members), kind='distinct')
+            row[f'distinct_{column}'] = round(sketch_distinct_count(merged))
+        rows.append(row)
+    return pd.DataFrame(rows, columns=columns)
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from dictionaries import all_hotels_label
+
+
+def stay_night_totals(dataframe):
+    """
+    This function computes, for every hotel and night, the number of rooms occupied and the room revenue, without
+    expanding the bookings into one row per night. Each stayed (non-canceled) booking adds +1 room and +ADR to a
+    difference array on its check-in date and -1 room and -ADR on its check-out date; all bookings are scattered at
+    once with a weighted bincount and a cumulative sum along the calendar turns the differences into nightly totals.
+    Memory therefore grows with the number of bookings plus the number of days, not with the number of nights.
+
+    Args:
+    - dataframe (pandas.DataFrame): The dashboard data (one row per booking).
+
+    Returns:
+    - pandas.DataFrame: One row per hotel and night with the columns `rooms_occupied` and `room_revenue`.
+    """
+    stayed = dataframe.loc[dataframe['is_canceled'] == 0]
+    return stay_night_totals_from_groups(pd.DataFrame({
+        'hotel': stayed['hotel'],
+        'arrival_date': stayed['arrival_date'],
+        'nights': stayed['stays_in_week_nights'] + stayed['stays_in_weekend_nights'],
+        'bookings': 1,
+        'adr_sum': stayed['adr'],
+    }))
+
+
+def stay_night_totals_from_groups(groups):
+    """
+    This function does the same as `stay_night_totals` for stayed bookings already grouped by hotel, arrival date
+    and number of nights (e.g. by the database): each group adds its number of bookings and its ADR sum at check-in
+    and removes them at check-out.
+
+    Args:
+    - groups (pandas.DataFrame): The columns `hotel`, `arrival_date`, `nights`, `bookings` and `adr_sum`.
+
+    Returns:
+    - pandas.DataFrame: One row per hotel and night with the columns `rooms_occupied` and `room_revenue`.
+    """
+    groups = groups.loc[groups['nights'] > 0]
+    if groups.empty:
+        return pd.DataFrame({'hotel': pd.Series(dtype=object), 'stay_date': pd.Series(dtype='datetime64[ns]'),
+                             'rooms_occupied': pd.Series(dtype=np.int64), 'room_revenue': pd.Series(dtype=float)})
+
+    hotel_codes, hotel_names = pd.factorize(groups['hotel'].astype(str), sort=True)
+    arrival_dates = pd.to_datetime(groups['arrival_date'])
+    first_night = arrival_dates.min()
+    check_in = (arrival_dates - first_night).dt.days.to_numpy()
+    check_out = check_in + groups['nights'].to_numpy(dtype=np.int64)
+
+    # One difference array per hotel, flattened: position = hotel * number of days + day
+    n_days = int(check_out.max()) + 1
+    n_cells = len(hotel_names) * n_days
+    starts = hotel_codes * n_days + check_in
+    ends = hotel_codes * n_days + check_out
+    bookings = groups['bookings'].to_numpy(dtype=float)
+    adr = groups['adr_sum'].to_numpy(dtype=float)
+
+    room_deltas = (np.bincount(starts, weights=bookings, minlength=n_cells) -
+                   np.bincount(ends, weights=bookings, minlength=n_cells)).round().astype(np.int64)
+    revenue_deltas = (np.bincount(starts, weights=adr, minlength=n_cells) -
+                      np.bincount(ends, weights=adr, minlength=n_cells))
+
+    # The running sum of the differences gives the rooms and revenue of every night
+    rooms = np.cumsum(room_deltas.reshape(len(hotel_names), n_days), axis=1)[:, :-1]
+    revenue = np.cumsum(revenue_deltas.reshape(len(hotel_names), n_days), axis=1)[:, :-1]
+
+    calendar_nights = pd.date_range(first_night, periods=n_days - 1, freq='D')
+    return pd.DataFrame({
+        'hotel': np.repeat(np.asarray(hotel_names), n_days - 1),
+        'stay_date': np.tile(calendar_nights, len(hotel_names)),
+        'rooms_occupied': rooms.ravel(),
+        'room_revenue': revenue.ravel(),
+    })
+
+
+def merge_stay_night_totals(*totals):
+    # Nightly totals of separate chunks of bookings add up night by night, on a calendar without gaps
+    merged = pd.concat(totals, ignore_index=True)
+    merged = merged.groupby(['hotel', 'stay_date'])[['rooms_occupied', 'room_revenue']].sum()
+    if merged.empty:
+        return merged.reset_index()
+    calendar = pd.MultiIndex.from_product(
+        [merged.index.levels[0], pd.date_range(merged.index.levels[1].min(), merged.index.levels[1].max(), freq='D')],
+        names=['hotel', 'stay_date'])
+    return merged.reindex(calendar, fill_value=0).reset_index()
+
+
+def stay_night_kpis(dataframe, hotel_rooms=None):
+    """
+    This function derives the nightly occupancy KPIs per hotel and for both hotels together from the bookings. See
+    `occupancy_kpis` for the KPIs and the capacity used.
+
+    Args:
+    - dataframe (pandas.DataFrame): The dashboard data (one row per booking).
+    - hotel_rooms (dict, optional): The number of rooms of each hotel, e.g. {'City Hotel': 300}.
+
+    Returns:
+    - pandas.DataFrame: One row per hotel and night with the occupancy KPIs.
+    """
+    return occupancy_kpis(stay_night_totals(dataframe), hotel_rooms)
+
+
+def occupancy_kpis(nightly, hotel_rooms=None):
+    """
+    This function derives the nightly occupancy KPIs per hotel and for both hotels together: rooms occupied, room
+    revenue, ADR of the occupied rooms, occupancy and RevPAR (room revenue per available room).
+
+    The dataset does not contain the number of rooms of each hotel. If `hotel_rooms` is not given, the highest number
+    of rooms occupied on any night is used as the capacity of the hotel, so occupancy and RevPAR are relative to the
+    busiest night.
+
+    Args:
+    - nightly (pandas.DataFrame): The nightly totals, as returned by `stay_night_totals`.
+    - hotel_rooms (dict, optional): The number of rooms of each hotel, e.g. {'City Hotel': 300}.
+
+    Returns:
+    - pandas.DataFrame: One row per hotel and night with the occupancy KPIs.
+    """
+    nightly = nightly.copy()
+
+    if hotel_rooms is None:
+        hotel_rooms = nightly.groupby('hotel')['rooms_occupied'].max().to_dict()
+    nightly['rooms_available'] = nightly['hotel'].map(hotel_rooms)
+
+    # Add the combined figures of both hotels for every night
+    combined = nightly.groupby('stay_date', as_index=False)[['rooms_occupied', 'room_revenue', 'rooms_available']].sum()
+    combined.insert(0, 'hotel', all_hotels_label)
+    nightly = pd.concat([nightly, combined], ignore_index=True)
+
+    occupied = nightly['rooms_occupied'].where(nightly['rooms_occupied'] > 0)
+    nightly['adr'] = (nightly['room_revenue'] / occupied).round(2)
+    nightly['occupancy'] = (100 * nightly['rooms_occupied'] / nightly['rooms_available']).round(2)
+    nightly['revpar'] = (nightly['room_revenue'] / nightly['rooms_available']).round(2)
+    nightly['room_revenue'] = nightly['room_revenue'].round(2)
+    return nightly
@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import calendar
 
 from cleaning import month_components_calculation, day_components_calculation
@@ -14,6 +13,8 @@ def plot_circular_month(dataframe, month_columns):
         dataframe (pd.DataFrame): The DataFrame containing the cyclical components.
         month_columns (list): List of month column names for which cyclical encoding was done.
     """
+    import matplotlib.pyplot as plt
+
     for col in month_columns:
         # Get the x_comp and y_comp columns for each month column
         x_comp_col = f'x_comp_{col}'
@@ -48,6 +49,8 @@ def plot_circular_day(dataframe, day_columns):
         dataframe (pd.DataFrame): The DataFrame containing the cyclical components.
         day_columns (list): List of day column names for which cyclical encoding was done.
     """
+    import matplotlib.pyplot as plt
+
     for col in day_columns:
         # Get the x_comp and y_comp columns for each day column
         x_comp_col = f'x_comp_{col}'
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules of the project live in its root directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def bookings():
+    # Synthetic dashboard data with the columns read by the KPI code
+    rng = np.random.default_rng(0)
+    n = 2000
+    return pd.DataFrame({
+        'hotel': rng.choice(['City Hotel', 'Resort Hotel'], n),
+        'arrival_date': pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 120, n), unit='D'),
+        'is_canceled': rng.integers(0, 2, n),
+        'previous_cancellations': rng.integers(0, 3, n),
+        'adr': rng.gamma(2.0, 60.0, n).round(2),
+        'lead_time': rng.integers(0, 400, n),
+        'adults': rng.integers(1, 4, n),
+        'total_kids': rng.integers(0, 3, n),
+        'stays_in_week_nights': rng.integers(0, 6, n),
+        'stays_in_weekend_nights': rng.integers(0, 3, n),
+        'market_segment': rng.choice(['Online TA', 'Offline TA/TO', 'Direct', 'Groups'], n),
+        'country': rng.choice([f'C{i:03d}' for i in range(300)], n),
+    })
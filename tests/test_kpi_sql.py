@@ -0,0 +1,35 @@
+from sqlalchemy import create_engine
+
+from kpi_accumulators import kpi_totals, finalize_kpis, finalize_market_segments
+from kpi_sql import verify_sql_kpis
+
+
+def test_sql_kpis_match_pandas_on_sqlite(bookings):
+    # SQLite stands in for PostgreSQL: the overall row is computed with UNION ALL instead of ROLLUP
+    engine = create_engine('sqlite://')
+    bookings.to_sql('dashboard_data', engine, index=False)
+    totals = kpi_totals(bookings)
+    expected = {
+        'kpis': finalize_kpis(totals['hotels']),
+        'market_segments': finalize_market_segments(totals['segments']),
+        'daily': totals['daily'],
+    }
+
+    differences = verify_sql_kpis(engine, expected)
+
+    assert differences.empty, differences.to_string()
+
+
+def test_sql_kpis_report_a_changed_table(bookings):
+    engine = create_engine('sqlite://')
+    bookings.to_sql('dashboard_data', engine, index=False)
+    totals = kpi_totals(bookings.iloc[1:])
+    expected = {
+        'kpis': finalize_kpis(totals['hotels']),
+        'market_segments': finalize_market_segments(totals['segments']),
+        'daily': totals['daily'],
+    }
+
+    differences = verify_sql_kpis(engine, expected)
+
+    assert set(differences['table']) == {'kpis', 'market_segments', 'daily'}
@@ -0,0 +1,27 @@
+import numpy as np
+
+from results import threshold_sweep, confusion_counts
+
+
+def test_threshold_sweep_matches_thresholding_each_value():
+    rng = np.random.default_rng(2)
+    y_test = rng.integers(0, 2, 500)
+    y_proba = np.clip(0.3 * y_test + rng.random(500) * 0.7, 0, 1).round(2)
+    thresholds = [0.0, 0.25, 0.5, 0.75, 1.0]
+
+    sweep = threshold_sweep(y_test, y_proba, thresholds)
+
+    assert list(sweep['Threshold']) == thresholds
+    for i, threshold in enumerate(thresholds):
+        tn, fp, fn, tp = confusion_counts(y_test, (y_proba >= threshold).astype(int)[np.newaxis, :])
+        assert (sweep.loc[i, ['TN', 'FP', 'FN', 'TP']].to_numpy() == [tn[0], fp[0], fn[0], tp[0]]).all()
+
+
+def test_threshold_sweep_accepts_predict_proba_output():
+    y_test = np.array([0, 1, 1, 0])
+    y_proba = np.array([0.1, 0.8, 0.6, 0.4])
+
+    sweep = threshold_sweep(y_test, np.column_stack([1 - y_proba, y_proba]))
+
+    assert list(sweep['Threshold']) == [0.8, 0.6, 0.4, 0.1]
+    assert sweep.loc[sweep['Threshold'] == 0.6, 'Recall'].item() == 1.0
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from dictionaries import all_hotels_label
+from sketches import (
+    quantile_sketch, sketch_quantile, distinct_sketch, sketch_distinct_count, relative_accuracy,
+    build_partition_sketches, merge_partition_sketches, sketch_summary
+)
+
+
+def test_quantiles_are_within_the_relative_accuracy():
+    values = np.random.default_rng(1).lognormal(4, 1, 10_000)
+    sketch = quantile_sketch(values)
+
+    for q in (0.1, 0.5, 0.9, 0.99):
+        exact = np.quantile(values, q, method='lower')
+        assert abs(sketch_quantile(sketch, q) - exact) <= 2 * relative_accuracy * exact
+
+
+def test_distinct_count_is_close():
+    values = np.arange(5000).astype(str)
+
+    estimate = sketch_distinct_count(distinct_sketch(np.concatenate([values, values])))
+
+    assert abs(estimate - 5000) / 5000 < 0.05
+
+
+def test_merged_chunks_equal_one_pass(bookings):
+    merged = merge_partition_sketches(build_partition_sketches(bookings.iloc[:700]),
+                                      build_partition_sketches(bookings.iloc[700:]))
+    whole = build_partition_sketches(bookings)
+
+    assert merged.keys() == whole.keys()
+    for partition, sketches in whole.items():
+        for column, sketch in sketches.items():
+            np.testing.assert_array_equal(merged[partition][column], sketch)
+
+
+def test_sketch_summary_groups(bookings):
+    partition_sketches = build_partition_sketches(bookings)
+
+    assert list(sketch_summary(partition_sketches, 'all')['hotel']) == [all_hotels_label]
+    assert list(sketch_summary(partition_sketches)['hotel']) == ['City Hotel', 'Resort Hotel']
+    assert len(sketch_summary(partition_sketches, 'hotel_period')) == len(partition_sketches)
+    empty = sketch_summary({})
+    assert empty.empty and list(empty.columns) == list(sketch_summary(partition_sketches).columns)
+
+
+def test_only_the_given_months_are_sketched(bookings):
+    partition_sketches = build_partition_sketches(bookings, months=['2023-02'])
+
+    assert {period for _, period in partition_sketches} == {'2023-02'}
+    assert build_partition_sketches(bookings, months=['1999-01']) == {}
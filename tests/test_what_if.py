@@ -0,0 +1,31 @@
+import numpy as np
+
+from kpi_accumulators import booking_totals, hotel_total_columns
+from what_if import what_if_data, threshold_totals
+from dictionaries import all_hotels_label
+
+
+def test_threshold_totals_match_filtering_every_scenario(bookings):
+    data = what_if_data(bookings)
+    adr_thresholds, lead_time_thresholds = [50, 120, 1000], [30, 200, 365]
+
+    result = threshold_totals(data, adr_thresholds, lead_time_thresholds).set_index(
+        ['hotel', 'adr_threshold', 'lead_time_threshold'])
+
+    assert len(result) == 3 * len(adr_thresholds) * len(lead_time_thresholds)
+    for adr_threshold in adr_thresholds:
+        for lead_time_threshold in lead_time_thresholds:
+            kept = bookings.loc[(bookings['adr'] < adr_threshold) & (bookings['lead_time'] < lead_time_threshold)]
+            expected = booking_totals(kept).groupby('hotel').sum()
+            expected.loc[all_hotels_label] = expected.sum()
+            for hotel, row in expected.iterrows():
+                actual = result.loc[(hotel, adr_threshold, lead_time_threshold), hotel_total_columns]
+                np.testing.assert_allclose(actual.to_numpy(dtype=float), row[hotel_total_columns].to_numpy(float))
+
+
+def test_threshold_totals_remove_negative_adr(bookings):
+    data = what_if_data(bookings.assign(adr=-1.0))
+
+    result = threshold_totals(data, [1000], [1000])
+
+    assert (result['bookings'] == 0).all()
@@ -0,0 +1,246 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Largest deviation allowed between a cyclical component and its recomputed value, and from the unit circle
+component_tolerance = 1e-9
+
+# Number of days of every month in a common year (February gets a 29th day in leap years)
+month_lengths = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+# Columns of the model data that hold floats, every other column must have an integer dtype
+float_columns = ['adr', 'x_comp_arrival_date_month', 'y_comp_arrival_date_month', 'x_comp_arrival_date_day_of_month',
+                 'y_comp_arrival_date_day_of_month']
+
+
+def days_in_month(years, months):
+    """
+    This function returns the number of days of every (year, month) pair without a per-row call, using the leap year
+    rule of `cleaning.day_components_calculation` (divisible by 4, except centuries not divisible by 400).
+
+    Args:
+    - years (array-like): The years.
+    - months (array-like): The months (1-12).
+
+    Returns:
+    - numpy.ndarray: The number of days of each month.
+    """
+    years = np.asarray(years, dtype=np.int64)
+    months = np.asarray(months, dtype=np.int64)
+    is_leap_year = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    return month_lengths[np.clip(months, 1, 12) - 1] + ((months == 2) & is_leap_year)
+
+
+def check_components(dataframe, columns):
+    """
+    This function checks the cyclical components `x_comp_<column>` and `y_comp_<column>` of every column: they must
+    exist, hold no NaN, lie in [-1, 1] and, as cosine and sine of the same angle, lie on the unit circle.
+
+    Args:
+    - dataframe (pandas.DataFrame): The dataframe holding the components.
+    - columns (list): The encoded columns, e.g. ['arrival_date_month'].
+
+    Returns:
+    - list: The problems found (empty if the components are valid).
+    """
+    problems = []
+    for column in columns:
+        names = [f'x_comp_{column}', f'y_comp_{column}']
+        missing = [name for name in names if name not in dataframe.columns]
+        if missing:
+            problems.append(f"missing component columns: {missing}")
+            continue
+        x, y = (dataframe[name].to_numpy(dtype=float) for name in names)
+        if np.isnan(x).any() or np.isnan(y).any():
+            problems.append(f"{column}: the components contain NaN values")
+            continue
+        if (np.abs(x) > 1).any() or (np.abs(y) > 1).any():
+            problems.append(f"{column}: components outside [-1, 1]")
+        off_circle = np.abs(x * x + y * y - 1) > component_tolerance
+        if off_circle.any():
+            problems.append(f"{column}: {off_circle.sum()} rows with components that are not on the unit circle")
+    return problems
+
+
+def check_date_components(dataframe, year_column='arrival_date_year', month_column='arrival_date_month',
+                          day_column='arrival_date_day_of_month'):
+    """
+    This function checks the date columns and their cyclical encoding (the invariants of
+    `testing.test_month_components_calculation` and `testing.test_day_components_calculation`) with a few vectorized
+    reductions: the months lie in 1-12, every day exists in its month (given leap years) and the components match
+    the encoding of `cleaning.month_components_calculation` and `cleaning.day_components_calculation`.
+
+    Args:
+    - dataframe (pandas.DataFrame): The dataframe holding the integer date columns and their components.
+    - year_column (str): The name of the year column.
+    - month_column (str): The name of the month column (1-12).
+    - day_column (str): The name of the day of month column.
+
+    Returns:
+    - list: The problems found (empty if the date columns and components are valid).
+    """
+    problems = check_components(dataframe, [month_column, day_column])
+    problems += check_integer_dtypes(dataframe, [year_column, month_column, day_column])
+    if problems:
+        return problems
+
+    years, months, days = (dataframe[column].to_numpy() for column in [year_column, month_column, day_column])
+    invalid_months = (months < 1) | (months > 12)
+    if invalid_months.any():
+        problems.append(f"{month_column}: {invalid_months.sum()} rows outside 1-12")
+    lengths = days_in_month(years, months)
+    invalid_days = (days < 1) | (days > lengths)
+    if invalid_days.any():
+        first = np.flatnonzero(invalid_days)[0]
+        problems.append(f"{day_column}: {invalid_days.sum()} rows with a day that does not exist in its month, "
+                        f"e.g. {years[first]}-{months[first]:02d}-{days[first]:02d}")
+
+    for column, angles in [(month_column, 2 * np.pi * months / 12), (day_column, 2 * np.pi * days / lengths)]:
+        deviation = np.maximum(np.abs(dataframe[f'x_comp_{column}'].to_numpy() - np.cos(angles)),
+                               np.abs(dataframe[f'y_comp_{column}'].to_numpy() - np.sin(angles)))
+        if (deviation > component_tolerance).any():
+            problems.append(f"{column}: {(deviation > component_tolerance).sum()} rows whose components do not "
+                            f"encode their value")
+    return problems
+
+
+def check_no_nans(dataframe):
+    # Columns holding NaN values, with their count
+    counts = dataframe.isna().sum()
+    return [f"{column}: {count} NaN values" for column, count in counts[counts > 0].items()]
+
+
+def check_integer_dtypes(dataframe, columns):
+    # Columns that should hold integers but were stored with another dtype (e.g. floats after a NaN slipped in)
+    return [f"{column}: dtype {dataframe[column].dtype} instead of an integer dtype" for column in columns
+            if column in dataframe.columns and not pd.api.types.is_integer_dtype(dataframe[column].dtype)]
+
+
+def expected_one_hot_columns(dataframe, categories):
+    """
+    This function lists the columns that `pd.get_dummies(drop_first=True)` must create from the categorical columns
+    of a dataframe: one column per category level, except the first.
+
+    Args:
+    - dataframe (pandas.DataFrame): The dataframe before the encoding.
+    - categories (list): The columns to be one-hot encoded.
+
+    Returns:
+    - list: The names of the one-hot columns, in the order of `pd.get_dummies`.
+    """
+    columns = []
+    for category in categories:
+        series = dataframe[category]
+        levels = series.cat.categories if isinstance(series.dtype, pd.CategoricalDtype) else np.sort(series.unique())
+        columns += [f'{category}_{level}' for level in levels[1:]]
+    return columns
+
+
+def check_one_hot_schema(dataframe, categories, expected_columns):
+    """
+    This function checks the one-hot encoded columns of the model data: every expected column exists and no other
+    column of an encoded category does, the columns are integers holding only 0 and 1, and at most one level of
+    every category is set on a row (none for the dropped first level).
+
+    Args:
+    - dataframe (pandas.DataFrame): The encoded model data.
+    - categories (list): The one-hot encoded columns.
+    - expected_columns (list): The one-hot columns the data must have, e.g. from `expected_one_hot_columns`.
+
+    Returns:
+    - list: The problems found (empty if the schema is as expected).
+    """
+    problems = []
+    encoded = [column for column in dataframe.columns if any(column.startswith(f'{category}_')
+                                                             for category in categories)]
+    missing = [column for column in expected_columns if column not in dataframe.columns]
+    unexpected = [column for column in encoded if column not in expected_columns]
+    if missing:
+        problems.append(f"missing one-hot columns: {missing}")
+    if unexpected:
+        problems.append(f"unexpected one-hot columns: {unexpected}")
+
+    present = [column for column in expected_columns if column in dataframe.columns]
+    problems += check_integer_dtypes(dataframe, present)
+    # Column-wise min/max and sums avoid copying the one-hot columns into one wide array
+    not_binary = [column for column in present if dataframe[column].min() < 0 or dataframe[column].max() > 1]
+    if not_binary:
+        problems.append(f"one-hot columns with values other than 0 and 1: {not_binary}")
+
+    for category in categories:
+        levels = [dataframe[column].to_numpy() for column in present if column.startswith(f'{category}_')]
+        if levels:
+            several = (sum(levels) > 1).sum()
+            if several:
+                problems.append(f"{category}: {several} rows with more than one level set")
+    return problems
+
+
+def check_model_data(dataframe, categories, expected_columns):
+    """
+    This function checks the model data (logreg_rf_data) before it is published: no NaN, integer dtypes for every
+    column except `float_columns`, valid cyclical components and the expected one-hot schema.
+
+    Args:
+    - dataframe (pandas.DataFrame): The encoded model data.
+    - categories (list): The one-hot encoded columns.
+    - expected_columns (list): The one-hot columns the data must have.
+
+    Returns:
+    - list: The problems found (empty if the model data is valid).
+    """
+    problems = check_no_nans(dataframe)
+    problems += check_integer_dtypes(dataframe, [column for column in dataframe.columns
+                                                 if column not in float_columns])
+    problems += check_components(dataframe, ['arrival_date_month', 'arrival_date_day_of_month'])
+    problems += check_one_hot_schema(dataframe, categories, expected_columns)
+    return problems
+
+
+def load_schema(path):
+    # The one-hot columns of the last validated model data, None before the first validation
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_schema(columns, path):
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(list(columns), f, indent=2)
+    os.replace(temporary_path, path)
+
+
+def report_validation(stage, problems, rows, seconds):
+    """
+    This function reports the outcome and the cost of a validation, whether it found problems or not.
+
+    Args:
+    - stage (str): The name of the validated output, used in the messages.
+    - problems (list): The problems found by the checks.
+    - rows (int): The number of validated rows.
+    - seconds (float): The time spent on the checks.
+    """
+    cost = f"{rows} rows in {seconds * 1000:.1f} ms ({seconds * 1000 / max(rows, 1) * 1e6:.0f} ms per million rows)"
+    if problems:
+        print(f"Validation of {stage} found {len(problems)} problems: {cost}")
+    else:
+        print(f"Validated {stage}: {cost}")
+
+
+def raise_for_problems(stage, problems):
+    """
+    This function ends the run with every problem a validation found, listed at once.
+
+    Args:
+    - stage (str): The name of the validated output, used in the message.
+    - problems (list): The problems found by the checks.
+
+    Raises:
+    - ValueError: If any problem was found.
+    """
+    if problems:
+        raise ValueError(f"Validation of {stage} failed:\n- " + "\n- ".join(problems))
@@ -0,0 +1,147 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from dictionaries import hotels, all_hotels_label
+from kpi_accumulators import booking_totals, hotel_total_columns
+
+# Outlier thresholds of preprocessing.py: bookings are kept if adr < adr threshold and lead_time < lead_time threshold
+current_thresholds = {'adr': 5400, 'lead_time': 640}
+
+# File where preprocessing.py keeps the cleaned dashboard bookings before the outlier removal
+what_if_file = 'what_if_data.parquet'
+
+# KPIs of a scenario, as in hotel_kpis.csv: (name, numerator, denominator or None for a total, unit)
+what_if_kpis = [
+    ('Total Bookings', 'bookings', None, 1),
+    ('Cancellation Rate (%)', 'cancellations', 'bookings', 100),
+    ('Previous Cancellation Rate (%)', 'previous_cancellations', 'bookings', 100),
+    ('Total Revenue (€)', 'adr_sum', None, 1),
+    ('ADR (€)', 'adr_sum', 'bookings', 1),
+    ('Average Lead Time (days)', 'lead_time_sum', 'bookings', 1),
+    ('Revenue per Guest (€)', 'adr_sum', 'guests', 1),
+    ('Length of Stay (days)', 'nights', 'bookings', 1),
+]
+
+
+def what_if_data(dataframe):
+    """
+    This function reduces the cleaned dashboard bookings, before the outlier removal, to what the what-if analysis
+    needs: the hotel, the two thresholded values and the contribution of the booking to every KPI total.
+
+    Args:
+    - dataframe (pandas.DataFrame): The cleaned dashboard data before the outlier removal.
+
+    Returns:
+    - pandas.DataFrame: One row per booking with `hotel`, `adr`, `lead_time` and the `hotel_total_columns`.
+    """
+    data = booking_totals(dataframe)
+    data.insert(1, 'adr', dataframe['adr'].to_numpy(dtype=float))
+    data.insert(2, 'lead_time', dataframe['lead_time'].to_numpy(dtype=float))
+    return data.reset_index(drop=True)
+
+
+def threshold_totals(data, adr_thresholds, lead_time_thresholds):
+    """
+    This function computes the KPI totals of every hotel for every pair of candidate thresholds in one vectorized
+    pass, without filtering the bookings once per scenario. Each booking is located once among the sorted thresholds
+    of each column: it is kept by every adr threshold above its adr and every lead_time threshold above its lead
+    time. Its totals are added to that cell of a (hotel, adr, lead_time) grid, and cumulative sums along both
+    threshold axes then give the totals of all the bookings kept by each pair. The cost is one binary search per
+    booking and column plus the size of the grid, whatever the number of scenarios.
+
+    Bookings with a negative adr are always removed, as in preprocessing.py.
+
+    Args:
+    - data (pandas.DataFrame): The output of `what_if_data`.
+    - adr_thresholds (array-like): The candidate adr thresholds.
+    - lead_time_thresholds (array-like): The candidate lead_time thresholds.
+
+    Returns:
+    - pandas.DataFrame: One row per hotel (including 'All Hotels') and pair of thresholds, with the columns `hotel`,
+      `adr_threshold`, `lead_time_threshold` and the `hotel_total_columns`.
+    """
+    adr_thresholds = np.unique(np.asarray(adr_thresholds, dtype=float))
+    lead_time_thresholds = np.unique(np.asarray(lead_time_thresholds, dtype=float))
+    data = data.loc[data['adr'] >= 0]
+
+    # Index of the smallest threshold that keeps the booking (len(thresholds) if none does)
+    adr_positions = np.searchsorted(adr_thresholds, data['adr'].to_numpy(), side='right')
+    lead_time_positions = np.searchsorted(lead_time_thresholds, data['lead_time'].to_numpy(), side='right')
+    hotel_codes = pd.Categorical(data['hotel'], categories=hotels).codes
+    if (hotel_codes < 0).any():
+        raise ValueError(f"Unknown hotels: {sorted(set(data['hotel']) - set(hotels))}")
+
+    n_adr, n_lead_time = len(adr_thresholds) + 1, len(lead_time_thresholds) + 1
+    cells = (hotel_codes * n_adr + adr_positions) * n_lead_time + lead_time_positions
+    grid_shape = (len(hotels), n_adr, n_lead_time)
+
+    totals = {}
+    for column in hotel_total_columns:
+        grid = np.bincount(cells, weights=data[column].to_numpy(dtype=float),
+                           minlength=np.prod(grid_shape)).reshape(grid_shape)
+        # Cumulative sums over both threshold axes; the last cell of each axis (kept by no threshold) is dropped
+        kept = grid.cumsum(axis=1).cumsum(axis=2)[:, :-1, :-1]
+        totals[column] = np.concatenate([kept.sum(axis=0, keepdims=True), kept]).ravel()
+
+    scenario_hotels, adr_index, lead_time_index = np.meshgrid(
+        np.arange(len(hotels) + 1), np.arange(len(adr_thresholds)), np.arange(len(lead_time_thresholds)),
+        indexing='ij')
+    result = pd.DataFrame({
+        'hotel': np.array([all_hotels_label] + hotels)[scenario_hotels.ravel()],
+        'adr_threshold': adr_thresholds[adr_index.ravel()],
+        'lead_time_threshold': lead_time_thresholds[lead_time_index.ravel()],
+    })
+    for column in hotel_total_columns:
+        result[column] = totals[column]
+    return result
+
+
+def scenario_kpis(data, adr_thresholds, lead_time_thresholds):
+    """
+    This function returns the KPIs of hotel_kpis.csv for every hotel (including 'All Hotels') and every pair of
+    candidate outlier thresholds, with the number of bookings each scenario removes compared to the current
+    thresholds of preprocessing.py (negative if it keeps more bookings).
+
+    Args:
+    - data (pandas.DataFrame): The output of `what_if_data`.
+    - adr_thresholds (array-like): The candidate adr thresholds.
+    - lead_time_thresholds (array-like): The candidate lead_time thresholds.
+
+    Returns:
+    - pandas.DataFrame: One row per hotel and pair of thresholds, with the KPIs rounded as in hotel_kpis.csv.
+    """
+    totals = threshold_totals(data, adr_thresholds, lead_time_thresholds)
+    current = threshold_totals(data, [current_thresholds['adr']], [current_thresholds['lead_time']])
+    current_bookings = totals['hotel'].map(current.set_index('hotel')['bookings'])
+
+    kpis = totals[['hotel', 'adr_threshold', 'lead_time_threshold']].copy()
+    for name, numerator, denominator, unit in what_if_kpis:
+        values = totals[numerator].to_numpy(dtype=float)
+        if denominator is not None:
+            denominators = totals[denominator].to_numpy(dtype=float)
+            values = np.divide(values, denominators, out=np.full_like(values, np.nan), where=denominators != 0)
+        kpis[name] = np.round(values * unit, 2)
+    kpis['Total Bookings'] = kpis['Total Bookings'].astype(int)
+    kpis['Removed Bookings (vs. current)'] = (current_bookings - totals['bookings']).astype(int)
+    return kpis
+
+
+if __name__ == '__main__':
+    # Usage: python what_if.py --adr 300 500 1000 5400 --lead-time 365 500 640
+    # writes the KPIs of every pair of thresholds to what_if_kpis.csv
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="KPIs of the dashboard data under other outlier thresholds.")
+    parser.add_argument('--adr', type=float, nargs='+', default=[current_thresholds['adr']],
+                        help="candidate adr thresholds")
+    parser.add_argument('--lead-time', type=float, nargs='+', default=[current_thresholds['lead_time']],
+                        help="candidate lead_time thresholds")
+    parser.add_argument('--data', default=what_if_file, help="the bookings saved by preprocessing.py")
+    parser.add_argument('--output', default='what_if_kpis.csv', help="the CSV file to write")
+    args = parser.parse_args()
+
+    what_if_df = scenario_kpis(pd.read_parquet(args.data), args.adr, args.lead_time)
+    what_if_df.to_csv(args.output, index=False)
+    print(f"Wrote {len(what_if_df)} scenarios to {args.output}")